@@ -0,0 +1,251 @@
+# admission_control.py
+#
+# Admission layer in front of module dispatch: token-bucket rate limits per
+# user and per module, a global cap on concurrent upstream calls, and
+# weighted fair queuing between priority classes for requests waiting on a
+# slot.
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is refused by the admission layer."""
+
+    def __init__(self, reason, retry_after=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, tokens=1):
+        """Returns 0 if tokens are available now, else seconds until they would be. Takes nothing."""
+        self._refill(self.clock())
+        if self.tokens >= tokens:
+            return 0
+        return (tokens - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def try_acquire(self, tokens=1):
+        """Takes tokens if available. Returns 0 on success, else seconds until they would be."""
+        wait = self.wait_time(tokens)
+        if not wait:
+            self.tokens -= tokens
+        return wait
+
+    def is_full(self):
+        self._refill(self.clock())
+        return self.tokens >= self.capacity
+
+
+class _Waiter:
+    def __init__(self, notify):
+        self.notify = notify
+        self.granted = False
+        self.cancelled = False
+
+
+class AdmissionController:
+    """
+    Decides whether a request may proceed to a module.
+
+    Args:
+        max_concurrent: Global cap on concurrently running upstream calls.
+        user_rate, user_burst: Token bucket refill rate (requests/s) and size per user.
+        module_limits: {module_name: (rate, burst)} token buckets per module.
+        class_weights: Relative share of freed slots per priority class.
+        queue_timeouts: Default seconds a request of each class may wait for a slot.
+        max_queue: Requests waiting beyond this are rejected immediately.
+    """
+
+    def __init__(self, max_concurrent=16, user_rate=1.0, user_burst=10, module_limits=None,
+                 class_weights=None, queue_timeouts=None, max_queue=1000,
+                 max_tracked_users=10000, clock=time.monotonic):
+        self.max_concurrent = max_concurrent
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.class_weights = class_weights or {INTERACTIVE: 8, BATCH: 1}
+        self.queue_timeouts = queue_timeouts or {INTERACTIVE: 2.0, BATCH: 30.0}
+        self.max_queue = max_queue
+        self.max_tracked_users = max_tracked_users
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._user_buckets = {}
+        self._module_buckets = {
+            name: TokenBucket(rate, burst, clock) for name, (rate, burst) in (module_limits or {}).items()
+        }
+        self._active = 0
+        self._queue = []  # heap of (finish_tag, seq, waiter)
+        self._queued = 0
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish = {}
+        self._stats = {"admitted": 0, "queued": 0, "rejected": {}}
+
+    # --- Rate limiting -------------------------------------------------
+
+    def check_rate(self, user_id, module_name):
+        """
+        Charges one request to the user's and the module's token buckets.
+        Nothing is charged unless both have a token, so a request the module
+        limit turns away does not use up the user's allowance.
+
+        Raises:
+            AdmissionRejected: If either bucket is empty.
+        """
+        with self._lock:
+            user_bucket = None
+            if user_id is not None:
+                user_bucket = self._user_buckets.get(user_id)
+                if user_bucket is None:
+                    if len(self._user_buckets) >= self.max_tracked_users:
+                        self._prune_user_buckets()
+                    user_bucket = TokenBucket(self.user_rate, self.user_burst, self.clock)
+                    self._user_buckets[user_id] = user_bucket
+                wait = user_bucket.wait_time()
+                if wait:
+                    self._reject("user_rate_limited", wait)
+            module_bucket = self._module_buckets.get(module_name)
+            if module_bucket is not None:
+                wait = module_bucket.wait_time()
+                if wait:
+                    self._reject("module_rate_limited", wait)
+                module_bucket.try_acquire()
+            if user_bucket is not None:
+                user_bucket.try_acquire()
+
+    def _prune_user_buckets(self):
+        # A full bucket carries no state worth keeping.
+        for user_id in [u for u, b in self._user_buckets.items() if b.is_full()]:
+            del self._user_buckets[user_id]
+
+    def _reject(self, reason, retry_after=None):
+        rejected = self._stats["rejected"]
+        rejected[reason] = rejected.get(reason, 0) + 1
+        raise AdmissionRejected(reason, retry_after)
+
+    # --- Concurrency slots ---------------------------------------------
+
+    def _try_enter(self, priority, waiter):
+        """Takes a slot now, or queues waiter. Returns True if a slot was taken. Caller holds the lock."""
+        if self._active < self.max_concurrent and not self._queued:
+            self._active += 1
+            self._stats["admitted"] += 1
+            return True
+        if self._queued >= self.max_queue:
+            self._reject("queue_full")
+        weight = self.class_weights.get(priority, 1)
+        start = max(self._virtual_time, self._last_finish.get(priority, 0.0))
+        finish = start + 1.0 / weight
+        self._last_finish[priority] = finish
+        heapq.heappush(self._queue, (finish, next(self._seq), waiter))
+        self._queued += 1
+        self._stats["queued"] += 1
+        return False
+
+    def _cancel(self, waiter):
+        """Withdraws a queued waiter. Returns False if it was granted a slot first."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            waiter.cancelled = True
+            self._queued -= 1
+            self._reject("deadline_exceeded")
+
+    def release(self):
+        """Frees a slot and hands it to the next queued request, if any."""
+        with self._lock:
+            while self._queue:
+                finish, _, waiter = heapq.heappop(self._queue)
+                if waiter.cancelled:
+                    continue
+                self._queued -= 1
+                self._virtual_time = finish
+                waiter.granted = True
+                self._stats["admitted"] += 1
+                waiter.notify()
+                return
+            self._active -= 1
+
+    def _timeout_for(self, priority, timeout):
+        return self.queue_timeouts.get(priority, self.queue_timeouts.get(INTERACTIVE, 2.0)) if timeout is None else timeout
+
+    @contextmanager
+    def slot(self, priority=INTERACTIVE, timeout=None):
+        """
+        Holds a concurrency slot for the duration of the block, waiting at most
+        timeout seconds (default: the class's queue timeout) for one.
+
+        Raises:
+            AdmissionRejected: If the queue is full or the wait times out.
+        """
+        event = threading.Event()
+        waiter = _Waiter(event.set)
+        with self._lock:
+            entered = self._try_enter(priority, waiter)
+        if not entered and not event.wait(self._timeout_for(priority, timeout)):
+            self._cancel(waiter)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def slot_async(self, priority=INTERACTIVE, timeout=None):
+        """Async counterpart of slot(); waiting does not block the event loop."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = _Waiter(notify)
+        with self._lock:
+            entered = self._try_enter(priority, waiter)
+        if not entered:
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self._timeout_for(priority, timeout))
+            except asyncio.TimeoutError:
+                self._cancel(waiter)
+            except asyncio.CancelledError:
+                with self._lock:
+                    granted = waiter.granted
+                    if not granted:
+                        waiter.cancelled = True
+                        self._queued -= 1
+                if granted:
+                    self.release()
+                raise
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": self._active,
+                "queue_depth": self._queued,
+                "admitted": self._stats["admitted"],
+                "queued": self._stats["queued"],
+                "rejected": dict(self._stats["rejected"]),
+            }
@@ -1,27 +1,318 @@
 # ai_coordinator.py
 
+import asyncio
 import logging
 import os
+import queue
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import nullcontext
 from dotenv import load_dotenv
-from text_to_speech import TextToSpeechModule  # Import the TextToSpeechModule
+from admission_control import AdmissionRejected, INTERACTIVE
+from cancellation import CancellationToken, RequestCancelled, check_cancelled
+from deadlines import DeadlineExceeded, deadline_after, run_in_thread, time_left
+from single_flight import SingleFlight, AsyncSingleFlight
+from session_context import SessionContextStore
+from scatter_gather import BranchResult, QuorumNotMet, merge_by_module, scatter
+
+def _create_tts_module():
+    # Imported here so google.cloud.texttospeech and playsound are only loaded
+    # when speech is actually used.
+    from text_to_speech import TextToSpeechModule
+    return TextToSpeechModule()
 
 class AICoordinator:
     def __init__(self):
         self.modules = {}  # Registry of modules
-        self.context = {}  # Shared context
+        self.module_factories = {}  # Modules to instantiate on first use
+        self._factory_lock = threading.Lock()
+        self.sessions = SessionContextStore()  # Global defaults plus per-session overrides
+        self.coalesced_modules = {}  # module_name -> context keys in the coalescing key
+        self._single_flight = SingleFlight()
+        self._async_single_flight = AsyncSingleFlight()
+        self._coalescing_stats = {}
+        self._cancellations = {}  # module_name -> requests cancelled while queued or running
+        self.module_timeouts = {}  # module_name -> default seconds for messages without a 'deadline'
+        self.max_overdue_calls = 16  # Per module; beyond this, new deadline-bound calls are refused
+        self._timeout_stats = {}  # module_name -> {"timeouts": n, "shed": m}
+        self._deadline_calls = {}  # module_name -> {future: deadline} for calls run on their own thread
+        self._stats_lock = threading.Lock()
+        self.admission = None  # Optional AdmissionController
         self.logger = logging.getLogger("ai_coordinator")
         load_dotenv()
         self.config = os.environ
         self.register_tts_module()  # Register TextToSpeechModule
 
     def register_module(self, module_name, module_instance):
+        self.module_factories.pop(module_name, None)
         self.modules[module_name] = module_instance
         self.logger.info(f"Module '{module_name}' registered.")
 
+    def register_module_factory(self, module_name, factory):
+        """
+        Registers a module that is only instantiated the first time it is used.
+
+        Args:
+            module_name: The name messages use to target the module.
+            factory: A zero-argument callable returning the module instance.
+        """
+        self.modules.pop(module_name, None)
+        self.module_factories[module_name] = factory
+        self.logger.info(f"Module factory '{module_name}' registered.")
+
     def register_tts_module(self):
-        """Registers the TextToSpeechModule."""
-        tts_module = TextToSpeechModule()
-        self.register_module("text_to_speech", tts_module)
+        """Registers the TextToSpeechModule (created lazily on first use)."""
+        self.register_module_factory("text_to_speech", _create_tts_module)
+
+    def has_module(self, module_name):
+        return module_name in self.modules or module_name in self.module_factories
+
+    def get_module(self, module_name):
+        """
+        Returns the module registered under module_name, instantiating it from
+        its factory on first use.
+
+        Returns:
+            The module instance, or None if no module or factory is registered.
+
+        Raises:
+            Any exception raised by the module's factory.
+        """
+        module = self.modules.get(module_name)
+        if module is not None:
+            return module
+        with self._factory_lock:
+            if module_name in self.modules:
+                return self.modules[module_name]
+            factory = self.module_factories.get(module_name)
+            if factory is None:
+                return None
+            module = factory()
+            self.modules[module_name] = module
+            del self.module_factories[module_name]
+            self.logger.info(f"Module '{module_name}' instantiated.")
+            return module
+
+    def warm_up(self, module_names=None, background=False):
+        """
+        Instantiates lazily registered modules ahead of their first request and
+        calls each module's optional warm_up() method.
+
+        Args:
+            module_names: Names to warm up; defaults to every registered module.
+            background: If True, warm up on a daemon thread and return it.
+
+        Returns:
+            The warm-up thread when background is True, otherwise None.
+        """
+        if background:
+            thread = threading.Thread(target=self.warm_up, args=(module_names,), daemon=True)
+            thread.start()
+            return thread
+        if module_names is None:
+            module_names = list(self.modules) + list(self.module_factories)
+        for module_name in module_names:
+            try:
+                module = self.get_module(module_name)
+                if hasattr(module, "warm_up"):
+                    module.warm_up()
+            except Exception as e:
+                self.logger.error(f"Warm-up failed for module '{module_name}': {e}")
+        return None
+
+    def set_admission_controller(self, controller):
+        """
+        Puts an AdmissionController in front of module dispatch. Messages may
+        then carry 'user_id', 'priority' ("interactive" or "batch") and
+        'queue_timeout' (seconds to wait for a free upstream slot). Requests
+        are rate limited per 'client_id' when given, else per 'user_id'; callers
+        that take user_id from an untrusted request body should set client_id
+        to an identity they have verified, such as the remote address.
+        """
+        self.admission = controller
+
+    def _check_admission(self, message):
+        if self.admission is not None:
+            client_id = message.get("client_id", message.get("user_id"))
+            self.admission.check_rate(client_id, message.get("target_module"))
+
+    @staticmethod
+    def _queue_timeout(message):
+        # Never wait for a slot past the request's deadline.
+        timeout, left = message.get("queue_timeout"), time_left(message.get("deadline"))
+        if left is None:
+            return timeout
+        return max(0.0, left) if timeout is None else max(0.0, min(timeout, left))
+
+    def _admission_slot(self, message):
+        if self.admission is None:
+            return nullcontext()
+        return self.admission.slot(message.get("priority", INTERACTIVE), self._queue_timeout(message))
+
+    def _admission_slot_async(self, message):
+        if self.admission is None:
+            return nullcontext()
+        return self.admission.slot_async(message.get("priority", INTERACTIVE), self._queue_timeout(message))
+
+    def _call_module(self, module, message):
+        with self._admission_slot(message):
+            check_cancelled(message)  # It may have been cancelled while queued for a slot
+            return module.handle_message(message, self._context_for(message))
+
+    def enable_coalescing(self, module_name, context_keys=("system_instruction",),
+                          message_keys=("message_type", "model_tier")):
+        """
+        Coalesces concurrent identical requests to a module into one upstream call.
+
+        Requests are identical when they share target module, content, the
+        values of message_keys and the values of context_keys. Only enable
+        this for modules whose responses are safe to share (not for side
+        effects such as TTS).
+        """
+        self.coalesced_modules[module_name] = (tuple(message_keys), tuple(context_keys))
+
+    def get_coalescing_stats(self):
+        """Returns {module_name: {"upstream_calls": n, "coalesced": m}}."""
+        with self._stats_lock:
+            return {name: dict(stats) for name, stats in self._coalescing_stats.items()}
+
+    def _coalescing_key(self, message):
+        target_module = message.get("target_module")
+        keys = self.coalesced_modules.get(target_module)
+        if keys is None:
+            return None
+        message_keys, context_keys = keys
+        context = self._context_for(message)
+        return (
+            target_module,
+            message.get("content"),
+            tuple(repr(message.get(key)) for key in message_keys),
+            tuple(repr(context.get(key)) for key in context_keys),
+        )
+
+    def _count_coalescing(self, module_name, shared):
+        with self._stats_lock:
+            stats = self._coalescing_stats.setdefault(module_name, {"upstream_calls": 0, "coalesced": 0})
+            stats["coalesced" if shared else "upstream_calls"] += 1
+
+    def _shared_message(self, message):
+        # A coalesced upstream call serves several callers, so no one caller's token or
+        # deadline may stop it; it only gets the module's default deadline.
+        shared = {key: value for key, value in message.items() if key not in ("cancel_token", "deadline")}
+        return self._with_deadline(shared)
+
+    def set_module_timeout(self, module_name, seconds):
+        """
+        Gives messages to module_name without their own 'deadline' one that
+        many seconds after dispatch. None removes the default.
+        """
+        if seconds is None:
+            self.module_timeouts.pop(module_name, None)
+        else:
+            self.module_timeouts[module_name] = seconds
+
+    def _with_deadline(self, message):
+        """
+        Returns message with its effective deadline and, when there is one, a
+        cancel token of its own (a child of the caller's), so the coordinator
+        can stop an overdue call without cancelling the caller's token.
+        """
+        deadline = message.get("deadline")
+        if deadline is None:
+            timeout = self.module_timeouts.get(message.get("target_module"))
+            if timeout is None:
+                return message
+            deadline = deadline_after(timeout)
+        return {**message, "deadline": deadline, "cancel_token": CancellationToken(parent=message.get("cancel_token"))}
+
+    def _count_timeout(self, module_name, key="timeouts"):
+        with self._stats_lock:
+            stats = self._timeout_stats.setdefault(module_name, {"timeouts": 0, "shed": 0})
+            stats[key] += 1
+
+    def _overdue_calls(self, module_name, now=None):
+        now = time.monotonic() if now is None else now
+        calls = self._deadline_calls.get(module_name, {})
+        return sum(1 for deadline in calls.values() if deadline <= now)
+
+    def get_timeout_stats(self):
+        """
+        Returns {module_name: {"timeouts": n, "shed": m, "overdue": k}}: requests
+        that missed their deadline, requests refused because too many calls
+        were still overdue, and calls still running past their deadline now.
+        """
+        with self._stats_lock:
+            names = set(self._timeout_stats) | set(self._deadline_calls)
+            return {
+                name: {**self._timeout_stats.get(name, {"timeouts": 0, "shed": 0}), "overdue": self._overdue_calls(name)}
+                for name in names
+            }
+
+    def _start_deadline_call(self, message, fn):
+        """Runs fn on its own thread, tracked until it finishes so overdue calls can be counted and capped."""
+        module_name = message.get("target_module")
+        deadline = message["deadline"]
+        with self._stats_lock:
+            if self._overdue_calls(module_name) >= self.max_overdue_calls:
+                self._timeout_stats.setdefault(module_name, {"timeouts": 0, "shed": 0})["shed"] += 1
+                raise AdmissionRejected(f"{module_name}_stalled")
+            future = run_in_thread(fn, name=f"{module_name}-call")
+            self._deadline_calls.setdefault(module_name, {})[future] = deadline
+
+        def finished(done):
+            with self._stats_lock:
+                calls = self._deadline_calls.get(module_name, {})
+                calls.pop(done, None)
+                if not calls:
+                    self._deadline_calls.pop(module_name, None)
+        future.add_done_callback(finished)
+        return future
+
+    def _overdue(self, message):
+        # Stop the abandoned call at its next checkpoint, then report the timeout.
+        message["cancel_token"].cancel("deadline exceeded")
+        return DeadlineExceeded(message.get("target_module"))
+
+    def _call_before_deadline(self, message, fn):
+        """Returns fn(), or raises DeadlineExceeded as soon as the message's deadline passes."""
+        if message.get("deadline") is None:
+            return fn()
+        if time_left(message["deadline"]) <= 0:
+            raise self._overdue(message)
+        future = self._start_deadline_call(message, fn)
+        try:
+            return future.result(timeout=max(0.0, time_left(message["deadline"])))
+        except DeadlineExceeded:
+            raise  # The module noticed first (DeadlineExceeded is also a TimeoutError)
+        except FutureTimeoutError:
+            raise self._overdue(message) from None
+
+    async def _await_before_deadline(self, message, awaitable):
+        if message.get("deadline") is None:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, timeout=max(0.0, time_left(message["deadline"])))
+        except DeadlineExceeded:
+            raise
+        except asyncio.TimeoutError:
+            raise self._overdue(message) from None
+
+    def _count_cancellation(self, module_name):
+        self.logger.info(f"Request to '{module_name}' cancelled.")
+        with self._stats_lock:
+            self._cancellations[module_name] = self._cancellations.get(module_name, 0) + 1
+
+    def _count_if_cancelled(self, module_name, caller_token):
+        # A caller that stops reading a stream early counts only if it did so because of its token.
+        # This must be the caller's token: a deadline-bound call's child token is cancelled on any close.
+        if caller_token is not None and caller_token.cancelled:
+            self._count_cancellation(module_name)
+
+    def get_cancellation_stats(self):
+        """Returns {module_name: number of requests cancelled while queued or running}."""
+        with self._stats_lock:
+            return dict(self._cancellations)
 
     def route_message(self, message):
         """
@@ -32,17 +323,52 @@ class AICoordinator:
                 - 'target_module': The name of the module to receive the message.
                 - 'message_type': The type of message or command.
                 - 'content': The actual content of the message.
+                - 'session_id': Optional; selects that session's context overrides.
+                - 'cancel_token': Optional CancellationToken; modules stop work
+                  at their next checkpoint once it is cancelled. Coalesced
+                  upstream calls are shared and ignore it.
+                - 'deadline': Optional time.monotonic() by which the response
+                  is needed; defaults to the module's timeout, if one is set.
+                  Modules use it to budget upstream calls. A call that runs
+                  past it is cancelled and left to finish on its own thread.
                 - (Other relevant data)
 
         Returns:
             The response from the module, or None if the module is not found or an error occurs.
+
+        Raises:
+            AdmissionRejected: If an admission controller is set and refuses the
+                request, or too many calls to the module are overdue.
+            RequestCancelled: If the message's cancel_token was cancelled.
+            DeadlineExceeded: If the deadline passed before the module answered.
         """
         target_module = message.get("target_module")
-        if target_module in self.modules:
+        if self.has_module(target_module):
             try:
-                module = self.modules[target_module]
-                response = module.handle_message(message, self.context)
-                return response
+                module = self.get_module(target_module)
+                check_cancelled(message)
+                message = self._with_deadline(message)
+                self._check_admission(message)
+                key = self._coalescing_key(message)
+                if key is None:
+                    return self._call_before_deadline(message, lambda: self._call_module(module, message))
+                shared_message = self._shared_message(message)
+
+                def coalesced_call():
+                    response, shared = self._single_flight.do(key, lambda: self._call_module(module, shared_message))
+                    self._count_coalescing(target_module, shared)
+                    return response
+                return self._call_before_deadline(message, coalesced_call)
+            except AdmissionRejected as e:
+                self.logger.warning(f"Request to '{target_module}' rejected: {e.reason}")
+                raise
+            except RequestCancelled:
+                self._count_cancellation(target_module)
+                raise
+            except DeadlineExceeded:
+                self.logger.warning(f"Request to '{target_module}' missed its deadline.")
+                self._count_timeout(target_module)
+                raise
             except Exception as e:
                 self.logger.error(f"Error in module '{target_module}': {e}")
                 return None
@@ -50,11 +376,332 @@ class AICoordinator:
             self.logger.warning(f"Module '{target_module}' not found.")
             return None
 
-    def set_context(self, key, value):
-        self.context[key] = value
+    async def _invoke_async(self, module, message):
+        context = self._context_for(message)
+        if hasattr(module, "handle_message_async"):
+            return await module.handle_message_async(message, context)
+        if message.get("deadline") is not None:
+            # Not the loop's shared executor: a call that hangs past its deadline would keep its worker.
+            future = self._start_deadline_call(message, lambda: module.handle_message(message, context))
+            return await asyncio.wrap_future(future)
+        return await asyncio.to_thread(module.handle_message, message, context)
+
+    async def _handle_message_async(self, module, message):
+        async with self._admission_slot_async(message):
+            check_cancelled(message)
+            return await self._invoke_async(module, message)
+
+    async def _stream_module(self, module, message):
+        async with self._admission_slot_async(message):
+            check_cancelled(message)
+            if hasattr(module, "stream_message_async"):
+                async for chunk in module.stream_message_async(message, self._context_for(message)):
+                    yield chunk
+            else:
+                yield await self._invoke_async(module, message)
+
+    def _join_stream(self, module, message):
+        """Starts or joins the coalesced stream for message; returns an async iterator."""
+        key = self._coalescing_key(message)
+        if key is None:
+            return self._stream_module(module, message)
+        shared_message = self._shared_message(message)
+        chunks, shared = self._async_single_flight.stream(key, lambda: self._stream_module(module, shared_message))
+        self._count_coalescing(message.get("target_module"), shared)
+        if message.get("cancel_token") is None:
+            return chunks
+        return self._follow_until_cancelled(chunks, message)
+
+    @staticmethod
+    async def _follow_until_cancelled(chunks, message):
+        # Leaving a shared stream only cancels the upstream call once every caller has left.
+        try:
+            async for chunk in chunks:
+                check_cancelled(message)
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    async def _follow_before_deadline(self, chunks, message):
+        # Waits for each chunk only until the deadline, then closes the stream.
+        if message.get("deadline") is None:
+            async for chunk in chunks:
+                yield chunk
+            return
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=max(0.0, time_left(message["deadline"])))
+                except StopAsyncIteration:
+                    return
+                except DeadlineExceeded:
+                    raise
+                except asyncio.TimeoutError:
+                    raise self._overdue(message) from None
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    async def route_message_async(self, message):
+        """
+        Async counterpart of route_message for use inside an event loop.
+
+        Modules that define handle_message_async are awaited directly; plain
+        handle_message implementations run in a worker thread so they never
+        block the loop.
+
+        Returns:
+            The response from the module, or None if the module is not found or an error occurs.
+
+        Raises:
+            AdmissionRejected: If an admission controller is set and refuses the
+                request, or too many calls to the module are overdue.
+            RequestCancelled: If the message's cancel_token was cancelled.
+            DeadlineExceeded: If the deadline passed before the module answered.
+        """
+        target_module = message.get("target_module")
+        if self.has_module(target_module):
+            try:
+                module = self.get_module(target_module)
+                check_cancelled(message)
+                message = self._with_deadline(message)
+                self._check_admission(message)
+                if self._coalescing_key(message) is None:
+                    return await self._await_before_deadline(message, self._handle_message_async(module, message))
+                chunks = []
+                async for chunk in self._follow_before_deadline(self._join_stream(module, message), message):
+                    chunks.append(chunk)
+                return chunks[0] if len(chunks) == 1 else "".join(chunks)
+            except AdmissionRejected as e:
+                self.logger.warning(f"Request to '{target_module}' rejected: {e.reason}")
+                raise
+            except (RequestCancelled, asyncio.CancelledError):
+                self._count_cancellation(target_module)
+                raise
+            except DeadlineExceeded:
+                self.logger.warning(f"Request to '{target_module}' missed its deadline.")
+                self._count_timeout(target_module)
+                raise
+            except Exception as e:
+                self.logger.error(f"Error in module '{target_module}': {e}")
+                return None
+        else:
+            self.logger.warning(f"Module '{target_module}' not found.")
+            return None
+
+    async def stream_message_async(self, message):
+        """
+        Routes a message and yields the response incrementally.
+
+        Modules that define stream_message_async stream chunk by chunk; any
+        other module yields its complete response once.
+
+        Raises:
+            KeyError: If the target module is not registered.
+            AdmissionRejected: If an admission controller is set and refuses the request.
+            RequestCancelled: If the message's cancel_token was cancelled.
+            DeadlineExceeded: If the deadline passed before the next chunk arrived.
+        """
+        target_module = message.get("target_module")
+        if not self.has_module(target_module):
+            self.logger.warning(f"Module '{target_module}' not found.")
+            raise KeyError(target_module)
+        module = self.get_module(target_module)
+        caller_token = message.get("cancel_token")
+        try:
+            check_cancelled(message)
+            message = self._with_deadline(message)
+            self._check_admission(message)
+            async for chunk in self._follow_before_deadline(self._join_stream(module, message), message):
+                if chunk is not None:
+                    yield chunk
+        except (RequestCancelled, asyncio.CancelledError):
+            self._count_cancellation(target_module)
+            raise
+        except DeadlineExceeded:
+            self.logger.warning(f"Stream from '{target_module}' missed its deadline.")
+            self._count_timeout(target_module)
+            raise
+        except GeneratorExit:
+            self._count_if_cancelled(target_module, caller_token)
+            raise
+
+    def stream_message(self, message):
+        """
+        Blocking counterpart of stream_message_async for threaded callers such as the GUI.
+
+        Modules that define stream_message stream chunk by chunk; any other
+        module yields its complete response once. Requests are not coalesced
+        on this path. With a deadline, the module runs on its own thread so a
+        stalled stream cannot hold the caller past it.
+
+        Raises:
+            KeyError: If the target module is not registered.
+            AdmissionRejected: If an admission controller is set and refuses the request.
+            RequestCancelled: If the message's cancel_token was cancelled.
+            DeadlineExceeded: If the deadline passed before the next chunk arrived.
+        """
+        target_module = message.get("target_module")
+        if not self.has_module(target_module):
+            self.logger.warning(f"Module '{target_module}' not found.")
+            raise KeyError(target_module)
+        module = self.get_module(target_module)
+        caller_token = message.get("cancel_token")
+        try:
+            check_cancelled(message)
+            message = self._with_deadline(message)
+            self._check_admission(message)
+            if message.get("deadline") is None:
+                yield from self._stream_module_sync(module, message)
+            else:
+                yield from self._stream_before_deadline(module, message)
+        except RequestCancelled:
+            self._count_cancellation(target_module)
+            raise
+        except DeadlineExceeded:
+            self.logger.warning(f"Stream from '{target_module}' missed its deadline.")
+            self._count_timeout(target_module)
+            raise
+        except GeneratorExit:
+            self._count_if_cancelled(target_module, caller_token)
+            raise
+
+    def _stream_module_sync(self, module, message):
+        context = self._context_for(message)
+        with self._admission_slot(message):
+            check_cancelled(message)
+            if hasattr(module, "stream_message"):
+                chunks = module.stream_message(message, context)
+                try:
+                    for chunk in chunks:
+                        check_cancelled(message)
+                        if chunk is not None:
+                            yield chunk
+                finally:
+                    if hasattr(chunks, "close"):
+                        chunks.close()
+            else:
+                response = module.handle_message(message, context)
+                if response is not None:
+                    yield response
+
+    def _stream_before_deadline(self, module, message):
+        # A pump thread feeds chunks through a queue; the caller waits only until the deadline.
+        chunks = queue.Queue()
+        done = object()
+
+        def pump():
+            try:
+                for chunk in self._stream_module_sync(module, message):
+                    chunks.put(chunk)
+            finally:
+                chunks.put(done)
+
+        future = self._start_deadline_call(message, pump)
+        try:
+            while True:
+                try:
+                    chunk = chunks.get(timeout=max(0.0, time_left(message["deadline"])))
+                except queue.Empty:
+                    raise self._overdue(message) from None
+                if chunk is done:
+                    future.result()  # Re-raises the module's error, if any
+                    return
+                yield chunk
+        finally:
+            # Stops the pump at its next chunk if the caller leaves early.
+            message["cancel_token"].cancel("caller stopped reading")
+
+    def scatter_stream_async(self, message, module_names, timeout=None, branch_timeouts=None, first_n=None):
+        """
+        Sends the same message to several modules at once and streams their
+        responses as they arrive.
+
+        Each branch goes through stream_message_async with target_module set
+        to that module, so admission control and coalescing apply per branch.
+
+        Args:
+            message: The message to fan out; its 'target_module' is ignored.
+            module_names: Modules to send the message to.
+            timeout: Seconds each branch may run; None waits indefinitely.
+            branch_timeouts: Optional {module_name: seconds} overriding timeout.
+            first_n: Stop once this many branches have succeeded and cancel the rest.
+
+        Returns:
+            An async iterator of (module_name, chunk) tuples and, as each
+            branch finishes, its BranchResult.
+        """
+        def stream_branch(module_name):
+            return self.stream_message_async({**message, "target_module": module_name})
+        return scatter(stream_branch, module_names, timeout, branch_timeouts, first_n)
+
+    async def scatter_gather_async(self, message, module_names, merge=merge_by_module, timeout=None,
+                                   branch_timeouts=None, first_n=None, quorum=1, on_chunk=None):
+        """
+        Sends the same message to several modules at once and merges their responses.
+
+        Args:
+            merge: Callable receiving the finished BranchResults in completion
+                order and returning the combined response.
+            first_n: Return as soon as this many branches have succeeded.
+            quorum: Minimum number of successful branches.
+            on_chunk: Optional callable(module_name, chunk) receiving partial
+                results while the branches are still running.
+            (Other arguments as for scatter_stream_async.)
+
+        Returns:
+            The value returned by merge.
+
+        Raises:
+            QuorumNotMet: If fewer than quorum branches succeeded.
+        """
+        results = []
+        events = self.scatter_stream_async(message, module_names, timeout, branch_timeouts, first_n)
+        try:
+            async for event in events:
+                if isinstance(event, BranchResult):
+                    results.append(event)
+                elif on_chunk is not None:
+                    on_chunk(*event)
+        finally:
+            await events.aclose()
+        if sum(1 for result in results if result.ok) < quorum:
+            raise QuorumNotMet(quorum, results)
+        return merge(results)
+
+    def scatter_gather(self, message, module_names, **kwargs):
+        """
+        Blocking counterpart of scatter_gather_async for threaded callers
+        (not for use inside a running event loop).
+        """
+        return asyncio.run(self.scatter_gather_async(message, module_names, **kwargs))
+
+    @property
+    def context(self):
+        """Read-only view of the global context defaults."""
+        return self.sessions.defaults
+
+    def _context_for(self, message):
+        # Taken once per dispatch, so a module sees one consistent context
+        # even if the session is updated while it runs.
+        return self.sessions.snapshot(message.get("session_id"))
+
+    def set_context(self, key, value, session_id=None):
+        """
+        Sets a context value. Without a session_id it becomes a global default;
+        with one it overrides the default for messages carrying that 'session_id'.
+        """
+        if session_id is None:
+            self.sessions.set_default(key, value)
+        else:
+            self.sessions.set(session_id, key, value)
+
+    def get_context(self, key, default=None, session_id=None):
+        return self.sessions.get(session_id, key, default)
 
-    def get_context(self, key, default=None):
-        return self.context.get(key, default)
+    def end_session(self, session_id):
+        """Discards a session's context overrides."""
+        return self.sessions.end_session(session_id)
 
     def load_config(self, key, default=None):
         return self.config.get(key, default)
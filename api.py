@@ -1,12 +1,25 @@
 # api.py (Modified)
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, make_response, stream_with_context
 from flask_cors import CORS
 from ai_coordinator import AICoordinator
+from admission_control import AdmissionController, AdmissionRejected, INTERACTIVE, BATCH
+from cancellation import CancellationRegistry, RequestCancelled
+from deadlines import DeadlineExceeded, deadline_after
+import atexit
+import hmac
+import json
 import os
+import threading
 from dotenv import load_dotenv
 # Import your actual AI module class
 from vertex_ai_module import VertexAIClient # Assuming vertex_ai_module.py has VertexAIClient
+from resilient_vertex import ResilientVertexClient
+from model_tiering import TieredVertexClient
+from semantic_cache import SemanticCache, SemanticCachingClient
+from usage_ledger import UsageLedger, UsageFlushJob, GROUP_FIELDS, usage_chronos_logger
+from sampling_profiler import SamplingProfiler, ProfileStore, profile_for
+from response_sections import parse_sections
 
 app = Flask(__name__)
 CORS(app) # Consider restricting origins in production
@@ -17,17 +30,58 @@ project = os.environ.get("VERTEX_PROJECT")
 location = os.environ.get("VERTEX_LOCATION")
 # Add system instruction loading if needed here or get from context
 SYSTEM_INSTRUCTION = """You are an AI assistant specialized... (load your full instruction)"""
+# Profiling and usage endpoints are disabled unless DEBUG_TOKEN is set; callers send it as X-Debug-Token.
+DEBUG_TOKEN = os.environ.get("DEBUG_TOKEN")
+MAX_PROFILE_SECONDS = float(os.environ.get("MAX_PROFILE_SECONDS", "60"))
+_profile_lock = threading.Lock()
+_request_profiles = ProfileStore()
+# In-flight /chat requests that sent a request_id, so /chat/cancel can stop them.
+cancellations = CancellationRegistry()
+# A /chat body may set "timeout" (seconds), capped at MAX_REQUEST_TIMEOUT; otherwise
+# the Vertex module's default of VERTEX_TIMEOUT applies.
+MAX_REQUEST_TIMEOUT = float(os.environ.get("MAX_REQUEST_TIMEOUT", "300"))
+VERTEX_TIMEOUT = float(os.environ.get("VERTEX_TIMEOUT", "120"))
 
 
 if not project or not location:
     raise ValueError("VERTEX_PROJECT and VERTEX_LOCATION environment variables must be set.")
 
 coordinator = AICoordinator()
+coordinator.set_admission_controller(AdmissionController(
+    max_concurrent=int(os.environ.get("MAX_UPSTREAM_CONCURRENCY", "16")),
+    user_rate=float(os.environ.get("USER_RATE_LIMIT", "1.0")),
+    user_burst=int(os.environ.get("USER_RATE_BURST", "10")),
+))
+
+# Token usage per user, module and model; flushed to USAGE_LOG every USAGE_FLUSH_INTERVAL seconds.
+# Prompts are clinical text, so /usage shows only their hashes unless USAGE_PROMPT_PREVIEW
+# (characters) is set, and /usage itself needs the debug token.
+usage_ledger = UsageLedger(prompt_preview=int(os.environ.get("USAGE_PROMPT_PREVIEW", "0")))
+usage_flush_job = UsageFlushJob(usage_ledger, usage_chronos_logger(os.environ.get("USAGE_LOG", "token_usage.log")),
+                                interval=float(os.environ.get("USAGE_FLUSH_INTERVAL", "60"))).start()
+atexit.register(usage_flush_job.stop)  # Writes out the last interval's usage when the server exits
 
 # --- REGISTER THE ACTUAL AI MODULE ---
 try:
-    vertex_module = VertexAIClient(project=project, location=location)
+    vertex_module = VertexAIClient(project=project, location=location, ledger=usage_ledger)
+    # Comma-separated regions to hedge and fail over to, e.g. "us-east1,europe-west4"
+    fallback_locations = [loc.strip() for loc in os.environ.get("VERTEX_FALLBACK_LOCATIONS", "").split(",") if loc.strip()]
+    if fallback_locations:
+        vertex_module = ResilientVertexClient(
+            [vertex_module] + [VertexAIClient(project=project, location=loc, ledger=usage_ledger) for loc in fallback_locations]
+        )
+    if os.environ.get("MODEL_TIERING", "").lower() in ("1", "true", "yes"):
+        vertex_module = TieredVertexClient(vertex_module)
+    if os.environ.get("SEMANTIC_CACHE", "").lower() in ("1", "true", "yes"):
+        from google.cloud import aiplatform
+        from memory_manager import embed_text  # Loads aiplatform, so only when the cache is enabled
+        # The cache embeds every prompt, so the embedding model must use this deployment's project and region.
+        aiplatform.init(project=project, location=location)
+        vertex_module = SemanticCachingClient(vertex_module, SemanticCache(
+            embed_text, threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.92"))))
     coordinator.register_module("vertex_ai", vertex_module)
+    coordinator.enable_coalescing("vertex_ai")  # Share one upstream call between identical concurrent prompts
+    coordinator.set_module_timeout("vertex_ai", VERTEX_TIMEOUT)
     coordinator.set_context("system_instruction", SYSTEM_INSTRUCTION) # Set context if module uses it
     # coordinator.register_tts_module() # Keep if API might trigger TTS
 except Exception as e:
@@ -35,25 +89,111 @@ except Exception as e:
     # Decide how to handle this - maybe exit or run with limited functionality?
     # raise e # Or re-raise to stop the app
 
+def _debug_authorized():
+    token = request.headers.get('X-Debug-Token', '')
+    return bool(DEBUG_TOKEN) and hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode())
+
+@app.route('/debug/profile', methods=['GET'])
+def debug_profile():
+    """Samples every worker thread for ?seconds=N and returns collapsed stacks for flame graphs."""
+    if not _debug_authorized():
+        return jsonify({'error': 'Not found'}), 404
+    try:
+        seconds = min(max(float(request.args.get('seconds', '10')), 0.1), MAX_PROFILE_SECONDS)
+    except ValueError:
+        return jsonify({'error': 'seconds must be a number'}), 400
+    if not _profile_lock.acquire(blocking=False):
+        return jsonify({'error': 'A profile is already running.'}), 409
+    try:
+        collapsed = profile_for(seconds)
+    finally:
+        _profile_lock.release()
+    return collapsed, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+@app.route('/debug/profile/<profile_id>', methods=['GET'])
+def debug_request_profile(profile_id):
+    """Returns a per-request profile recorded for a /chat call sent with X-Profile: 1."""
+    collapsed = _request_profiles.get(profile_id) if _debug_authorized() else None
+    if collapsed is None:
+        return jsonify({'error': 'Not found'}), 404
+    return collapsed, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+@app.route('/usage', methods=['GET'])
+def usage():
+    """
+    Token usage over a rolling window: ?window=<seconds>&by=user_id,module,model&top=<n>.
+    Returns overall totals, the top groups and the heaviest individual requests.
+    """
+    if not _debug_authorized():
+        return jsonify({'error': 'Not found'}), 404
+    by = tuple(field for field in request.args.get('by', ','.join(GROUP_FIELDS)).split(',') if field)
+    try:
+        report = usage_ledger.report(window=float(request.args.get('window', '3600')), by=by,
+                                     top=int(request.args.get('top', '10')))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid usage query: {e}'}), 400
+    return jsonify(report)
+
+@app.route('/chat/cancel', methods=['POST'])
+def cancel_chat():
+    """
+    Cancels an in-flight /chat request by the request_id it was sent with;
+    upstream generation stops at its next chunk. Clients should use
+    unguessable ids (e.g. UUIDs).
+    """
+    data = request.get_json(silent=True) or {}
+    request_id = data.get('request_id')
+    if not request_id:
+        return jsonify({'error': 'No request_id provided'}), 400
+    if not cancellations.cancel(request_id, "cancelled by client"):
+        return jsonify({'error': 'No such request in flight.'}), 404
+    return jsonify({'cancelled': request_id})
+
 @app.route('/chat', methods=['POST'])
 def chat():
+    if not (request.headers.get('X-Profile') and _debug_authorized()):
+        return _chat()
+    # Opt-in per-request profile of this worker thread; fetch it via /debug/profile/<X-Profile-Id>.
+    with SamplingProfiler(thread_ids=[threading.get_ident()]) as profiler:
+        response = make_response(_chat())
+    response.headers['X-Profile-Id'] = _request_profiles.add(profiler.collapsed())
+    return response
+
+def _chat():
     data = request.get_json()
     user_input = data.get('message')
-    # You might want user_id, session_id from frontend too
-    # user_id = data.get('user_id', 'api_user')
-    # session_id = data.get('session_id', 'api_session')
+    user_id = data.get('user_id', request.remote_addr)
+    priority = BATCH if data.get('priority') == BATCH else INTERACTIVE
 
     if not user_input:
         return jsonify({'error': 'No message provided'}), 400
+    try:
+        deadline = _request_deadline(data)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'timeout must be a positive number of seconds'}), 400
 
+    request_id = data.get('request_id')  # Lets /chat/cancel stop this request
+    cancel_token = cancellations.register(request_id)
+    streaming = False
     try:
         # --- Use route_message to send to the AI module ---
         message_to_ai = {
             "target_module": "vertex_ai", # The name you registered the module with
-            "content": user_input
-            # Add other relevant info if needed by handle_message
-            # "user_id": user_id,
+            "content": user_input,
+            "user_id": user_id,
+            "client_id": request.remote_addr,  # Rate limits apply per caller, whatever user_id it claims
+            "session_id": data.get('session_id'),  # Selects per-session context overrides
+            "priority": priority,
+            "model_tier": data.get('model_tier'),  # Optional override, e.g. "quick" or "full"
+            "cache": data.get('cache', True),  # False skips the semantic response cache
+            "cancel_token": cancel_token,
+            "deadline": deadline,  # None falls back to the module's default timeout
         }
+        if data.get('format') == 'events':
+            response = _event_stream(message_to_ai, request_id)
+            streaming = True  # The stream releases the cancel token when it ends
+            return response
+
         # The coordinator's route_message will pass context (like system_instruction)
         # to the module's handle_message method.
         response = coordinator.route_message(message_to_ai)
@@ -68,10 +208,70 @@ def chat():
         # coordinator.route_message(tts_message) # Fire-and-forget or handle response
 
         return jsonify({'response': response})
+    except AdmissionRejected as e:
+        return _rejection_response(e)
+    except RequestCancelled:
+        return jsonify({'error': 'Request cancelled.'}), 499
+    except DeadlineExceeded:
+        return jsonify({'error': 'Request timed out.'}), 504
     except Exception as e:
         # Log the exception
         app.logger.error(f"Error in /chat endpoint: {e}", exc_info=True)
         return jsonify({'error': f'An internal server error occurred: {str(e)}'}), 500
+    finally:
+        if not streaming:
+            cancellations.release(request_id, cancel_token)
+
+def _event_stream(message_to_ai, request_id):
+    """
+    Streams the answer as newline-delimited JSON section events (see
+    response_sections). Waits for the first event before committing to a 200,
+    so rejections and early failures still raise into _chat's handlers.
+    """
+    events = parse_sections(coordinator.stream_message(message_to_ai))
+    try:
+        first = next(events, None)
+    except BaseException:
+        events.close()
+        raise
+
+    def generate():
+        try:
+            if first is not None:
+                yield json.dumps(first) + "\n"
+            for event in events:
+                yield json.dumps(event) + "\n"
+        except RequestCancelled:
+            yield json.dumps({'event': 'error', 'error': 'Request cancelled.'}) + "\n"
+        except DeadlineExceeded:
+            yield json.dumps({'event': 'error', 'error': 'Request timed out.'}) + "\n"
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band.
+            app.logger.error(f"Error while streaming /chat events: {e}", exc_info=True)
+            yield json.dumps({'event': 'error', 'error': 'AI module failed while responding.'}) + "\n"
+        finally:
+            events.close()
+            cancellations.release(request_id, message_to_ai["cancel_token"])
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def _request_deadline(data):
+    """The deadline for the body's optional "timeout", capped at MAX_REQUEST_TIMEOUT."""
+    timeout = data.get('timeout')
+    if timeout is None:
+        return None
+    timeout = float(timeout)
+    if not timeout > 0:
+        raise ValueError(timeout)
+    return deadline_after(min(timeout, MAX_REQUEST_TIMEOUT))
+
+def _rejection_response(error):
+    """429 for rate limits, 503 when the upstream queue is saturated."""
+    status = 429 if error.reason.endswith("rate_limited") else 503
+    response = jsonify({'error': f'Request rejected: {error.reason}'})
+    if error.retry_after:
+        response.headers['Retry-After'] = str(max(1, int(error.retry_after + 0.999)))
+    return response, status
 
 if __name__ == '__main__':
     # Use a production server (like Gunicorn or Waitress) instead of debug=True in production
@@ -0,0 +1,390 @@
+# api_asgi.py
+#
+# ASGI variant of api.py. Serves the same /chat contract, but upstream calls are
+# awaited instead of blocking a worker thread, so a handful of processes can hold
+# thousands of slow streaming connections open at once.
+#
+# Run with an ASGI server, for example:
+#   hypercorn api_asgi:app --workers 4 --bind 0.0.0.0:5000 --graceful-timeout 30
+# or directly with `python api_asgi.py`.
+
+import asyncio
+import hmac
+import json
+import os
+import signal
+from dotenv import load_dotenv
+from quart import Quart, request, jsonify, make_response
+from quart_cors import cors
+from ai_coordinator import AICoordinator
+from admission_control import AdmissionController, AdmissionRejected, INTERACTIVE, BATCH
+from cancellation import CancellationRegistry, RequestCancelled
+from deadlines import DeadlineExceeded, deadline_after
+from vertex_ai_module import VertexAIClient
+from resilient_vertex import ResilientVertexClient
+from model_tiering import TieredVertexClient
+from semantic_cache import SemanticCache, SemanticCachingClient
+from usage_ledger import UsageLedger, UsageFlushJob, GROUP_FIELDS, usage_chronos_logger
+from sampling_profiler import SamplingProfiler, ProfileStore
+from response_sections import parse_sections_async
+
+app = Quart(__name__)
+app = cors(app)  # Consider restricting origins in production
+
+# Streams from long generations must not be cut off by Quart's default 60s timeout.
+load_dotenv()
+app.config["RESPONSE_TIMEOUT"] = float(os.environ.get("RESPONSE_TIMEOUT", "600"))
+
+project = os.environ.get("VERTEX_PROJECT")
+location = os.environ.get("VERTEX_LOCATION")
+# Seconds to wait for in-flight requests to finish on shutdown.
+DRAIN_TIMEOUT = float(os.environ.get("DRAIN_TIMEOUT", "30"))
+SYSTEM_INSTRUCTION = """You are an AI assistant specialized... (load your full instruction)"""
+# Profiling and usage endpoints are disabled unless DEBUG_TOKEN is set; callers send it as X-Debug-Token.
+DEBUG_TOKEN = os.environ.get("DEBUG_TOKEN")
+MAX_PROFILE_SECONDS = float(os.environ.get("MAX_PROFILE_SECONDS", "60"))
+_request_profiles = ProfileStore()
+_profiling = False
+# In-flight /chat requests that sent a request_id, so /chat/cancel can stop them.
+cancellations = CancellationRegistry()
+# A /chat body may set "timeout" (seconds), capped at MAX_REQUEST_TIMEOUT; otherwise
+# the Vertex module's default of VERTEX_TIMEOUT applies.
+MAX_REQUEST_TIMEOUT = float(os.environ.get("MAX_REQUEST_TIMEOUT", "300"))
+VERTEX_TIMEOUT = float(os.environ.get("VERTEX_TIMEOUT", "120"))
+
+
+if not project or not location:
+    raise ValueError("VERTEX_PROJECT and VERTEX_LOCATION environment variables must be set.")
+
+coordinator = AICoordinator()
+coordinator.set_admission_controller(AdmissionController(
+    max_concurrent=int(os.environ.get("MAX_UPSTREAM_CONCURRENCY", "64")),
+    user_rate=float(os.environ.get("USER_RATE_LIMIT", "1.0")),
+    user_burst=int(os.environ.get("USER_RATE_BURST", "10")),
+))
+
+# Token usage per user, module and model; flushed to USAGE_LOG every USAGE_FLUSH_INTERVAL seconds.
+# Prompts are clinical text, so /usage shows only their hashes unless USAGE_PROMPT_PREVIEW
+# (characters) is set, and /usage itself needs the debug token.
+usage_ledger = UsageLedger(prompt_preview=int(os.environ.get("USAGE_PROMPT_PREVIEW", "0")))
+usage_flush_job = UsageFlushJob(usage_ledger, usage_chronos_logger(os.environ.get("USAGE_LOG", "token_usage.log")),
+                                interval=float(os.environ.get("USAGE_FLUSH_INTERVAL", "60"))).start()
+
+try:
+    vertex_module = VertexAIClient(project=project, location=location, ledger=usage_ledger)
+    # Comma-separated regions to hedge and fail over to, e.g. "us-east1,europe-west4"
+    fallback_locations = [loc.strip() for loc in os.environ.get("VERTEX_FALLBACK_LOCATIONS", "").split(",") if loc.strip()]
+    if fallback_locations:
+        vertex_module = ResilientVertexClient(
+            [vertex_module] + [VertexAIClient(project=project, location=loc, ledger=usage_ledger) for loc in fallback_locations]
+        )
+    if os.environ.get("MODEL_TIERING", "").lower() in ("1", "true", "yes"):
+        vertex_module = TieredVertexClient(vertex_module)
+    if os.environ.get("SEMANTIC_CACHE", "").lower() in ("1", "true", "yes"):
+        from google.cloud import aiplatform
+        from memory_manager import embed_text  # Loads aiplatform, so only when the cache is enabled
+        # The cache embeds every prompt, so the embedding model must use this deployment's project and region.
+        aiplatform.init(project=project, location=location)
+        vertex_module = SemanticCachingClient(vertex_module, SemanticCache(
+            embed_text, threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.92"))))
+    coordinator.register_module("vertex_ai", vertex_module)
+    coordinator.enable_coalescing("vertex_ai")  # Share one upstream call between identical concurrent prompts
+    coordinator.set_module_timeout("vertex_ai", VERTEX_TIMEOUT)
+    coordinator.set_context("system_instruction", SYSTEM_INSTRUCTION)
+except Exception as e:
+    app.logger.error(f"Failed to initialize AI modules: {e}")
+
+# In-flight request bookkeeping used to drain gracefully on shutdown.
+_inflight = 0
+_idle = asyncio.Event()
+_idle.set()
+_shutting_down = False
+
+
+def _request_started():
+    global _inflight
+    _inflight += 1
+    _idle.clear()
+
+
+def _request_finished():
+    global _inflight
+    _inflight -= 1
+    if _inflight == 0:
+        _idle.set()
+
+
+def _chat_finished(message_to_ai):
+    cancellations.release(message_to_ai["request_id"], message_to_ai["cancel_token"])
+    _request_finished()
+
+
+@app.after_serving
+async def drain_inflight_requests():
+    global _shutting_down
+    _shutting_down = True
+    if _inflight:
+        app.logger.info(f"Draining {_inflight} in-flight request(s)...")
+    try:
+        await asyncio.wait_for(_idle.wait(), timeout=DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        app.logger.warning(f"Shutdown with {_inflight} request(s) still in flight.")
+    usage_flush_job.stop()
+
+
+def _debug_authorized():
+    token = request.headers.get('X-Debug-Token', '')
+    return bool(DEBUG_TOKEN) and hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode())
+
+
+@app.route('/debug/profile', methods=['GET'])
+async def debug_profile():
+    """
+    Samples the event loop and worker threads for ?seconds=N and returns
+    collapsed stacks for flame graphs. The loop keeps serving while it runs.
+    """
+    global _profiling
+    if not _debug_authorized():
+        return jsonify({'error': 'Not found'}), 404
+    try:
+        seconds = min(max(float(request.args.get('seconds', '10')), 0.1), MAX_PROFILE_SECONDS)
+    except ValueError:
+        return jsonify({'error': 'seconds must be a number'}), 400
+    if _profiling:
+        return jsonify({'error': 'A profile is already running.'}), 409
+    _profiling = True
+    try:
+        with SamplingProfiler() as profiler:
+            await asyncio.sleep(seconds)
+    finally:
+        _profiling = False
+    return profiler.collapsed(), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+
+@app.route('/debug/profile/<profile_id>', methods=['GET'])
+async def debug_request_profile(profile_id):
+    """Returns a per-request profile recorded for a /chat call sent with X-Profile: 1."""
+    collapsed = _request_profiles.get(profile_id) if _debug_authorized() else None
+    if collapsed is None:
+        return jsonify({'error': 'Not found'}), 404
+    return collapsed, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+
+@app.route('/usage', methods=['GET'])
+async def usage():
+    """
+    Token usage over a rolling window: ?window=<seconds>&by=user_id,module,model&top=<n>.
+    Returns overall totals, the top groups and the heaviest individual requests.
+    """
+    if not _debug_authorized():
+        return jsonify({'error': 'Not found'}), 404
+    by = tuple(field for field in request.args.get('by', ','.join(GROUP_FIELDS)).split(',') if field)
+    try:
+        report = usage_ledger.report(window=float(request.args.get('window', '3600')), by=by,
+                                     top=int(request.args.get('top', '10')))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid usage query: {e}'}), 400
+    return jsonify(report)
+
+
+@app.route('/chat/cancel', methods=['POST'])
+async def cancel_chat():
+    """
+    Cancels an in-flight /chat request by the request_id it was sent with;
+    upstream generation stops at its next chunk. Clients should use
+    unguessable ids (e.g. UUIDs). A client that disconnects is cancelled
+    automatically.
+    """
+    data = await request.get_json(silent=True) or {}
+    request_id = data.get('request_id')
+    if not request_id:
+        return jsonify({'error': 'No request_id provided'}), 400
+    if not cancellations.cancel(request_id, "cancelled by client"):
+        return jsonify({'error': 'No such request in flight.'}), 404
+    return jsonify({'cancelled': request_id})
+
+
+@app.route('/chat', methods=['POST'])
+async def chat():
+    if not (request.headers.get('X-Profile') and _debug_authorized()):
+        return await _chat()
+    # Opt-in per-request profile, fetched via /debug/profile/<X-Profile-Id>. The event
+    # loop is shared, so samples include other requests running at the same time, and
+    # a streamed response is only profiled up to its first chunk.
+    with SamplingProfiler() as profiler:
+        response = await make_response(await _chat())
+    response.headers['X-Profile-Id'] = _request_profiles.add(profiler.collapsed())
+    return response
+
+
+async def _chat():
+    if _shutting_down:
+        return jsonify({'error': 'Server is shutting down.'}), 503
+
+    data = await request.get_json()
+    user_input = data.get('message') if data else None
+
+    if not user_input:
+        return jsonify({'error': 'No message provided'}), 400
+    try:
+        deadline = _request_deadline(data)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'timeout must be a positive number of seconds'}), 400
+
+    message_to_ai = {
+        "target_module": "vertex_ai",
+        "content": user_input,
+        "user_id": data.get('user_id', request.remote_addr),
+        "client_id": request.remote_addr,  # Rate limits apply per caller, whatever user_id it claims
+        "session_id": data.get('session_id'),  # Selects per-session context overrides
+        "priority": BATCH if data.get('priority') == BATCH else INTERACTIVE,
+        "model_tier": data.get('model_tier'),  # Optional override, e.g. "quick" or "full"
+        "cache": data.get('cache', True),  # False skips the semantic response cache
+        "request_id": data.get('request_id'),  # Lets /chat/cancel stop this request
+        "deadline": deadline,  # None falls back to the module's default timeout
+    }
+    message_to_ai["cancel_token"] = cancellations.register(message_to_ai["request_id"])
+
+    _request_started()
+    if data.get('format') == 'events':
+        return await _start_stream(message_to_ai, events=True)
+    if data.get('stream'):
+        return await _start_stream(message_to_ai)
+
+    try:
+        response = await coordinator.route_message_async(message_to_ai)
+
+        if response is None:
+            app.logger.error(f"Received no response from module 'vertex_ai' for input: {user_input[:50]}...")
+            return jsonify({'error': 'AI module failed to generate a response.'}), 500
+
+        return jsonify({'response': response})
+    except AdmissionRejected as e:
+        return _rejection_response(e)
+    except RequestCancelled:
+        return jsonify({'error': 'Request cancelled.'}), 499
+    except DeadlineExceeded:
+        return jsonify({'error': 'Request timed out.'}), 504
+    except Exception as e:
+        app.logger.error(f"Error in /chat endpoint: {e}", exc_info=True)
+        return jsonify({'error': f'An internal server error occurred: {str(e)}'}), 500
+    finally:
+        # Also reached when the client disconnects and the server cancels this task.
+        _chat_finished(message_to_ai)
+
+
+def _request_deadline(data):
+    """The deadline for the body's optional "timeout", capped at MAX_REQUEST_TIMEOUT."""
+    timeout = data.get('timeout')
+    if timeout is None:
+        return None
+    timeout = float(timeout)
+    if not timeout > 0:
+        raise ValueError(timeout)
+    return deadline_after(min(timeout, MAX_REQUEST_TIMEOUT))
+
+
+def _rejection_response(error):
+    """429 for rate limits, 503 when the upstream queue is saturated."""
+    status = 429 if error.reason.endswith("rate_limited") else 503
+    headers = {}
+    if error.retry_after:
+        headers['Retry-After'] = str(max(1, int(error.retry_after + 0.999)))
+    return jsonify({'error': f'Request rejected: {error.reason}'}), status, headers
+
+
+async def _start_stream(message_to_ai, events=False):
+    """
+    Waits for the first chunk before committing to a 200 so that admission
+    rejections and early upstream failures still get a proper status code.
+    With events, the response is newline-delimited JSON section events (see
+    response_sections) instead of plain text.
+    """
+    chunks = coordinator.stream_message_async(message_to_ai)
+    if events:
+        chunks = parse_sections_async(chunks)
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except AdmissionRejected as e:
+        _chat_finished(message_to_ai)
+        return _rejection_response(e)
+    except RequestCancelled:
+        _chat_finished(message_to_ai)
+        return jsonify({'error': 'Request cancelled.'}), 499
+    except DeadlineExceeded:
+        _chat_finished(message_to_ai)
+        return jsonify({'error': 'Request timed out.'}), 504
+    except asyncio.CancelledError:
+        _chat_finished(message_to_ai)  # Client disconnected before the first chunk
+        raise
+    except Exception as e:
+        _chat_finished(message_to_ai)
+        app.logger.error(f"Error in /chat endpoint: {e}", exc_info=True)
+        return jsonify({'error': f'An internal server error occurred: {str(e)}'}), 500
+    if events:
+        return _stream_response(first, chunks, message_to_ai, events=True), 200, {"Content-Type": "application/x-ndjson"}
+    return _stream_response(first, chunks, message_to_ai), 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+
+def _encode_event(event):
+    return (json.dumps(event) + "\n").encode("utf-8")
+
+
+async def _stream_response(first, chunks, message_to_ai, events=False):
+    """
+    Yields response chunks as plain text, or as JSON lines with events; errors
+    and cancellation end the stream early (with an error event in events mode).
+    """
+    encode = _encode_event if events else (lambda chunk: chunk.encode("utf-8"))
+    error = None
+    completed = False
+    try:
+        if first is not None:
+            yield encode(first)
+            async for chunk in chunks:
+                yield encode(chunk)
+        completed = True
+    except RequestCancelled:
+        completed = True  # Cancelled through /chat/cancel; just end the stream
+        error = 'Request cancelled.'
+    except DeadlineExceeded:
+        completed = True  # The coordinator has already closed the upstream stream
+        error = 'Request timed out.'
+        app.logger.warning("Streaming /chat response cut off at its deadline.")
+    except Exception as e:
+        # Headers are already sent, so the best we can do is log and close.
+        completed = True
+        error = 'AI module failed while responding.'
+        app.logger.error(f"Error while streaming /chat response: {e}", exc_info=True)
+    finally:
+        if not completed:
+            # The client went away mid-stream: stop the upstream call now rather than at garbage collection.
+            message_to_ai["cancel_token"].cancel("client disconnected")
+            await chunks.aclose()
+        _chat_finished(message_to_ai)
+    if events and error is not None:
+        yield _encode_event({'event': 'error', 'error': error})
+
+
+if __name__ == '__main__':
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [f"0.0.0.0:{os.environ.get('PORT', '5000')}"]
+    config.graceful_timeout = DRAIN_TIMEOUT
+
+    shutdown_event = asyncio.Event()
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, shutdown_event.set)
+            except NotImplementedError:  # Windows
+                pass
+        await serve(app, config, shutdown_trigger=shutdown_event.wait)
+
+    asyncio.run(main())
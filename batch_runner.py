@@ -0,0 +1,219 @@
+# batch_runner.py
+#
+# Offline batch processing of de-identified cases through AICoordinator.
+#
+# Input is JSONL, one case per line: {"id": "...", "content": "...", ...}.
+# Results are appended to the output JSONL as each case finishes, and the
+# output file doubles as the checkpoint: rerunning the same command skips
+# every case that already has a successful result there.
+#
+# Usage:
+#   python batch_runner.py cases.jsonl results.jsonl --concurrency 8
+
+import argparse
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from admission_control import BATCH
+
+logger = logging.getLogger("batch_runner")
+
+
+def load_completed_ids(output_path):
+    """Returns ids with a successful result in output_path; torn or failed lines are ignored."""
+    completed = set()
+    try:
+        with open(output_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Partially written line from an interrupted run
+                if record.get("error") is None:
+                    completed.add(record.get("id"))
+    except FileNotFoundError:
+        pass
+    return completed
+
+
+def _terminate_torn_line(out):
+    """Starts a fresh line if an interrupted run left the last one unfinished."""
+    if out.tell() == 0:
+        return
+    out.seek(out.tell() - 1)
+    if out.read(1) != "\n":
+        out.write("\n")
+
+
+def _read_cases(input_path):
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            case = json.loads(line)
+            case.setdefault("id", str(line_number))
+            yield case
+
+
+class Progress:
+    def __init__(self, total, skipped):
+        self.total = total
+        self.skipped = skipped
+        self.done = 0
+        self.failed = 0
+        self.started = time.monotonic()
+
+    def throughput(self):
+        elapsed = time.monotonic() - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        remaining = self.total - self.skipped - self.done
+        rate = self.throughput()
+        return remaining / rate if rate > 0 else None
+
+    def summary(self):
+        return {
+            "total": self.total,
+            "skipped": self.skipped,
+            "processed": self.done,
+            "failed": self.failed,
+            "elapsed": time.monotonic() - self.started,
+            "throughput": self.throughput(),
+        }
+
+    def __str__(self):
+        eta = self.eta()
+        eta_text = f"{eta:.0f}s" if eta is not None else "?"
+        return (f"{self.skipped + self.done}/{self.total} cases "
+                f"({self.failed} failed), {self.throughput():.2f} cases/s, ETA {eta_text}")
+
+
+def _process_case(coordinator, case, target_module):
+    message = {
+        "target_module": target_module,
+        "content": case.get("content"),
+        "user_id": case.get("user_id", "batch"),
+        "priority": BATCH,
+    }
+    if "model_tier" in case:
+        message["model_tier"] = case["model_tier"]
+    start = time.monotonic()
+    try:
+        response = coordinator.route_message(message)
+        error = None if response is not None else "AI module failed to generate a response."
+    except Exception as e:
+        response, error = None, str(e)
+    return {"id": case["id"], "response": response, "error": error, "elapsed": time.monotonic() - start}
+
+
+def run_batch(coordinator, input_path, output_path, concurrency=4, target_module="vertex_ai",
+              progress_interval=10.0, on_progress=None, stop_event=None):
+    """
+    Runs every case in input_path that is not already completed in output_path.
+
+    Args:
+        coordinator: AICoordinator with target_module registered.
+        concurrency: Maximum cases in flight at once.
+        on_progress: Called with a Progress every progress_interval seconds and at the end.
+        stop_event: Optional threading.Event; when set, no new cases are started and
+            in-flight cases are finished and written before returning.
+
+    Returns:
+        The final Progress summary as a dict.
+    """
+    completed = load_completed_ids(output_path)
+    total = sum(1 for _ in _read_cases(input_path))
+    progress = Progress(total, skipped=0)
+    last_report = time.monotonic()
+    on_progress = on_progress or (lambda p: logger.info(str(p)))
+
+    with open(output_path, "a+", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        _terminate_torn_line(out)
+        pending = set()
+
+        def drain(block_until):
+            nonlocal pending, last_report
+            while len(pending) > block_until:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record = future.result()
+                    out.write(json.dumps(record) + "\n")
+                    progress.done += 1
+                    if record["error"] is not None:
+                        progress.failed += 1
+                out.flush()
+                if time.monotonic() - last_report >= progress_interval:
+                    last_report = time.monotonic()
+                    on_progress(progress)
+
+        for case in _read_cases(input_path):
+            if case["id"] in completed:
+                progress.skipped += 1
+                continue
+            if stop_event is not None and stop_event.is_set():
+                break
+            pending.add(pool.submit(_process_case, coordinator, case, target_module))
+            # Read ahead only as far as there are free workers.
+            drain(block_until=concurrency - 1)
+        drain(block_until=0)
+        os.fsync(out.fileno())
+
+    on_progress(progress)
+    return progress.summary()
+
+
+def _build_coordinator(system_instruction):
+    from dotenv import load_dotenv
+    from ai_coordinator import AICoordinator
+    from vertex_ai_module import VertexAIClient
+
+    load_dotenv()
+    project = os.environ.get("VERTEX_PROJECT")
+    location = os.environ.get("VERTEX_LOCATION")
+    if not project or not location:
+        raise ValueError("VERTEX_PROJECT and VERTEX_LOCATION environment variables must be set.")
+
+    coordinator = AICoordinator()
+    coordinator.register_module("vertex_ai", VertexAIClient(project, location))
+    coordinator.set_context("system_instruction", system_instruction)
+    return coordinator
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a JSONL file of cases through the AI coordinator.")
+    parser.add_argument("input", help="JSONL file of cases with 'id' and 'content' fields")
+    parser.add_argument("output", help="JSONL results file; also used to resume interrupted runs")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--system-instruction-file", help="File containing the system instruction")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="Seconds between progress reports")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    system_instruction = ""
+    if args.system_instruction_file:
+        with open(args.system_instruction_file, "r", encoding="utf-8") as f:
+            system_instruction = f.read()
+
+    coordinator = _build_coordinator(system_instruction)
+    stop_event = threading.Event()
+    # Ctrl+C stops starting new cases; in-flight ones are still written out.
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    summary = run_batch(coordinator, args.input, args.output, args.concurrency,
+                        progress_interval=args.progress_interval, stop_event=stop_event)
+    print(json.dumps(summary))
+    if stop_event.is_set():
+        print("Interrupted; rerun the same command to resume.", file=sys.stderr)
+        return 130
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
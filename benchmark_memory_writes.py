@@ -0,0 +1,120 @@
+# benchmark_memory_writes.py
+#
+# Many concurrent writers, across processes and threads, appending turns to
+# shared and private sessions through MemoryManager. Reports throughput and
+# then checks that no entry was lost and no session file was torn.
+#
+# Vertex AI calls (embeddings, Matching Engine) are replaced with local stubs
+# in the worker processes so only local storage is measured.
+#
+# Usage: python benchmark_memory_writes.py [--processes 4] [--threads 4] [--entries 50] [--sessions 8]
+
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+
+class _NoopIndexEndpoint:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def deploy_index(self, **kwargs):
+        pass
+
+    def upsert_datapoints(self, **kwargs):
+        pass
+
+    @staticmethod
+    def UpsertDatapointsSpec(**kwargs):
+        return kwargs
+
+
+def _session_for(worker, n, sessions):
+    # Half the writes go to sessions every worker shares, half to the worker's own.
+    if n % 2 == 0:
+        return "shared", f"shared{n % sessions}"
+    return f"user{worker}", f"private{n % sessions}"
+
+
+def _worker_process(base_dir, process_index, threads, entries, sessions, ready=None):
+    from google.cloud import aiplatform
+    aiplatform.init = lambda **kwargs: None
+    aiplatform.MatchingEngineIndexEndpoint = _NoopIndexEndpoint
+    from memory_manager import MemoryManager
+
+    manager = MemoryManager(base_dir=base_dir)
+    manager.generate_embeddings = lambda text: [0.1] * 768
+    if ready is not None:
+        ready.wait()  # Start writing together, after the slow aiplatform import
+
+    def write(thread_index):
+        worker = process_index * threads + thread_index
+        for n in range(entries):
+            user_id, session_id = _session_for(worker, n, sessions)
+            manager.save_conversation_entry(user_id, session_id, f"{worker}-{n}", f"turn {n} from {worker}", "user")
+
+    pool = [threading.Thread(target=write, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+
+def _verify(base_dir, workers, entries, sessions):
+    expected = {}
+    for worker in range(workers):
+        for n in range(entries):
+            user_id, session_id = _session_for(worker, n, sessions)
+            expected.setdefault((user_id, session_id), set()).add(f"{worker}-{n}")
+
+    lost = torn = 0
+    for (user_id, session_id), ids in expected.items():
+        path = os.path.join(base_dir, "conversations", f"user_{user_id}_session_{session_id}.json")
+        try:
+            with open(path, "r") as f:
+                stored = {entry["id"] for entry in json.load(f)}
+        except ValueError:
+            torn += 1
+            continue
+        lost += len(ids - stored)
+    return lost, torn
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MemoryManager concurrent writer benchmark")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4, help="Writer threads per process")
+    parser.add_argument("--entries", type=int, default=50, help="Entries written by each thread")
+    parser.add_argument("--sessions", type=int, default=8, help="Shared sessions (and private sessions per writer)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as base_dir:
+        ready = multiprocessing.Barrier(args.processes + 1)
+        processes = [
+            multiprocessing.Process(target=_worker_process,
+                                    args=(base_dir, i, args.threads, args.entries, args.sessions, ready))
+            for i in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+        ready.wait()
+        start = time.perf_counter()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        workers = args.processes * args.threads
+        total = workers * args.entries
+        lost, torn = _verify(base_dir, workers, args.entries, args.sessions)
+        print(f"{total} writes by {workers} writers in {args.processes} processes: "
+              f"{elapsed:.2f}s, {total / elapsed:.0f} writes/s")
+        print(f"lost entries: {lost}, torn session files: {torn}")
+        return 0 if lost == 0 and torn == 0 and all(p.exitcode == 0 for p in processes) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,63 @@
+# benchmark_startup.py
+#
+# Measures cold-start cost of the coordinator: importing ai_coordinator and
+# constructing AICoordinator, each in a fresh interpreter so nothing is cached.
+#
+# Usage: python benchmark_startup.py [--runs N]
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import ai_coordinator
+t1 = time.perf_counter()
+coordinator = ai_coordinator.AICoordinator()
+t2 = time.perf_counter()
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "init_ms": (t2 - t1) * 1000,
+    "tts_imported": "google.cloud.texttospeech" in sys.modules,
+    "playsound_imported": "playsound" in sys.modules,
+}))
+"""
+
+# Cost the coordinator used to pay up front: importing the TTS stack eagerly.
+_EAGER_TTS_PROBE = """
+import json, time
+t0 = time.perf_counter()
+import text_to_speech
+print(json.dumps({"tts_import_ms": (time.perf_counter() - t0) * 1000}))
+"""
+
+
+def _run_probe(code):
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AICoordinator startup-time benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    samples = [_run_probe(_PROBE) for _ in range(args.runs)]
+    import_ms = [s["import_ms"] for s in samples]
+    init_ms = [s["init_ms"] for s in samples]
+    print(f"import ai_coordinator: median {statistics.median(import_ms):.1f} ms")
+    print(f"AICoordinator():       median {statistics.median(init_ms):.1f} ms")
+    print(f"TTS stack imported at startup: {samples[-1]['tts_imported'] or samples[-1]['playsound_imported']}")
+
+    try:
+        eager = [_run_probe(_EAGER_TTS_PROBE)["tts_import_ms"] for _ in range(args.runs)]
+        print(f"deferred TTS import cost: median {statistics.median(eager):.1f} ms")
+    except subprocess.CalledProcessError as e:
+        print(f"TTS import probe failed: {e.stderr.strip().splitlines()[-1]}")
+
+
+if __name__ == "__main__":
+    main()
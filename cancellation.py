@@ -0,0 +1,98 @@
+# cancellation.py
+#
+# Cooperative cancellation. A CancellationToken travels with a request as
+# message["cancel_token"], from the API or the GUI through AICoordinator into
+# the modules. Long-running work checks the token between units of work (each
+# streamed chunk, each speech segment) and stops with RequestCancelled, closing
+# whatever upstream stream or playback it holds. Nothing is interrupted
+# preemptively: work stops at its next checkpoint.
+
+import threading
+
+
+class RequestCancelled(Exception):
+    """Raised by code that noticed its request's CancellationToken was cancelled."""
+
+    def __init__(self, reason=None):
+        super().__init__(f"Request cancelled: {reason}" if reason else "Request cancelled")
+        self.reason = reason
+
+
+class CancellationToken:
+    """
+    Thread-safe cancellation flag shared by everything working on one request.
+
+    Args:
+        parent: Optional token whose cancellation also cancels this one, so a
+            narrower scope (e.g. one deadline-bound call) can be cancelled
+            without cancelling the whole request.
+    """
+
+    def __init__(self, parent=None):
+        self._event = threading.Event()
+        self._reason = None
+        self.parent = parent
+
+    def cancel(self, reason=None):
+        """Cancels the token. Returns False if it was already cancelled."""
+        if self._event.is_set():
+            return False
+        self._reason = reason
+        self._event.set()
+        return True
+
+    @property
+    def cancelled(self):
+        return self._event.is_set() or (self.parent is not None and self.parent.cancelled)
+
+    @property
+    def reason(self):
+        if self._event.is_set() or self.parent is None:
+            return self._reason
+        return self.parent.reason
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise RequestCancelled(self.reason)
+
+
+def check_cancelled(message):
+    """Raises RequestCancelled if the message carries a cancelled token."""
+    token = message.get("cancel_token")
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+class CancellationRegistry:
+    """
+    Tokens of in-flight API requests by client-supplied request id, so a
+    separate cancel call can reach a request that is still running.
+    """
+
+    def __init__(self):
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def register(self, request_id):
+        """Returns a fresh token, registered under request_id unless it is None."""
+        token = CancellationToken()
+        if request_id is not None:
+            with self._lock:
+                self._tokens[request_id] = token
+        return token
+
+    def release(self, request_id, token):
+        """Forgets a finished request's token."""
+        with self._lock:
+            if request_id is not None and self._tokens.get(request_id) is token:
+                del self._tokens[request_id]
+
+    def cancel(self, request_id, reason=None):
+        """Cancels the in-flight request with this id. Returns False if there is none."""
+        with self._lock:
+            token = self._tokens.get(request_id)
+        return token is not None and token.cancel(reason)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tokens)
@@ -0,0 +1,272 @@
+# conversation_archive.py
+#
+# Cold storage for conversations. Sessions idle past a threshold are moved out
+# of local_storage/conversations into compressed, append-only per-user segment
+# files under local_storage/archive/user_<id>/. A small JSON index maps each
+# session to its (segment, offset, length) record so one session can be read
+# without decompressing anything else.
+
+import base64
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from array import array
+
+from file_locks import KeyedFileLock, atomic_write_json
+
+KEEP_VECTORS = "keep"
+QUANTIZE_VECTORS = "quantize"
+DROP_VECTORS = "drop"
+
+
+class RetentionPolicy:
+    """
+    Args:
+        archive_after: Seconds since a session was last written before it is archived.
+        delete_after: Seconds since a session was last written before it is
+            deleted outright, hot or archived. None keeps sessions forever.
+        vector_policy: What happens to contentVector in archived turns:
+            KEEP_VECTORS, QUANTIZE_VECTORS (int8, about 8x smaller in JSON)
+            or DROP_VECTORS.
+    """
+
+    def __init__(self, archive_after=7 * 86400, delete_after=None, vector_policy=QUANTIZE_VECTORS):
+        if vector_policy not in (KEEP_VECTORS, QUANTIZE_VECTORS, DROP_VECTORS):
+            raise ValueError(f"Unknown vector policy '{vector_policy}'.")
+        self.archive_after = archive_after
+        self.delete_after = delete_after
+        self.vector_policy = vector_policy
+
+
+def quantize_vector(vector):
+    scale = max((abs(v) for v in vector), default=0.0) / 127 or 1.0
+    packed = array("b", (max(-127, min(127, round(v / scale))) for v in vector))
+    return {"int8": base64.b64encode(packed.tobytes()).decode("ascii"), "scale": scale}
+
+
+def dequantize_vector(vector):
+    if not isinstance(vector, dict) or "int8" not in vector:
+        return vector
+    packed = array("b")
+    packed.frombytes(base64.b64decode(vector["int8"]))
+    return [v * vector["scale"] for v in packed]
+
+
+class ConversationArchive:
+    """
+    Args:
+        archive_dir: Root directory for per-user segments and indexes.
+        max_segment_bytes: Size at which a user's active segment is closed
+            and a new one started.
+    """
+
+    def __init__(self, archive_dir, max_segment_bytes=64 * 1024 * 1024):
+        self.archive_dir = archive_dir
+        self.max_segment_bytes = max_segment_bytes
+        self.logger = logging.getLogger("conversation_archive")
+        self._indexes = {}  # str(user_id) -> {"sessions": {session_id: location}, "active": segment}
+        self._index_stamps = {}  # str(user_id) -> stat of index.json when it was last read or written
+        os.makedirs(archive_dir, exist_ok=True)
+        self._user_locks = KeyedFileLock(os.path.join(archive_dir, "locks"))
+
+    def _user_dir(self, user_id):
+        return os.path.join(self.archive_dir, f"user_{user_id}")
+
+    @contextlib.contextmanager
+    def _locked(self, user_id):
+        """
+        Serializes access to a user's archive across threads and processes.
+        Other users' archives stay available; the index caches are only ever
+        touched under the owning user's lock.
+        """
+        with self._user_locks.hold(user_id):
+            yield
+
+    @staticmethod
+    def _stamp(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _index(self, user_id):
+        # Another process may have rewritten the index since it was cached.
+        path = os.path.join(self._user_dir(user_id), "index.json")
+        stamp = self._stamp(path)
+        index = self._indexes.get(str(user_id))
+        if index is None or stamp != self._index_stamps.get(str(user_id)):
+            try:
+                with open(path, "r") as f:
+                    index = json.load(f)
+            except FileNotFoundError:
+                index = {"sessions": {}, "active": 0}
+            self._indexes[str(user_id)] = index
+            self._index_stamps[str(user_id)] = stamp
+        return index
+
+    def _save_index(self, user_id):
+        path = os.path.join(self._user_dir(user_id), "index.json")
+        atomic_write_json(path, self._indexes[str(user_id)])
+        self._index_stamps[str(user_id)] = self._stamp(path)
+
+    def _segment_path(self, user_id, number):
+        return os.path.join(self._user_dir(user_id), f"segment_{number:06d}.seg")
+
+    def _append(self, user_id, session_id, entries, modified):
+        index = self._index(user_id)
+        os.makedirs(self._user_dir(user_id), exist_ok=True)
+        record = zlib.compress(json.dumps({"sessionId": session_id, "entries": entries}).encode("utf-8"))
+        path = self._segment_path(user_id, index["active"])
+        if os.path.exists(path) and os.path.getsize(path) + len(record) > self.max_segment_bytes:
+            index["active"] += 1
+            path = self._segment_path(user_id, index["active"])
+        with open(path, "ab") as f:
+            offset = f.tell()
+            f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+        index["sessions"][session_id] = {
+            "segment": index["active"], "offset": offset, "length": len(record), "modified": modified,
+        }
+
+    def _read(self, user_id, location):
+        with open(self._segment_path(user_id, location["segment"]), "rb") as f:
+            f.seek(location["offset"])
+            record = json.loads(zlib.decompress(f.read(location["length"])))
+        return record["entries"]
+
+    def archive_sessions(self, user_id, sessions):
+        """
+        Appends sessions to the user's active segment and records them in the index.
+
+        Args:
+            sessions: Iterable of (session_id, entries, modified) tuples.
+        """
+        with self._locked(user_id):
+            for session_id, entries, modified in sessions:
+                self._append(user_id, session_id, entries, modified)
+            self._save_index(user_id)
+
+    def load(self, user_id, session_id):
+        """Returns an archived session's entries with vectors dequantized, or None."""
+        with self._locked(user_id):
+            location = self._index(user_id)["sessions"].get(session_id)
+            if location is None:
+                return None
+            entries = self._read(user_id, location)
+        for entry in entries:
+            if "contentVector" in entry:
+                entry["contentVector"] = dequantize_vector(entry["contentVector"])
+        return entries
+
+    def remove(self, user_id, session_id):
+        """Drops a session from the index; its bytes are reclaimed by reclaim()."""
+        with self._locked(user_id):
+            removed = self._index(user_id)["sessions"].pop(session_id, None)
+            if removed is not None:
+                self._save_index(user_id)
+            return removed is not None
+
+    def sessions(self, user_id):
+        """Returns {session_id: last modified epoch seconds} for a user's archived sessions."""
+        with self._locked(user_id):
+            return {sid: loc["modified"] for sid, loc in self._index(user_id)["sessions"].items()}
+
+    def users(self):
+        prefix = "user_"
+        return [name[len(prefix):] for name in os.listdir(self.archive_dir) if name.startswith(prefix)]
+
+    def expire(self, user_id, cutoff):
+        """Removes archived sessions last modified before cutoff. Returns how many."""
+        with self._locked(user_id):
+            sessions = self._index(user_id)["sessions"]
+            expired = [sid for sid, loc in sessions.items() if loc["modified"] < cutoff]
+            for session_id in expired:
+                del sessions[session_id]
+            if expired:
+                self._save_index(user_id)
+            return len(expired)
+
+    def reclaim(self, user_id, min_live_fraction=0.5):
+        """
+        Deletes segments with no live sessions and rewrites closed segments
+        that are mostly dead into the active segment.
+
+        Returns:
+            Bytes of disk space freed.
+        """
+        with self._locked(user_id):
+            index = self._index(user_id)
+            live = {}
+            for session_id, location in index["sessions"].items():
+                live.setdefault(location["segment"], []).append(session_id)
+            freed = 0
+            for name in os.listdir(self._user_dir(user_id)):
+                if not name.startswith("segment_"):
+                    continue
+                number = int(name[len("segment_"):-len(".seg")])
+                if number == index["active"] and number in live:
+                    continue
+                path = self._segment_path(user_id, number)
+                size = os.path.getsize(path)
+                live_ids = live.get(number, [])
+                live_bytes = sum(index["sessions"][sid]["length"] for sid in live_ids)
+                if live_ids and live_bytes >= size * min_live_fraction:
+                    continue
+                for session_id in live_ids:
+                    location = index["sessions"][session_id]
+                    self._append(user_id, session_id, self._read(user_id, location), location["modified"])
+                # The index must point at the copies before the old segment goes away.
+                self._save_index(user_id)
+                os.remove(path)
+                freed += size - live_bytes
+            return freed
+
+
+def apply_vector_policy(entries, vector_policy):
+    for entry in entries:
+        vector = entry.get("contentVector")
+        if vector is None:
+            continue
+        if vector_policy == DROP_VECTORS:
+            del entry["contentVector"]
+        elif vector_policy == QUANTIZE_VECTORS and isinstance(vector, list):
+            entry["contentVector"] = quantize_vector(vector)
+    return entries
+
+
+class CompactionJob:
+    """Runs MemoryManager.compact_storage(policy) every interval seconds on a daemon thread."""
+
+    def __init__(self, memory_manager, policy, interval=3600.0):
+        self.memory_manager = memory_manager
+        self.policy = policy
+        self.interval = interval
+        self.logger = logging.getLogger("conversation_archive")
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="storage-compaction", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                stats = self.memory_manager.compact_storage(self.policy)
+                self.logger.info(f"Storage compaction finished in {time.monotonic() - started:.1f}s: {stats}")
+            except Exception as e:
+                self.logger.error(f"Storage compaction failed: {e}")
+            self._stop.wait(self.interval)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,118 @@
+# conversation_persistence.py
+#
+# Saves GUI conversation turns through MemoryManager on background threads,
+# so sending a message never waits on disk writes or embedding calls.
+
+import collections
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PAGE_SIZE = 50  # Turns read per load_session call
+
+
+class ConversationPersister:
+    """
+    Args:
+        manager_factory: Zero-argument callable returning a MemoryManager. It is
+            called on a worker thread the first time storage is needed, since
+            constructing a MemoryManager talks to Vertex AI.
+        user_id: Owner of the sessions saved and listed through this persister.
+        max_pending: Turns that may wait to be written before new ones are dropped.
+    """
+
+    def __init__(self, manager_factory, user_id, max_pending=1000):
+        self.manager_factory = manager_factory
+        self.user_id = user_id
+        self.logger = logging.getLogger("conversation_persistence")
+        self._manager = None
+        self._manager_lock = threading.Lock()
+        self._writes = queue.Queue(maxsize=max_pending)
+        # Reads get their own thread so opening a session never queues behind
+        # a backlog of embedding calls.
+        self._reads = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-read")
+        self._writer = threading.Thread(target=self._write_loop, name="conversation-write", daemon=True)
+        self._writer.start()
+        self.dropped = 0
+        self._pending = collections.Counter()  # session_id -> turns queued but not yet written
+        self._pending_changed = threading.Condition()
+
+    def _get_manager(self):
+        with self._manager_lock:
+            if self._manager is None:
+                self._manager = self.manager_factory()
+            return self._manager
+
+    def save_turn(self, session_id, entry_id, content, role):
+        """Queues a turn to be saved. Never blocks; drops the turn if the queue is full."""
+        with self._pending_changed:
+            try:
+                self._writes.put_nowait((session_id, entry_id, content, role))
+            except queue.Full:
+                self.dropped += 1
+                self.logger.warning(f"Persistence queue full, dropped turn {entry_id} of session {session_id}.")
+                return
+            self._pending[session_id] += 1
+
+    def _write_loop(self):
+        while True:
+            job = self._writes.get()
+            try:
+                if job is None:
+                    return
+                session_id, entry_id, content, role = job
+                self._get_manager().save_conversation_entry(self.user_id, session_id, entry_id, content, role)
+            except Exception as e:
+                self.logger.error(f"Failed to save conversation turn: {e}")
+            finally:
+                if job is not None:
+                    with self._pending_changed:
+                        self._pending[job[0]] -= 1
+                        if not self._pending[job[0]]:
+                            del self._pending[job[0]]
+                        self._pending_changed.notify_all()
+                self._writes.task_done()
+
+    def _wait_for_session_writes(self, session_id):
+        # Only this session's queued turns; a backlog in other sessions doesn't hold up the read.
+        with self._pending_changed:
+            self._pending_changed.wait_for(lambda: not self._pending[session_id])
+
+    def list_sessions(self):
+        """Returns a Future resolving to MemoryManager.list_sessions(user_id)."""
+        return self._reads.submit(lambda: self._get_manager().list_sessions(self.user_id))
+
+    def load_session(self, session_id, limit=PAGE_SIZE, before=None):
+        """
+        Returns a Future resolving to (turns, cursor): up to `limit` of the
+        session's turns before `before` (the latest ones by default), oldest
+        first, as (entry_id, role, content) triples. Pass cursor back as
+        `before` for the next older page; it is None at the session's start.
+
+        Turns of this session still queued for writing are written first, so
+        the page includes everything saved so far.
+        """
+        def load():
+            self._wait_for_session_writes(session_id)
+            entries, cursor = self._get_manager().load_conversation_page(self.user_id, session_id, limit, before)
+            return [(entry.get("id"), entry.get("role"), entry.get("content") or "") for entry in entries], cursor
+        return self._reads.submit(load)
+
+    def flush(self):
+        """Blocks until every queued turn has been written (for shutdown and tests)."""
+        self._writes.join()
+
+    def close(self, timeout=30.0):
+        """Stops the workers after writing whatever is already queued."""
+        self._writes.put(None)
+        self._writer.join(timeout=timeout)
+        self._reads.shutdown(wait=False)
+
+
+def poll_future(root, future, callback, interval_ms=50):
+    """Calls callback(future) on the Tk thread once future completes."""
+    if future.done():
+        callback(future)
+    else:
+        root.after(interval_ms, poll_future, root, future, callback, interval_ms)
@@ -0,0 +1,240 @@
+import tkinter as tk
+
+ROLE_LABELS = {"user": "You", "assistant": "Assistant"}
+
+
+class ConversationModel:
+    """
+    Holds the turns of a conversation independently of any widget, so views
+    can show just a window of it and saving can stream turn by turn.
+    """
+
+    def __init__(self):
+        self.turns = []  # each turn: {"role": str, "parts": [str]}
+
+    def __len__(self):
+        return len(self.turns)
+
+    def append_turn(self, role, text=""):
+        self.turns.append({"role": role, "parts": [text] if text else []})
+        return len(self.turns) - 1
+
+    def append_to_last(self, chunk):
+        self.turns[-1]["parts"].append(chunk)
+
+    def finish_last(self):
+        """Collapse a streamed turn's chunks into one string."""
+        if self.turns:
+            parts = self.turns[-1]["parts"]
+            parts[:] = ["".join(parts)] if parts else []
+
+    def turn_text(self, index):
+        return "".join(self.turns[index]["parts"])
+
+    def format_turn(self, index):
+        role = self.turns[index]["role"]
+        return f"{ROLE_LABELS.get(role, role)}:\n{self.turn_text(index)}\n\n"
+
+    def iter_text(self, start=0):
+        """Yields the formatted conversation one turn at a time."""
+        for index in range(start, len(self.turns)):
+            yield self.format_turn(index)
+
+    def load_turns(self, turns):
+        """Replace the conversation with (role, text) pairs, e.g. a reopened session."""
+        self.turns = [{"role": role, "parts": [text] if text else []} for role, text in turns]
+
+    def prepend_turns(self, turns):
+        """Insert older (role, text) pairs before the current turns, e.g. a page of stored history."""
+        self.turns[:0] = [{"role": role, "parts": [text] if text else []} for role, text in turns]
+
+    def clear(self):
+        self.turns.clear()
+
+
+class ConversationView:
+    """
+    Renders a ConversationModel into a Text widget, keeping at most
+    max_visible_turns in the widget. Scrolling to the top pages older turns
+    back in and scrolling to the bottom pages newer ones back in; either way
+    the other end is trimmed back to the window.
+
+    on_history_start, if given, is called when the user scrolls to the top of
+    the model, so older turns still in storage can be fetched; add them with
+    turns_prepended().
+    """
+
+    def __init__(self, text_widget, model, max_visible_turns=40, page_size=20, on_history_start=None):
+        self.text = text_widget
+        self.model = model
+        self.on_history_start = on_history_start
+        self.max_visible_turns = max_visible_turns
+        self.page_size = page_size
+        self.first_visible = len(model)
+        self.end_visible = len(model)  # One past the last turn in the widget
+        self._loading = False
+        scrollbar = getattr(text_widget, "vbar", None)
+        self._scrollbar_set = scrollbar.set if scrollbar is not None else None
+        self.text.config(yscrollcommand=self._on_scroll)
+
+    def _mark(self, index):
+        return f"turn{index}"
+
+    def _write(self, callback):
+        state = self.text.cget("state")
+        self.text.config(state="normal")
+        try:
+            callback()
+        finally:
+            self.text.config(state=state)
+
+    @property
+    def at_tail(self):
+        """True when the newest turn is in the widget."""
+        return self.end_visible >= len(self.model)
+
+    def render_tail(self):
+        """Show the most recent window of turns."""
+        def render():
+            self.text.delete("1.0", tk.END)
+            for name in self.text.mark_names():
+                if name.startswith("turn"):
+                    self.text.mark_unset(name)
+            self.first_visible = self.end_visible = len(self.model)
+            self._prepend(max(0, len(self.model) - self.max_visible_turns))
+            self.text.see(tk.END)
+        self._write(render)
+
+    def clear(self):
+        self.model.clear()
+        self.render_tail()
+
+    def append_turn(self, role, text=""):
+        index = self.model.append_turn(role, text)
+        if self.end_visible < index:
+            self.render_tail()  # Scrolled back into history: jump to the new turn
+            return index
+
+        def insert():
+            self._append_rendered(index)
+            self._trim()
+            self.text.see(tk.END)
+        self._write(insert)
+        return index
+
+    def append_to_last(self, chunk):
+        """Add streamed text to the last turn, before its trailing blank line."""
+        self.model.append_to_last(chunk)
+        if not self.at_tail:
+            return  # The turn is rendered from the model when paged back in
+        self._write(lambda: self.text.insert("end-3c", chunk))
+        self.text.see(tk.END)
+
+    def _append_rendered(self, index):
+        self.text.mark_set(self._mark(index), "end-1c")
+        self.text.mark_gravity(self._mark(index), "left")
+        self.text.insert(tk.END, self.model.format_turn(index))
+        self.end_visible = index + 1
+
+    def _trim(self):
+        """Drop the oldest rendered turns beyond the window."""
+        excess = (self.end_visible - self.first_visible) - self.max_visible_turns
+        if excess <= 0:
+            return
+        new_first = self.first_visible + excess
+        self.text.delete("1.0", self._mark(new_first))
+        for index in range(self.first_visible, new_first):
+            self.text.mark_unset(self._mark(index))
+        self.first_visible = new_first
+
+    def _trim_newest(self):
+        """Drop the newest rendered turns beyond the window."""
+        excess = (self.end_visible - self.first_visible) - self.max_visible_turns
+        if excess <= 0:
+            return
+        new_end = self.end_visible - excess
+        self.text.delete(self._mark(new_end), tk.END)
+        for index in range(new_end, self.end_visible):
+            self.text.mark_unset(self._mark(index))
+        self.end_visible = new_end
+
+    def _prepend(self, new_first):
+        """Insert turns [new_first, first_visible) at the top of the widget in one edit."""
+        if new_first >= self.first_visible:
+            return
+        pieces = []
+        offsets = []
+        length = 0
+        for index in range(new_first, self.first_visible):
+            offsets.append(length)
+            piece = self.model.format_turn(index)
+            pieces.append(piece)
+            length += len(piece)
+        self.text.insert("1.0", "".join(pieces))
+        for index, offset in zip(range(new_first, self.first_visible), offsets):
+            self.text.mark_set(self._mark(index), f"1.0 + {offset} chars")
+            self.text.mark_gravity(self._mark(index), "left")
+        if self.first_visible < self.end_visible:
+            self.text.mark_set(self._mark(self.first_visible), f"1.0 + {length} chars")
+        self.first_visible = new_first
+
+    def turns_prepended(self, count):
+        """Renumbers the rendered turns after count turns were inserted at the start of the model, then shows them."""
+        if count <= 0:
+            return
+        rendered = range(self.first_visible, self.end_visible)
+        for index in rendered:  # Via temporary names, so no mark is overwritten before it moves
+            self.text.mark_set(f"moving{index}", self._mark(index))
+            self.text.mark_unset(self._mark(index))
+        for index in rendered:
+            self.text.mark_set(self._mark(index + count), f"moving{index}")
+            self.text.mark_gravity(self._mark(index + count), "left")
+            self.text.mark_unset(f"moving{index}")
+        self.first_visible += count
+        self.end_visible += count
+        self.load_older()
+
+    def load_older(self):
+        """Page in the previous page_size turns, keeping the current view in place."""
+        if self.first_visible == 0:
+            if self.on_history_start is not None:
+                self.on_history_start()
+            return
+        anchor = self._mark(self.first_visible)
+
+        def page():
+            self._prepend(max(0, self.first_visible - self.page_size))
+            self._trim_newest()
+        self._write(page)
+        self.text.yview(anchor)
+
+    def load_newer(self):
+        """Page in the next page_size turns after a scroll back, keeping the current view in place."""
+        if self.at_tail:
+            return
+        self.text.mark_set("view_top", self.text.index("@0,0"))
+
+        def page():
+            for index in range(self.end_visible, min(len(self.model), self.end_visible + self.page_size)):
+                self._append_rendered(index)
+            self._trim()
+        self._write(page)
+        self.text.yview("view_top")
+
+    def _on_scroll(self, first, last):
+        if self._scrollbar_set is not None:
+            self._scrollbar_set(first, last)
+        if self._loading:
+            return
+        if float(first) <= 0.0 and (self.first_visible > 0 or self.on_history_start is not None):
+            self._loading = True
+            self.text.after_idle(self._load_idle, self.load_older)
+        elif float(last) >= 1.0 and not self.at_tail:
+            self._loading = True
+            self.text.after_idle(self._load_idle, self.load_newer)
+
+    def _load_idle(self, load):
+        try:
+            load()
+        finally:
+            self._loading = False
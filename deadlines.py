@@ -0,0 +1,65 @@
+# deadlines.py
+#
+# Request deadlines. A message may carry "deadline", an absolute
+# time.monotonic() value set by the API from the client's timeout or by
+# AICoordinator from a per-module default. Modules read the time left to
+# budget their upstream calls (HTTP timeouts, hedging windows), and the
+# coordinator enforces the deadline by raising DeadlineExceeded.
+
+import threading
+import time
+from concurrent.futures import Future
+from sampling_profiler import follow_thread
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a request's deadline passes before its module has answered."""
+
+    def __init__(self, module=None, budget=None):
+        detail = f" waiting for '{module}'" if module else ""
+        if budget is not None:
+            detail += f" after {budget:.2f}s"
+        super().__init__(f"Deadline exceeded{detail}")
+        self.module = module
+        self.budget = budget
+
+
+def deadline_after(seconds):
+    """The deadline `seconds` from now."""
+    return time.monotonic() + seconds
+
+
+def time_left(deadline):
+    """Seconds until deadline (negative once it has passed), or None when there is no deadline."""
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check_deadline(deadline, module=None):
+    """Raises DeadlineExceeded if deadline has passed."""
+    if deadline is not None and time.monotonic() >= deadline:
+        raise DeadlineExceeded(module)
+
+
+def run_in_thread(fn, name="deadline-call"):
+    """
+    Runs fn() on a new daemon thread and returns a concurrent.futures.Future
+    for its result. Unlike a pool, a call that hangs past its deadline only
+    ties up its own thread, never the slots later calls need. A profiler
+    sampling the calling thread samples the new thread too.
+    """
+    future = Future()
+    parent_id = threading.get_ident()
+
+    def run():
+        follow_thread(parent_id)
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return future
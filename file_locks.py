@@ -0,0 +1,122 @@
+# file_locks.py
+#
+# Advisory file locks that work across processes (fcntl on POSIX, msvcrt on
+# Windows), plus atomic JSON writes. Used by MemoryManager so several API
+# workers can write conversation storage safely.
+
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _lock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return
+    f.seek(0)
+    while True:
+        try:
+            # LK_LOCK retries for ~10s and then raises; keep waiting like flock does.
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    """Exclusive lock on path, held across threads of this process and across processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def hold(self):
+        with self._thread_lock:
+            with open(self.path, "a+b") as f:
+                _lock_file(f)
+                try:
+                    yield
+                finally:
+                    _unlock_file(f)
+
+
+class StripedFileLock:
+    """
+    Maps keys onto a fixed set of lock files, so locking one session never
+    waits on another unless both hash to the same stripe. There are only
+    `stripes` lock files no matter how many sessions exist.
+    """
+
+    def __init__(self, lock_dir, stripes=1024):
+        os.makedirs(lock_dir, exist_ok=True)
+        self._locks = [FileLock(os.path.join(lock_dir, f"stripe_{i:04d}.lock")) for i in range(stripes)]
+
+    def hold(self, key):
+        # crc32 rather than hash(): every process must pick the same stripe.
+        return self._locks[zlib.crc32(str(key).encode("utf-8")) % len(self._locks)].hold()
+
+
+class KeyedFileLock:
+    """
+    One lock file per key, so holders of different keys never wait on each
+    other. Suited to a bounded key space such as user ids; lock files are
+    created on first use and kept.
+    """
+
+    def __init__(self, lock_dir):
+        os.makedirs(lock_dir, exist_ok=True)
+        self.lock_dir = lock_dir
+        self._locks = {}
+        self._locks_lock = threading.Lock()  # Guards the dict only, never held while locking
+
+    def hold(self, key):
+        key = str(key)
+        with self._locks_lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                # Hashed so any key makes a valid file name; every process derives the same one.
+                name = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+                lock = self._locks[key] = FileLock(os.path.join(self.lock_dir, f"{name}.lock"))
+        return lock.hold()
+
+
+def atomic_write_json(path, data, **dump_kwargs):
+    """
+    Writes data to a temporary file and renames it over path, so readers see
+    either the old file or the new one, never a partially written one.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        # dumps + one write: json.dump streams through the much slower pure-Python encoder.
+        f.write(json.dumps(data, **dump_kwargs))
+        f.flush()
+        os.fsync(f.fileno())
+    for attempt in range(10):
+        try:
+            os.replace(tmp_path, path)
+            return
+        except PermissionError:
+            # Windows refuses to replace a file another process has open.
+            if attempt == 9:
+                os.remove(tmp_path)
+                raise
+            time.sleep(0.01 * (attempt + 1))
@@ -2,14 +2,52 @@ import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox
 import os
 import platform
+import datetime
+import queue
+import threading
+from cancellation import CancellationToken, RequestCancelled
+from conversation_view import ConversationModel, ConversationView
+from conversation_persistence import poll_future
+
+# Streamed chunks are batched and drawn at most once per frame.
+STREAM_FRAME_MS = 33
+SPINNER_FRAMES = "|/-\\"
+
+def _turn_offset(turns):
+    """Stored turns before a loaded page, from its first entry id (the GUI saves turn n as id "n")."""
+    first_id = str(turns[0][0]) if turns else ""
+    return int(first_id) if first_id.isdigit() else 0
 
 class ModernUI:
-    def __init__(self, send_message_callback):
+    def __init__(self, send_message_callback, stream_message_callback=None, persister=None, speak_callback=None):
         """
         Creates a modern GUI for the Medical AI Assistant.
         send_message_callback: A function to be called when the "Send" button is clicked.
+        stream_message_callback: Optional function (user_input, cancel_token) returning an
+            iterator of response chunks. When given, it is used instead of
+            send_message_callback: it runs on a worker thread and the response is
+            streamed into the output area while the window stays responsive.
+            cancel_token is a CancellationToken, cancelled when the user cancels
+            or moves on to another request, conversation or session.
+        persister: Optional ConversationPersister. Streamed turns are saved through it in
+            the background, and File > Open Session reopens past sessions.
+        speak_callback: Optional function (text, cancel_token) that starts reading a
+            streamed answer aloud and returns a Future resolving to None or the error
+            once speech ends. Cancel stays active while it plays.
         """
         self.send_message_callback = send_message_callback
+        self.stream_message_callback = stream_message_callback
+        self.speak_callback = speak_callback
+        self._stream_queue = None
+        self._speech = None  # Future of the answer being spoken
+        self._cancel_token = None
+        self._busy = False
+        self._frame = 0
+        self.persister = persister
+        self.session_id = self._new_session_id()
+        self._turn_offset = 0  # Stored turns of this session older than the model's first turn
+        self._history_cursor = None  # Cursor for the next older page in storage, None when all loaded
+        self._history_loading = False
         self.setup_root()
         self.create_styles()
         self.create_menu()
@@ -68,6 +106,8 @@ class ModernUI:
         file_menu = tk.Menu(self.menu_bar, tearoff=0)
         file_menu.add_command(label="New Conversation", command=self.new_conversation)
         file_menu.add_command(label="Save Conversation", command=self.save_conversation)
+        if self.persister is not None:
+            file_menu.add_command(label="Open Session...", command=self.show_session_picker)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self.root.quit)
         self.menu_bar.add_cascade(label="File", menu=file_menu)
@@ -140,6 +180,16 @@ class ModernUI:
         )
         self.send_btn.pack(side=tk.LEFT, padx=5)
         
+        # Cancel button (only active while a response is being generated)
+        self.cancel_btn = ttk.Button(
+            button_frame, 
+            text="Cancel", 
+            command=self.cancel_message,
+            style='TButton',
+            state="disabled"
+        )
+        self.cancel_btn.pack(side=tk.LEFT, padx=5)
+        
         # Output section
         output_header = ttk.Frame(self.main_frame, style='Header.TFrame')
         output_header.grid(row=3, column=0, sticky="ew", pady=(10, 0))
@@ -168,6 +218,11 @@ class ModernUI:
         )
         self.output_text.grid(row=4, column=0, sticky="nsew", padx=5, pady=5)
         
+        # Turns live in the model; the widget only holds a bounded window of them
+        self.conversation = ConversationModel()
+        self.conversation_view = ConversationView(self.output_text, self.conversation,
+                                                  on_history_start=self._load_older_history)
+        
     def create_status_bar(self):
         """Create a status bar at the bottom of the window"""
         self.status_frame = ttk.Frame(self.root)
@@ -183,6 +238,10 @@ class ModernUI:
         
     def send_message(self):
         """Handle the send button click"""
+        if self.stream_message_callback is not None:
+            self.start_streaming()
+            return
+        
         # Enable the output text for modification
         self.output_text.config(state="normal")
         
@@ -199,6 +258,228 @@ class ModernUI:
         # Disable the output text to make it read-only
         self.output_text.config(state="disabled")
         
+    def start_streaming(self):
+        """Start generating a response on a worker thread without blocking the window"""
+        if self._busy:
+            return
+        user_input = self.input_text.get("1.0", tk.END).strip()
+        if not user_input:
+            return
+        
+        self._persist_turn(self.conversation_view.append_turn("user", user_input))
+        self.conversation_view.append_turn("assistant")
+        
+        self._busy = True
+        if self._cancel_token is not None:
+            self._cancel_token.cancel("superseded by a new request")  # Stops speech still playing
+        self._cancel_token = CancellationToken()
+        self._speech = None
+        # A fresh queue per request, so a cancelled worker's late chunks are ignored
+        self._stream_queue = queue.Queue()
+        self.send_btn.config(state="disabled")
+        self.cancel_btn.config(state="normal")
+        
+        worker = threading.Thread(
+            target=self._stream_worker,
+            args=(user_input, self._cancel_token, self._stream_queue),
+            daemon=True
+        )
+        worker.start()
+        self.root.after(STREAM_FRAME_MS, self._flush_stream, self._stream_queue)
+        
+    def _stream_worker(self, user_input, cancel_token, chunk_queue):
+        """Runs on a worker thread; hands chunks to the Tk thread through chunk_queue"""
+        failed = False
+        try:
+            chunks = self.stream_message_callback(user_input, cancel_token)
+            try:
+                for chunk in chunks:
+                    if cancel_token.cancelled:
+                        break
+                    chunk_queue.put(("chunk", chunk))
+            finally:
+                if hasattr(chunks, "close"):
+                    chunks.close()
+        except RequestCancelled:
+            pass  # The window already shows the turn as cancelled
+        except Exception as e:
+            failed = True
+            chunk_queue.put(("chunk", f"Error: {e}"))
+        chunk_queue.put(("done", failed))
+        
+    def _flush_stream(self, chunk_queue):
+        """Insert every chunk received since the last frame in a single widget update"""
+        if chunk_queue is not self._stream_queue:
+            return  # Request was cancelled
+        pending = []
+        finished = failed = False
+        try:
+            while True:
+                kind, payload = chunk_queue.get_nowait()
+                if kind == "chunk":
+                    pending.append(payload)
+                else:
+                    finished, failed = True, payload
+        except queue.Empty:
+            pass
+        
+        if pending:
+            self.conversation_view.append_to_last("".join(pending))
+        
+        if finished:
+            self._finish_streaming(False, failed)
+            return
+        
+        self._frame += 1
+        spinner = SPINNER_FRAMES[(self._frame // 4) % len(SPINNER_FRAMES)]
+        self.status_label.config(text=f"Generating response {spinner}  (Cancel to stop)")
+        self.root.after(STREAM_FRAME_MS, self._flush_stream, chunk_queue)
+        
+    def _finish_streaming(self, cancelled, failed=False):
+        self._busy = False
+        self._stream_queue = None
+        self.send_btn.config(state="normal")
+        self.cancel_btn.config(state="disabled")
+        if cancelled:
+            self.conversation_view.append_to_last(" [Cancelled]")
+        self.conversation.finish_last()
+        self._persist_turn(len(self.conversation) - 1)
+        self.status_label.config(text="Cancelled" if cancelled else "Ready")
+        answer = self.conversation.turn_text(len(self.conversation) - 1)
+        if self.speak_callback is not None and not (cancelled or failed) and answer.strip():
+            self._start_speech(answer)
+        
+    def _start_speech(self, text):
+        """Read an answer aloud; Cancel stays active until speech ends or fails"""
+        speech = self._speech = self.speak_callback(text, self._cancel_token)
+        self.cancel_btn.config(state="normal")
+        self.status_label.config(text="Speaking  (Cancel to stop)")
+        poll_future(self.root, speech, self._finish_speech)
+        
+    def _finish_speech(self, speech):
+        if speech is not self._speech:
+            return  # Cancelled, or superseded by a new request
+        self._speech = None
+        self.cancel_btn.config(state="disabled")
+        error = speech.result()
+        self.status_label.config(text=f"Speech failed: {error}" if error else "Ready")
+        
+    def _new_session_id(self):
+        return datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        
+    def _persist_turn(self, index):
+        """Queue a turn for saving; returns immediately"""
+        if self.persister is not None:
+            turn = self.conversation.turns[index]
+            entry_id = str(self._turn_offset + index)
+            self.persister.save_turn(self.session_id, entry_id, self.conversation.turn_text(index), turn["role"])
+        
+    def show_session_picker(self):
+        """List past sessions (loaded in the background) and reopen the chosen one"""
+        picker = tk.Toplevel(self.root)
+        picker.title("Open Session")
+        picker.geometry("400x350")
+        picker.transient(self.root)
+        picker.grid_columnconfigure(0, weight=1)
+        picker.grid_rowconfigure(0, weight=1)
+        
+        listbox = tk.Listbox(picker, font=('Arial', 10))
+        listbox.grid(row=0, column=0, sticky="nsew", padx=10, pady=10)
+        listbox.insert(tk.END, "Loading sessions...")
+        sessions = []
+        
+        def show_sessions(future):
+            if not listbox.winfo_exists():
+                return
+            listbox.delete(0, tk.END)
+            try:
+                sessions.extend(future.result())
+            except Exception as e:
+                listbox.insert(tk.END, f"Could not list sessions: {e}")
+                return
+            for session in sessions:
+                modified = datetime.datetime.fromtimestamp(session["modified"]).strftime("%Y-%m-%d %H:%M")
+                listbox.insert(tk.END, f"{modified}   {session['sessionId']}")
+            if not sessions:
+                listbox.insert(tk.END, "No saved sessions")
+        
+        def open_selected(event=None):
+            selection = listbox.curselection()
+            if selection and selection[0] < len(sessions):
+                picker.destroy()
+                self.open_session(sessions[selection[0]]["sessionId"])
+        
+        listbox.bind("<Double-Button-1>", open_selected)
+        button_frame = ttk.Frame(picker)
+        button_frame.grid(row=1, column=0, sticky="e", padx=10, pady=10)
+        ttk.Button(button_frame, text="Cancel", command=picker.destroy, style='TButton').pack(side=tk.RIGHT)
+        ttk.Button(button_frame, text="Open", command=open_selected, style='TButton').pack(side=tk.RIGHT, padx=5)
+        
+        poll_future(self.root, self.persister.list_sessions(), show_sessions)
+        
+    def open_session(self, session_id):
+        """
+        Reopen a saved session. Only its latest page of turns is read (in the
+        background, after any of its turns still waiting to be saved); older
+        pages are read when the user scrolls up to them.
+        """
+        self.cancel_message()
+        self.status_label.config(text=f"Opening session {session_id}...")
+        
+        def show_session(future):
+            try:
+                turns, cursor = future.result()
+            except Exception as e:
+                self.status_label.config(text=f"Could not open session: {e}")
+                return
+            self._start_session(session_id, _turn_offset(turns), cursor)
+            self.conversation.load_turns([(role, content) for _, role, content in turns])
+            self.conversation_view.render_tail()
+            self.status_label.config(text=f"Opened session {session_id}")
+        
+        poll_future(self.root, self.persister.load_session(session_id), show_session)
+        
+    def _start_session(self, session_id, turn_offset=0, history_cursor=None):
+        # Only ever on the Tk thread, which is also the only thread that queues turns.
+        self.session_id = session_id
+        self._turn_offset = turn_offset
+        self._history_cursor = history_cursor
+        self._history_loading = False
+        
+    def _load_older_history(self):
+        """Fetch the next older page of the open session from storage when the user scrolls to the top"""
+        if self.persister is None or self._history_cursor is None or self._history_loading:
+            return
+        self._history_loading = True
+        session_id = self.session_id
+        
+        def show_older(future):
+            if session_id != self.session_id:
+                return  # Another session was opened meanwhile
+            self._history_loading = False
+            try:
+                turns, cursor = future.result()
+            except Exception as e:
+                self.status_label.config(text=f"Could not load older turns: {e}")
+                return
+            self._history_cursor = cursor
+            self._turn_offset = _turn_offset(turns)
+            self.conversation.prepend_turns([(role, content) for _, role, content in turns])
+            self.conversation_view.turns_prepended(len(turns))
+        
+        poll_future(self.root, self.persister.load_session(session_id, before=self._history_cursor), show_older)
+        
+    def cancel_message(self):
+        """Stop the response currently being generated, and any speech still playing"""
+        if self._cancel_token is not None:
+            self._cancel_token.cancel("cancelled by user")
+        if self._busy:
+            self._finish_streaming(True)
+        elif self._speech is not None:
+            self._speech = None  # Playback stops after the segment that is playing
+            self.cancel_btn.config(state="disabled")
+            self.status_label.config(text="Cancelled")
+        
     def show_log(self):
         """Creates a new window to display the log."""
         log_window = tk.Toplevel(self.root)
@@ -215,11 +496,6 @@ class ModernUI:
         log_window.grid_rowconfigure(0, weight=1)
         log_window.grid_rowconfigure(1, weight=0)
         
-        # Get content from output
-        self.output_text.config(state="normal")
-        log_content = self.output_text.get("1.0", tk.END)
-        self.output_text.config(state="disabled")
-        
         # Log text area
         log_text = scrolledtext.ScrolledText(
             log_window, 
@@ -229,7 +505,15 @@ class ModernUI:
             wrap=tk.WORD
         )
         log_text.grid(row=0, column=0, sticky="nsew", padx=10, pady=10)
-        log_text.insert(tk.END, log_content)
+        if self.stream_message_callback is not None:
+            # Page through the conversation model instead of copying it all
+            ConversationView(log_text, self.conversation).render_tail()
+            log_content = None
+        else:
+            self.output_text.config(state="normal")
+            log_content = self.output_text.get("1.0", tk.END)
+            self.output_text.config(state="disabled")
+            log_text.insert(tk.END, log_content)
         log_text.config(state="disabled")  # Make it read-only
         
         # Button frame
@@ -249,13 +533,13 @@ class ModernUI:
         save_btn = ttk.Button(
             button_frame, 
             text="Save Log", 
-            command=lambda: self.save_log(log_content),
+            command=self.save_conversation if log_content is None else lambda: self.save_log(log_content),
             style='TButton'
         )
         save_btn.pack(side=tk.RIGHT, padx=5)
         
     def save_log(self, content):
-        """Save the log content to a file"""
+        """Save the log content (a string or an iterable of strings) to a file"""
         from tkinter import filedialog
         import datetime
         
@@ -271,7 +555,10 @@ class ModernUI:
         
         if filename:
             with open(filename, 'w') as f:
-                f.write(content)
+                if isinstance(content, str):
+                    f.write(content)
+                else:
+                    f.writelines(content)
             messagebox.showinfo("Save Log", f"Log saved successfully to {filename}")
             
     def clear_input(self):
@@ -279,10 +566,10 @@ class ModernUI:
         self.input_text.delete("1.0", tk.END)
         
     def clear_output(self):
-        """Clear the output text area"""
-        self.output_text.config(state="normal")
-        self.output_text.delete("1.0", tk.END)
-        self.output_text.config(state="disabled")
+        """Clear the output text area; later turns go to a new session so saved ids never repeat"""
+        self.cancel_message()
+        self.conversation_view.clear()
+        self._start_session(self._new_session_id())
         
     def new_conversation(self):
         """Start a new conversation by clearing both input and output"""
@@ -292,6 +579,10 @@ class ModernUI:
             
     def save_conversation(self):
         """Save the current conversation"""
+        if self.stream_message_callback is not None:
+            # Written turn by turn straight from the model
+            self.save_log(self.conversation.iter_text())
+            return
         self.output_text.config(state="normal")
         content = self.output_text.get("1.0", tk.END)
         self.output_text.config(state="disabled")
@@ -326,6 +617,10 @@ class ModernUI:
         # Start the main loop
         self.root.mainloop()
         
+        # Don't keep the process alive to finish speaking after the window closes
+        if self._cancel_token is not None:
+            self._cancel_token.cancel("window closed")
+        
     def get_widgets(self):
         """Return the main widgets for external access"""
         return self.root, self.input_text, self.output_text
@@ -398,4 +693,4 @@ if __name__ == "__main__":
         output_text.see(tk.END)  # Scroll to the end
         
     ui = ModernUI(dummy_callback)
-    ui.run()
\ No newline at end of file
+    ui.run()
@@ -1,10 +1,15 @@
 # gui_module.py
 import tkinter as tk
+import getpass
 import os
+import threading
+from concurrent.futures import Future
 from dotenv import load_dotenv
 from ai_coordinator import AICoordinator
-from vertex_ai_module import VertexAIClient
 from gui_design import ModernUI  # Import ModernUI class directly
+from conversation_persistence import ConversationPersister
+from cancellation import RequestCancelled
+from deadlines import DeadlineExceeded
 
 def main():
     load_dotenv()
@@ -17,8 +22,15 @@ def main():
 
     coordinator = AICoordinator()
 
-    client_module = VertexAIClient(project, location)
-    coordinator.register_module("vertex_ai", client_module)
+    def create_vertex_module():
+        # Deferred so the window appears before google.genai is imported.
+        from vertex_ai_module import VertexAIClient
+        return VertexAIClient(project, location)
+
+    coordinator.register_module_factory("vertex_ai", create_vertex_module)
+    # A stalled call ends with an error in the window instead of a turn that never finishes.
+    coordinator.set_module_timeout("vertex_ai", float(os.environ.get("VERTEX_TIMEOUT", "120")))
+    coordinator.set_module_timeout("text_to_speech", float(os.environ.get("TTS_TIMEOUT", "30")))
     coordinator.set_context("system_instruction", """You are an AI assistant specialized in the field of anti-regression medical treatment and diagnosing health issues. Your role is to assist medical specialists and patients by leveraging your advanced testing and analytical skillset to identify health issues and provide practical, efficient, and evidence-based treatment plans, with a strong focus on long-term health outcomes and preventative care.
 
         # Guidelines
@@ -119,11 +131,56 @@ def main():
             output_text.insert(tk.END, "\n")
             output_text.config(state="disabled")  # Make output read-only again
 
+    def speak(text, cancel_token):
+        """Speaks text without holding up the next request; the returned future resolves to None or the error once speech ends"""
+        done = Future()
+
+        def finish(error=None):
+            if not done.done():
+                done.set_result(error)
+
+        def run():
+            tts_message = {"target_module": "text_to_speech", "content": text, "cancel_token": cancel_token, "on_done": finish}
+            try:
+                if coordinator.route_message(tts_message) != "Audio Played":
+                    finish(RuntimeError("speech synthesis failed"))  # The coordinator has logged why
+            except RequestCancelled:
+                finish()  # The user moved on before speech started
+            except DeadlineExceeded:
+                finish()  # Speech came too late to be useful; the text is already shown
+            except Exception as e:
+                finish(e)
+
+        threading.Thread(target=run, daemon=True).start()
+        return done
+
+    def stream_message_callback(user_input, cancel_token):
+        """Runs on the UI's worker thread and yields response chunks as they arrive"""
+        message = {"target_module": "vertex_ai", "content": user_input, "cancel_token": cancel_token}
+        yield from coordinator.stream_message(message)
+
+    def create_memory_manager():
+        # Built on the persistence worker thread; it connects to Vertex AI
+        from memory_manager import MemoryManager
+        return MemoryManager(
+            project=project,
+            location=location,
+            index_endpoint_name=os.environ.get("VERTEX_INDEX_ENDPOINT", "YOUR_INDEX_ENDPOINT_NAME"),
+        )
+
+    persister = ConversationPersister(create_memory_manager, user_id=os.environ.get("MEDECI_USER_ID", getpass.getuser()))
+
     # Create the ModernUI instance directly
-    ui = ModernUI(send_message_callback)
+    ui = ModernUI(send_message_callback, stream_message_callback, persister, speak_callback=speak)
+
+    # Create the AI and TTS clients in the background while the window is drawn
+    coordinator.warm_up(background=True)
 
     # Run the application - this will start the mainloop
     ui.run()
 
+    # Finish writing any turns still queued
+    persister.close()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,13 +1,40 @@
 import json
+import math
 import os
+import threading
+import time
 from datetime import datetime
 from google.cloud import aiplatform
+from text_index import BM25Index
+from conversation_archive import ConversationArchive, apply_vector_policy
+from file_locks import StripedFileLock, atomic_write_json
+
+EMBEDDING_MODEL = "textembedding-gecko@001"  # or textembedding-gecko@002
+_embedding_models = {}
+
+
+def embed_text(text, model_name=EMBEDDING_MODEL):
+    """
+    Returns the embedding vector for text. Shared by MemoryManager and the
+    semantic response cache so both embed with the same model.
+    """
+    model = _embedding_models.get(model_name)
+    if model is None:
+        model = _embedding_models[model_name] = aiplatform.TextEmbeddingModel.from_pretrained(model_name)
+    return model.get_embeddings([text])[0].values
+
 
 class MemoryManager:
     def __init__(self, base_dir="local_storage", project="your-gcp-project", location="your-gcp-location", index_endpoint_name="YOUR_INDEX_ENDPOINT_NAME"):
         self.base_dir = base_dir
         self.conversations_dir = os.path.join(base_dir, "conversations")
         self.summaries_dir = os.path.join(base_dir, "summaries")
+        self.index_dir = os.path.join(base_dir, "index")
+        self._text_indexes = {}  # user_id -> BM25Index, opened on first use
+        self._text_indexes_lock = threading.Lock()
+        self.archive = ConversationArchive(os.path.join(base_dir, "archive"))
+        # Cross-process locks for session files, striped so unrelated sessions don't wait on each other.
+        self._session_locks = StripedFileLock(os.path.join(base_dir, "locks"))
         os.makedirs(self.conversations_dir, exist_ok=True)
         os.makedirs(self.summaries_dir, exist_ok=True)
         self.project = project
@@ -18,13 +45,19 @@ class MemoryManager:
     def _get_conversation_path(self, user_id, session_id):
         return os.path.join(self.conversations_dir, f"user_{user_id}_session_{session_id}.json")
 
+    def _get_transcript_path(self, user_id, session_id):
+        # One JSON line per turn without its embedding, so a session's latest
+        # turns can be read from the end of the file without loading the rest.
+        return os.path.join(self.conversations_dir, f"user_{user_id}_session_{session_id}.transcript.jsonl")
+
     def _get_summary_path(self, user_id, session_id, summary_id):
         return os.path.join(self.summaries_dir, f"user_{user_id}_session_{session_id}_summary_{summary_id}.json")
 
+    def _session_lock(self, user_id, session_id):
+        return self._session_locks.hold(f"{user_id}/{session_id}")
+
     def generate_embeddings(self, text):
-        model = aiplatform.TextEmbeddingModel.from_pretrained("textembedding-gecko@001") # or textembedding-gecko@002
-        embeddings = model.get_embeddings([text])
-        return embeddings[0].values
+        return embed_text(text)
 
     def save_conversation_entry(self, user_id, session_id, entry_id, content, role):
         path = self._get_conversation_path(user_id, session_id)
@@ -38,14 +71,31 @@ class MemoryManager:
             "contentVector": content_vector,
             "role": role,
         }
-        try:
-            with open(path, "r") as f:
-                data = json.load(f)
-        except FileNotFoundError:
-            data = []
-        data.append(entry)
-        with open(path, "w") as f:
-            json.dump(data, f, indent=2)
+        # The read-modify-write must not interleave with another writer of this
+        # session, in this process or any other.
+        with self._session_lock(user_id, session_id):
+            created = restored = False
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                # Resuming an archived session brings it back to hot storage.
+                data = self.archive.load(user_id, session_id) or []
+                created, restored = True, bool(data)
+            data.append(entry)
+            # Compact JSON: pretty-printing forces the pure-Python encoder, which
+            # dominated write time for files full of embedding vectors.
+            atomic_write_json(path, data)
+            if restored:
+                # Only once the hot copy is safely on disk; a failed write leaves the archive intact.
+                self.archive.remove(user_id, session_id)
+            transcript_path = self._get_transcript_path(user_id, session_id)
+            if created or not os.path.exists(transcript_path):
+                _write_transcript(transcript_path, data)
+            else:
+                with open(transcript_path, "a", encoding="utf-8") as f:
+                    f.write(_transcript_line(entry))
+        self._get_text_index(user_id).add({"type": "conversation", "sessionId": session_id, "id": entry_id}, content)
 
         # Matching Engine integration
         self.index_endpoint.deploy_index(deployed_index_id="conversation_vectors")
@@ -58,13 +108,67 @@ class MemoryManager:
             ]
         )
 
+    def list_sessions(self, user_id):
+        """
+        Lists a user's stored sessions, most recently updated first.
+
+        Returns:
+            A list of {"sessionId": ..., "modified": epoch seconds} dicts.
+        """
+        prefix = f"user_{user_id}_session_"
+        sessions = []
+        with os.scandir(self.conversations_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith(prefix) and entry.name.endswith(".json"):
+                    sessions.append({
+                        "sessionId": entry.name[len(prefix):-len(".json")],
+                        "modified": entry.stat().st_mtime,
+                    })
+        hot = {session["sessionId"] for session in sessions}
+        for session_id, modified in self.archive.sessions(user_id).items():
+            if session_id not in hot:
+                sessions.append({"sessionId": session_id, "modified": modified, "archived": True})
+        sessions.sort(key=lambda session: session["modified"], reverse=True)
+        return sessions
+
     def load_conversation(self, user_id, session_id):
         path = self._get_conversation_path(user_id, session_id)
         try:
             with open(path, "r") as f:
                 return json.load(f)
         except FileNotFoundError:
-            return []
+            return self.archive.load(user_id, session_id) or []
+
+    def load_conversation_page(self, user_id, session_id, limit=50, before=None):
+        """
+        Loads a session newest-first, one page at a time, without embeddings.
+
+        Hot sessions are read backwards from their transcript, so opening a
+        long session only reads its last `limit` turns. Archived sessions are
+        loaded whole.
+
+        Args:
+            limit: Most turns to return.
+            before: The cursor returned with the previous (newer) page, or
+                None for the latest turns.
+
+        Returns:
+            (entries, cursor): entries oldest first, each with "id", "role",
+            "content" and "timestamp"; cursor is None once the start of the
+            session has been reached.
+        """
+        path = self._get_conversation_path(user_id, session_id)
+        transcript_path = self._get_transcript_path(user_id, session_id)
+        with self._session_lock(user_id, session_id):
+            if not os.path.exists(transcript_path):
+                try:
+                    with open(path, "r") as f:
+                        data = json.load(f)
+                except FileNotFoundError:
+                    entries = self.archive.load(user_id, session_id) or []
+                    return [_transcript_entry(entry) for entry in entries], None
+                _write_transcript(transcript_path, data)  # Saved before transcripts existed; converted once
+            return _read_transcript_tail(transcript_path, limit, before)
 
     def save_summary(self, user_id, session_id, summary_id, summary):
         path = self._get_summary_path(user_id, session_id, summary_id)
@@ -75,8 +179,8 @@ class MemoryManager:
             "timestamp": datetime.utcnow().isoformat() + "Z",
             "summary": summary,
         }
-        with open(path, "w") as f:
-            json.dump(summary_data, f, indent=2)
+        atomic_write_json(path, summary_data, indent=2)
+        self._get_text_index(user_id).add({"type": "summary", "sessionId": session_id, "id": summary_id}, summary)
 
     def load_summary(self, user_id, session_id, summary_id):
         path = self._get_summary_path(user_id, session_id, summary_id)
@@ -84,4 +188,194 @@ class MemoryManager:
             with open(path, "r") as f:
                 return json.load(f)
         except FileNotFoundError:
-            return None
\ No newline at end of file
+            return None
+
+    def _get_text_index(self, user_id):
+        index = self._text_indexes.get(str(user_id))
+        if index is None:
+            # Loaded outside the shared lock so other users don't wait on this one's files.
+            # The index is per user, not per session: BM25's document frequencies and lengths
+            # span all of a user's sessions, so their writes are ordered by its own lock.
+            loaded = BM25Index(os.path.join(self.index_dir, f"user_{user_id}"))
+            with self._text_indexes_lock:
+                index = self._text_indexes.setdefault(str(user_id), loaded)
+        return index
+
+    def search_text(self, user_id, query, k=10, vector_weight=0.0):
+        """
+        Keyword search over a user's conversation entries and summaries, ranked by BM25.
+
+        Args:
+            vector_weight: Between 0 and 1. When above 0, the best keyword
+                matches are re-ranked by blending their normalized BM25 score
+                with the cosine similarity between the query embedding and the
+                entry's stored contentVector (summaries keep their BM25 score).
+
+        Returns:
+            Up to k dicts with "type" ("conversation" or "summary"),
+            "sessionId", "id" and "score", best first.
+        """
+        index = self._get_text_index(user_id)
+        if vector_weight <= 0:
+            return [dict(ref, score=score) for score, ref in index.search(query, k)]
+
+        candidates = index.search(query, k * 5)
+        if not candidates:
+            return []
+        query_vector = self.generate_embeddings(query)
+        top_score = candidates[0][0]
+        sessions = {}
+        results = []
+        for score, ref in candidates:
+            combined = score / top_score
+            if ref["type"] == "conversation":
+                if ref["sessionId"] not in sessions:
+                    sessions[ref["sessionId"]] = {
+                        entry.get("id"): entry.get("contentVector")
+                        for entry in self.load_conversation(user_id, ref["sessionId"])
+                    }
+                vector = sessions[ref["sessionId"]].get(ref["id"])
+                if vector:
+                    combined = (1 - vector_weight) * combined + vector_weight * _cosine(query_vector, vector)
+            results.append(dict(ref, score=combined))
+        results.sort(key=lambda result: result["score"], reverse=True)
+        return results[:k]
+
+    def rebuild_text_index(self, user_id):
+        """Indexes every stored conversation entry and summary of a user, e.g. history saved before the index existed."""
+        index = self._get_text_index(user_id)
+        prefix = f"user_{user_id}_session_"
+        for session in self.list_sessions(user_id):
+            for entry in self.load_conversation(user_id, session["sessionId"]):
+                index.add({"type": "conversation", "sessionId": session["sessionId"], "id": entry.get("id")},
+                          entry.get("content", ""))
+        with os.scandir(self.summaries_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith(prefix) and entry.name.endswith(".json"):
+                    with open(entry.path, "r") as f:
+                        summary = json.load(f)
+                    index.add({"type": "summary", "sessionId": summary.get("sessionId"), "id": summary.get("summaryId")},
+                              summary.get("summary", ""))
+        index.compact()
+
+    def compact_storage(self, policy, now=None):
+        """
+        Moves idle sessions into the compressed archive and deletes expired ones.
+
+        Args:
+            policy: A conversation_archive.RetentionPolicy.
+            now: Epoch seconds to measure idleness against (defaults to now).
+
+        Returns:
+            {"archived": n, "deleted": n, "bytes_freed": n}
+        """
+        now = time.time() if now is None else now
+        stats = {"archived": 0, "deleted": 0, "bytes_freed": 0}
+        to_archive = {}
+        with os.scandir(self.conversations_dir) as entries:
+            for entry in entries:
+                if not (entry.name.startswith("user_") and entry.name.endswith(".json")):
+                    continue
+                user_id, separator, session_id = entry.name[len("user_"):-len(".json")].partition("_session_")
+                if not separator:
+                    continue
+                stat = os.stat(entry.path)  # DirEntry.stat() leaves st_ino unset on Windows
+                age = now - stat.st_mtime
+                if policy.delete_after is not None and age > policy.delete_after:
+                    with self._session_lock(user_id, session_id):
+                        if not _unchanged(entry.path, stat):
+                            continue
+                        os.remove(entry.path)
+                        _remove_if_exists(self._get_transcript_path(user_id, session_id))
+                    self._get_text_index(user_id).remove_session(session_id, "conversation")
+                    stats["deleted"] += 1
+                    stats["bytes_freed"] += stat.st_size
+                elif age > policy.archive_after:
+                    to_archive.setdefault(user_id, []).append((session_id, entry.path, stat))
+
+        for user_id, sessions in to_archive.items():
+            batch = []
+            for session_id, path, stat in sessions:
+                with open(path, "r") as f:
+                    batch.append((session_id, apply_vector_policy(json.load(f), policy.vector_policy), stat.st_mtime))
+            self.archive.archive_sessions(user_id, batch)
+            for session_id, path, stat in sessions:
+                with self._session_lock(user_id, session_id):
+                    if _unchanged(path, stat):
+                        os.remove(path)
+                        _remove_if_exists(self._get_transcript_path(user_id, session_id))
+                        removed = True
+                    else:
+                        # A turn was saved while archiving; the hot file stays authoritative.
+                        self.archive.remove(user_id, session_id)
+                        removed = False
+                if not removed:
+                    continue
+                stats["archived"] += 1
+                stats["bytes_freed"] += stat.st_size
+
+        for user_id in self.archive.users():
+            if policy.delete_after is not None:
+                cutoff = now - policy.delete_after
+                expired = [sid for sid, modified in self.archive.sessions(user_id).items() if modified < cutoff]
+                stats["deleted"] += self.archive.expire(user_id, cutoff)
+                for session_id in expired:
+                    self._get_text_index(user_id).remove_session(session_id, "conversation")
+            stats["bytes_freed"] += self.archive.reclaim(user_id)
+        return stats
+
+
+def _transcript_entry(entry):
+    return {key: entry.get(key) for key in ("id", "role", "content", "timestamp")}
+
+
+def _transcript_line(entry):
+    return json.dumps(_transcript_entry(entry)) + "\n"
+
+
+def _write_transcript(path, entries):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("".join(_transcript_line(entry) for entry in entries))
+    os.replace(tmp_path, path)
+
+
+def _read_transcript_tail(path, limit, before=None, block_size=64 * 1024):
+    """Returns (entries, cursor) for the last `limit` lines of path ending at byte offset `before`."""
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END) if before is None else before
+        start, buffer = end, b""
+        # One more newline than lines wanted, so the first (possibly partial) line can be dropped.
+        while start > 0 and buffer.count(b"\n") <= limit:
+            step = min(block_size, start)
+            start -= step
+            f.seek(start)
+            buffer = f.read(step) + buffer
+    lines = buffer.split(b"\n")[:-1]
+    if start > 0:
+        lines = lines[1:]
+    lines = lines[-limit:] if limit else []
+    cursor = end - sum(len(line) + 1 for line in lines)
+    return [json.loads(line) for line in lines], cursor or None
+
+
+def _remove_if_exists(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _unchanged(path, stat):
+    """True if path is still the file described by stat (writes replace the inode)."""
+    try:
+        current = os.stat(path)
+    except FileNotFoundError:
+        return False
+    return (current.st_ino, current.st_mtime_ns, current.st_size) == (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
@@ -0,0 +1,192 @@
+# model_tiering.py
+#
+# Routing policy in front of VertexAIClient: each query is classified cheaply
+# and sent to a model tier with its own model, output budget and latency
+# target, so one-line questions don't pay for a full differential workup.
+
+import collections
+import logging
+import re
+import threading
+import time
+
+from usage_ledger import usage_tags
+
+QUICK = "quick"
+FULL = "full"
+
+# Terms that signal a request for a full clinical workup.
+COMPLEX_TERMS = (
+    "differential", "diagnos", "history", "symptom", "workup", "treatment plan",
+    "management", "complication", "lab result", "labs", "imaging", "prognosis",
+)
+
+
+class ModelTier:
+    def __init__(self, name, model, max_output_tokens, latency_target):
+        self.name = name
+        self.model = model
+        self.max_output_tokens = max_output_tokens
+        self.latency_target = latency_target  # seconds for the full response
+
+
+DEFAULT_TIERS = (
+    ModelTier(QUICK, "gemini-2.0-flash-lite-001", 1024, 3.0),
+    ModelTier(FULL, "gemini-2.0-flash-001", 8192, 20.0),
+)
+
+
+class KeywordLengthClassifier:
+    """
+    Sends short queries without workup-style terms to the quick tier and
+    everything else to the full tier.
+    """
+
+    def __init__(self, max_quick_words=30, complex_terms=COMPLEX_TERMS):
+        self.max_quick_words = max_quick_words
+        self._complex = re.compile("|".join(re.escape(term) for term in complex_terms), re.IGNORECASE)
+
+    def __call__(self, user_input):
+        if len(user_input.split()) > self.max_quick_words or self._complex.search(user_input):
+            return FULL
+        return QUICK
+
+
+class _TierStats:
+    def __init__(self, window):
+        self.requests = 0
+        self.target_misses = 0
+        self.latencies = collections.deque(maxlen=window)
+        self.first_chunk_latencies = collections.deque(maxlen=window)
+
+
+def _percentile(samples, percentile):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(percentile * len(ordered)))]
+
+
+class TieredVertexClient:
+    """
+    Module that classifies each query and forwards it to the underlying client
+    (a VertexAIClient or ResilientVertexClient) with the chosen tier's model
+    and output budget.
+
+    A message may force a tier with 'model_tier'.
+    """
+
+    def __init__(self, client, tiers=DEFAULT_TIERS, classifier=None, default_tier=FULL, latency_window=500):
+        self.client = client
+        self.tiers = {tier.name: tier for tier in tiers}
+        if default_tier not in self.tiers:
+            raise ValueError(f"Default tier '{default_tier}' is not configured.")
+        self.classifier = classifier or KeywordLengthClassifier()
+        self.default_tier = default_tier
+        self._stats = {name: _TierStats(latency_window) for name in self.tiers}
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger("model_tiering")
+
+    def select_tier(self, user_input, requested_tier=None):
+        name = requested_tier
+        if name is None:
+            try:
+                name = self.classifier(user_input)
+            except Exception as e:
+                self.logger.error(f"Tier classifier failed, using '{self.default_tier}': {e}")
+                name = self.default_tier
+        if name not in self.tiers:
+            self.logger.warning(f"Unknown model tier '{name}', using '{self.default_tier}'.")
+            name = self.default_tier
+        return self.tiers[name]
+
+    def _record(self, tier, first_chunk_latency, latency):
+        with self._lock:
+            stats = self._stats[tier.name]
+            stats.requests += 1
+            stats.latencies.append(latency)
+            if first_chunk_latency is not None:
+                stats.first_chunk_latencies.append(first_chunk_latency)
+            if latency > tier.latency_target:
+                stats.target_misses += 1
+
+    def generate_response(self, user_input, system_instruction, tier=None, usage_tags=None, cancel_token=None,
+                          deadline=None):
+        tier = self.select_tier(user_input, tier)
+        start = time.monotonic()
+        first_chunk_latency = None
+        for text in self.client.generate_response(
+            user_input, system_instruction, model=tier.model, max_output_tokens=tier.max_output_tokens,
+            usage_tags=usage_tags, cancel_token=cancel_token, deadline=deadline,
+        ):
+            if first_chunk_latency is None:
+                first_chunk_latency = time.monotonic() - start
+            yield text
+        self._record(tier, first_chunk_latency, time.monotonic() - start)
+
+    async def generate_response_async(self, user_input, system_instruction, tier=None, usage_tags=None,
+                                      cancel_token=None, deadline=None):
+        tier = self.select_tier(user_input, tier)
+        start = time.monotonic()
+        first_chunk_latency = None
+        async for text in self.client.generate_response_async(
+            user_input, system_instruction, model=tier.model, max_output_tokens=tier.max_output_tokens,
+            usage_tags=usage_tags, cancel_token=cancel_token, deadline=deadline,
+        ):
+            if first_chunk_latency is None:
+                first_chunk_latency = time.monotonic() - start
+            yield text
+        self._record(tier, first_chunk_latency, time.monotonic() - start)
+
+    def stream_message(self, message, context):
+        user_input = message.get("content")
+        system_instruction = context.get("system_instruction")
+        if not user_input:
+            yield "Error: No user input provided."
+            return
+
+        for text in self.generate_response(
+            user_input, system_instruction, tier=message.get("model_tier"), usage_tags=usage_tags(message),
+            cancel_token=message.get("cancel_token"), deadline=message.get("deadline"),
+        ):
+            yield text
+
+    def handle_message(self, message, context):
+        responses = ""
+        for text in self.stream_message(message, context):
+            responses += text
+        return responses
+
+    async def stream_message_async(self, message, context):
+        user_input = message.get("content")
+        system_instruction = context.get("system_instruction")
+        if not user_input:
+            yield "Error: No user input provided."
+            return
+
+        async for text in self.generate_response_async(
+            user_input, system_instruction, tier=message.get("model_tier"), usage_tags=usage_tags(message),
+            cancel_token=message.get("cancel_token"), deadline=message.get("deadline"),
+        ):
+            yield text
+
+    async def handle_message_async(self, message, context):
+        responses = ""
+        async for text in self.stream_message_async(message, context):
+            responses += text
+        return responses
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {
+                    "model": self.tiers[name].model,
+                    "requests": stats.requests,
+                    "latency_target": self.tiers[name].latency_target,
+                    "target_misses": stats.target_misses,
+                    "p50_latency": _percentile(stats.latencies, 0.5),
+                    "p95_latency": _percentile(stats.latencies, 0.95),
+                    "p50_first_chunk": _percentile(stats.first_chunk_latencies, 0.5),
+                }
+                for name, stats in self._stats.items()
+            }
@@ -0,0 +1,345 @@
+# resilient_vertex.py
+#
+# Wraps several VertexAIClient backends (regions and/or models) behind the same
+# interface. A request goes to the fastest healthy backend; if no first chunk
+# arrives within that backend's observed latency percentile, a hedged request
+# is sent to the next backend and whichever answers first wins while the other
+# is cancelled. Circuit breakers shed backends that keep failing.
+#
+# Blocking callers are served from one long-lived event loop on a background
+# thread: the genai client keeps its async HTTP connections per Client, so
+# they must always be used from the same loop.
+
+import asyncio
+import collections
+import logging
+import threading
+import time
+
+from usage_ledger import usage_tags
+from cancellation import RequestCancelled
+from deadlines import DeadlineExceeded, time_left
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class NoHealthyBackendError(Exception):
+    """Raised when every backend is failing or has its circuit open."""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()  # Shared by the API's request threads
+
+    def available(self):
+        """True if a request could be sent now (without reserving a half-open trial)."""
+        with self._lock:
+            if self.state == OPEN:
+                return self.clock() - self.opened_at >= self.reset_timeout
+            if self.state == HALF_OPEN:
+                return not self._trial_in_flight
+            return True
+
+    def allow(self):
+        """Reserves permission to send a request; only one trial is allowed while half-open."""
+        with self._lock:
+            if self.state == OPEN:
+                if self.clock() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == HALF_OPEN:
+                if self._trial_in_flight:
+                    return False
+                self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = self.clock()
+
+    def record_abandoned(self):
+        """A request was cancelled (lost a hedge race) before any outcome."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class _Backend:
+    def __init__(self, client, breaker, window):
+        self.client = client
+        self.name = getattr(client, "name", None) or f"{client.location}/{client.model}"
+        self.breaker = breaker
+        self.first_chunk_latencies = collections.deque(maxlen=window)
+        self.successes = 0
+        self.failures = 0
+        self.hedge_wins = 0
+
+    def latency_percentile(self, percentile):
+        if not self.first_chunk_latencies:
+            return None
+        samples = sorted(self.first_chunk_latencies)
+        index = min(len(samples) - 1, int(percentile * len(samples)))
+        return samples[index]
+
+
+class ResilientVertexClient:
+    """
+    Args:
+        backends: VertexAIClient instances (or anything with generate_response_async).
+        hedge_percentile: Hedge once the primary is slower than this percentile
+            of its own recent time-to-first-chunk.
+        default_hedge_delay: Hedge delay (seconds) until min_samples are observed.
+        max_hedges: Extra backends that may be raced against the primary.
+        first_chunk_timeout: Give up if no backend produced a chunk by then.
+    """
+
+    def __init__(self, backends, hedge_percentile=0.95, default_hedge_delay=2.0, min_samples=20,
+                 max_hedges=1, first_chunk_timeout=60.0, failure_threshold=5, reset_timeout=30.0,
+                 latency_window=200, clock=time.monotonic):
+        if not backends:
+            raise ValueError("ResilientVertexClient needs at least one backend.")
+        self.backends = [
+            _Backend(client, CircuitBreaker(failure_threshold, reset_timeout, clock), latency_window)
+            for client in backends
+        ]
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = default_hedge_delay
+        self.min_samples = min_samples
+        self.max_hedges = max_hedges
+        self.first_chunk_timeout = first_chunk_timeout
+        self.clock = clock
+        self.hedges_sent = 0
+        self.logger = logging.getLogger("resilient_vertex")
+        self._loop = None  # Event loop for blocking callers, started on first use
+        self._loop_lock = threading.Lock()
+
+    def _background_loop(self):
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="resilient-vertex-loop", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def _ordered_backends(self):
+        """Healthy backends, fastest median first; unmeasured backends follow in their configured order."""
+        healthy = [b for b in self.backends if b.breaker.available()]
+
+        def median_first(backend):
+            median = backend.latency_percentile(0.5)
+            return (median is None, median or 0.0)
+        return sorted(healthy, key=median_first)
+
+    def _hedge_delay(self, backend):
+        if len(backend.first_chunk_latencies) < self.min_samples:
+            return self.default_hedge_delay
+        return backend.latency_percentile(self.hedge_percentile)
+
+    async def _close_attempt(self, task, stream):
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        try:
+            await stream.aclose()
+        except Exception:
+            pass
+
+    async def _race_first_chunk(self, user_input, system_instruction, overrides):
+        """
+        Returns (backend, first_chunk, stream) for the first backend to produce
+        output. first_chunk is None if that backend's stream was empty.
+        """
+        candidates = self._ordered_backends()
+        pending = {}  # task -> (backend, stream, started)
+        start = self.clock()
+        # The request's own deadline, if sooner, bounds the race instead; running out of
+        # the caller's budget is not the backends' fault.
+        budget = time_left(overrides.get("deadline"))
+        caller_bound = budget is not None and budget < self.first_chunk_timeout
+        deadline = start + (max(0.0, budget) if caller_bound else self.first_chunk_timeout)
+        hedge_at = None
+        hedges = 0
+        last_error = None
+
+        def launch():
+            nonlocal hedge_at
+            while candidates:
+                backend = candidates.pop(0)
+                if not backend.breaker.allow():
+                    continue
+                stream = backend.client.generate_response_async(user_input, system_instruction, **overrides)
+                task = asyncio.ensure_future(stream.__anext__())
+                now = self.clock()
+                pending[task] = (backend, stream, now)
+                hedge_at = now + self._hedge_delay(backend)
+                return True
+            return False
+
+        if not launch():
+            raise NoHealthyBackendError("All Vertex backends have open circuits.")
+
+        try:
+            while pending:
+                now = self.clock()
+                wake_at = deadline
+                if candidates and hedges < self.max_hedges:
+                    wake_at = min(wake_at, hedge_at)
+                done, _ = await asyncio.wait(
+                    list(pending), timeout=max(0.0, wake_at - now), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    if self.clock() >= deadline:
+                        if caller_bound:
+                            raise DeadlineExceeded("vertex_ai", budget)
+                        for backend, _, _ in pending.values():
+                            backend.failures += 1
+                            backend.breaker.record_failure()
+                        raise TimeoutError(f"No Vertex backend responded within {self.first_chunk_timeout}s.")
+                    if launch():
+                        hedges += 1
+                        self.hedges_sent += 1
+                    continue
+
+                for task in done:
+                    backend, stream, started = pending.pop(task)
+                    try:
+                        first = task.result()
+                    except StopAsyncIteration:
+                        first = None
+                    except (RequestCancelled, DeadlineExceeded):
+                        # Not the backend's fault; don't count it against the breaker.
+                        backend.breaker.record_abandoned()
+                        raise
+                    except Exception as e:
+                        self.logger.warning(f"Vertex backend '{backend.name}' failed: {e}")
+                        backend.failures += 1
+                        backend.breaker.record_failure()
+                        last_error = e
+                        if not pending:
+                            launch()  # Fail over immediately rather than waiting to hedge
+                        continue
+                    backend.first_chunk_latencies.append(self.clock() - started)
+                    if hedges:
+                        backend.hedge_wins += 1
+                    return backend, first, stream
+        finally:
+            for task, (backend, stream, _) in list(pending.items()):
+                backend.breaker.record_abandoned()
+                await self._close_attempt(task, stream)
+
+        raise NoHealthyBackendError(f"All Vertex backends failed: {last_error}") from last_error
+
+    async def generate_response_async(self, user_input, system_instruction, **overrides):
+        """
+        Streams from the winning backend. Keyword overrides such as model or
+        max_output_tokens are forwarded to every backend tried.
+        """
+        backend, first, stream = await self._race_first_chunk(user_input, system_instruction, overrides)
+        recorded = False
+        try:
+            if first is not None:
+                yield first
+                async for chunk in stream:
+                    yield chunk
+            backend.successes += 1
+            backend.breaker.record_success()
+            recorded = True
+        except (RequestCancelled, DeadlineExceeded):
+            raise  # Not the backend's fault
+        except Exception:
+            backend.failures += 1
+            backend.breaker.record_failure()
+            recorded = True
+            raise
+        finally:
+            if not recorded:
+                # Cancelled, or the consumer stopped reading (GeneratorExit, CancelledError):
+                # no verdict on the backend, but a half-open trial must be released.
+                backend.breaker.record_abandoned()
+            await stream.aclose()
+
+    def generate_response(self, user_input, system_instruction, **overrides):
+        """
+        Blocking variant. The async stream runs on the client's background loop
+        and is pulled one chunk at a time; every blocking caller shares that loop.
+        """
+        loop = self._background_loop()
+        stream = self.generate_response_async(user_input, system_instruction, **overrides)
+        try:
+            while True:
+                try:
+                    yield asyncio.run_coroutine_threadsafe(stream.__anext__(), loop).result()
+                except StopAsyncIteration:
+                    break
+        finally:
+            asyncio.run_coroutine_threadsafe(stream.aclose(), loop).result()
+
+    def stream_message(self, message, context):
+        user_input = message.get("content")
+        system_instruction = context.get("system_instruction")
+        if not user_input:
+            yield "Error: No user input provided."
+            return
+
+        for text in self.generate_response(user_input, system_instruction, usage_tags=usage_tags(message),
+                                           cancel_token=message.get("cancel_token"),
+                                           deadline=message.get("deadline")):
+            yield text
+
+    def handle_message(self, message, context):
+        responses = ""
+        for text in self.stream_message(message, context):
+            responses += text
+        return responses
+
+    async def stream_message_async(self, message, context):
+        user_input = message.get("content")
+        system_instruction = context.get("system_instruction")
+        if not user_input:
+            yield "Error: No user input provided."
+            return
+
+        async for text in self.generate_response_async(user_input, system_instruction, usage_tags=usage_tags(message),
+                                                       cancel_token=message.get("cancel_token"),
+                                                       deadline=message.get("deadline")):
+            yield text
+
+    async def handle_message_async(self, message, context):
+        responses = ""
+        async for text in self.stream_message_async(message, context):
+            responses += text
+        return responses
+
+    def stats(self):
+        return {
+            "hedges_sent": self.hedges_sent,
+            "backends": {
+                b.name: {
+                    "state": b.breaker.state,
+                    "p50_first_chunk": b.latency_percentile(0.5),
+                    "p95_first_chunk": b.latency_percentile(0.95),
+                    "successes": b.successes,
+                    "failures": b.failures,
+                    "hedge_wins": b.hedge_wins,
+                }
+                for b in self.backends
+            },
+        }
@@ -0,0 +1,139 @@
+# response_sections.py
+#
+# Incremental parser for the sectioned answers the system instruction asks
+# for ("**Diagnosis**:", "**Reasoning**:", ...). It is fed streamed text as it
+# arrives and turns it into events a front end can render right away:
+#
+#   {"event": "section_start", "section": "Diagnosis"}
+#   {"event": "item", "section": "Diagnosis", "text": "Chronic bronchitis.", "level": 0}
+#   {"event": "section_end", "section": "Diagnosis"}
+#
+# Only the unfinished last line is kept between chunks, so each chunk costs
+# time proportional to its own length rather than to the answer so far.
+
+import re
+
+SECTIONS = (
+    "Diagnosis",
+    "Reasoning",
+    "Treatment Recommendations",
+    "Possible Complications",
+    "Preventative Measures",
+    "Disclaimer",
+)
+
+# "**Diagnosis**:", "**Possible Complications:**", "## Reasoning", "Disclaimer: text..."
+_HEADER = re.compile(
+    r"^\s*(?:#+\s*)?\**\s*(" + "|".join(re.escape(name) for name in SECTIONS) + r")\s*(?::\s*\**|\**\s*:|\**\s*$)(.*)$",
+    re.IGNORECASE,
+)
+_BULLET = re.compile(r"^(\s*)(?:[-*•]|\d+[.)])\s+(.*)$")
+_EMPHASIS = re.compile(r"\*\*(.+?)\*\*")
+_CANONICAL = {name.lower(): name for name in SECTIONS}
+
+
+def _clean(text):
+    return _EMPHASIS.sub(r"\1", text).strip()
+
+
+class SectionParser:
+    """
+    Turns streamed response text into section and item events.
+
+    Bullets and numbered lines each become an item, with level giving their
+    nesting; other text becomes one item per paragraph. Text before the first
+    recognised header is reported with section None.
+    """
+
+    def __init__(self):
+        self._buffer = ""  # Unfinished last line
+        self.section = None
+        self._item = None  # [text, level] not yet emitted; later lines may continue it
+        self._indents = []  # Indentation of each open list level
+
+    def feed(self, text):
+        """Adds a chunk of text. Returns the events completed by it."""
+        events = []
+        lines = (self._buffer + text).split("\n")
+        self._buffer = lines.pop()
+        for line in lines:
+            self._parse_line(line.rstrip("\r"), events)
+        return events
+
+    def close(self):
+        """Ends the stream. Returns the events for whatever was still pending."""
+        events = []
+        if self._buffer:
+            self._parse_line(self._buffer, events)
+            self._buffer = ""
+        self._flush_item(events)
+        if self.section is not None:
+            events.append({"event": "section_end", "section": self.section})
+            self.section = None
+        return events
+
+    def _parse_line(self, line, events):
+        header = _HEADER.match(line)
+        if header:
+            self._flush_item(events)
+            if self.section is not None:
+                events.append({"event": "section_end", "section": self.section})
+            self.section = _CANONICAL[header.group(1).lower()]
+            self._indents = []
+            events.append({"event": "section_start", "section": self.section})
+            rest = _clean(header.group(2))
+            if rest:
+                self._item = [rest, 0]
+            return
+        if not line.strip():
+            self._flush_item(events)  # A blank line ends a paragraph
+            return
+        bullet = _BULLET.match(line)
+        if bullet:
+            self._flush_item(events)
+            self._item = [_clean(bullet.group(2)), self._level(len(bullet.group(1).expandtabs(4)))]
+        elif self._item is not None:
+            self._item[0] = f"{self._item[0]} {_clean(line)}"  # Wrapped line or paragraph continued
+        else:
+            self._item = [_clean(line), 0]
+
+    def _level(self, indent):
+        while self._indents and self._indents[-1] > indent:
+            self._indents.pop()
+        if not self._indents or self._indents[-1] < indent:
+            self._indents.append(indent)
+        return len(self._indents) - 1
+
+    def _flush_item(self, events):
+        if self._item is not None:
+            text, level = self._item
+            self._item = None
+            if text:
+                events.append({"event": "item", "section": self.section, "text": text, "level": level})
+
+
+def parse_sections(chunks):
+    """Yields events for an iterable of text chunks, e.g. from VertexAIClient.generate_response."""
+    parser = SectionParser()
+    try:
+        for chunk in chunks:
+            yield from parser.feed(chunk)
+        yield from parser.close()
+    finally:
+        # Stops the upstream stream too when the consumer leaves early.
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+async def parse_sections_async(chunks):
+    """Async counterpart of parse_sections for an async iterator of text chunks."""
+    parser = SectionParser()
+    try:
+        async for chunk in chunks:
+            for event in parser.feed(chunk):
+                yield event
+        for event in parser.close():
+            yield event
+    finally:
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()
@@ -0,0 +1,141 @@
+# sampling_profiler.py
+#
+# Low-overhead statistical profiler for live servers. While running, a daemon
+# thread wakes every `interval` seconds, snapshots the stacks of the profiled
+# threads with sys._current_frames(), and counts identical stacks. Nothing is
+# hooked into the interpreter, so there is no cost at all when it is not running.
+#
+# A profiler limited to some threads also follows work those threads hand
+# off through follow_thread() (e.g. AICoordinator's deadline-bound calls), so
+# a per-request profile still shows where the request's time goes.
+#
+# Output is in the "collapsed stack" format (`frame;frame;frame count`)
+# accepted by flamegraph.pl, speedscope and similar tools.
+
+import collections
+import os
+import sys
+import threading
+import time
+import uuid
+
+
+def _frame_label(code):
+    name = getattr(code, "co_qualname", code.co_name)
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{name}".replace(";", ":").replace(" ", "_")
+
+
+_active = set()  # Running profilers
+_active_lock = threading.Lock()
+
+
+def follow_thread(parent_id, thread_id=None):
+    """
+    Adds thread_id (default: the calling thread) to every running profiler
+    that samples parent_id. Call it first thing on a thread doing work on
+    behalf of parent_id.
+    """
+    thread_id = threading.get_ident() if thread_id is None else thread_id
+    with _active_lock:
+        for profiler in _active:
+            if profiler.thread_ids is not None and parent_id in profiler.thread_ids:
+                # Replaced rather than mutated, so the sampling loop never sees a set change size.
+                profiler.thread_ids = profiler.thread_ids | {thread_id}
+
+
+class SamplingProfiler:
+    """
+    Args:
+        interval: Seconds between samples.
+        thread_ids: Thread idents to sample; None samples every thread except
+            the profiler's own.
+        exclude_thread_ids: Thread idents never sampled, e.g. a thread that
+            only waits for the profile to finish.
+        max_depth: Deepest stack frames kept per sample.
+    """
+
+    def __init__(self, interval=0.005, thread_ids=None, exclude_thread_ids=(), max_depth=128):
+        self.interval = interval
+        self.thread_ids = set(thread_ids) if thread_ids is not None else None
+        self.exclude_thread_ids = set(exclude_thread_ids)
+        self.max_depth = max_depth
+        self.samples = 0
+        self._stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+        self._elapsed = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._started = time.perf_counter()
+        with _active_lock:
+            _active.add(self)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with _active_lock:
+            _active.discard(self)
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._elapsed = time.perf_counter() - self._started
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _run(self):
+        excluded = self.exclude_thread_ids | {threading.get_ident()}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in excluded or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                self._stacks[";".join(stack)] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        """Returns the collected stacks as collapsed-stack text, heaviest first."""
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def summary(self):
+        return {"samples": self.samples, "elapsed": self._elapsed, "interval": self.interval,
+                "distinct_stacks": len(self._stacks)}
+
+
+def profile_for(seconds, interval=0.005):
+    """Profiles every other thread for `seconds`, blocking the caller, and returns the collapsed stacks."""
+    with SamplingProfiler(interval, exclude_thread_ids=[threading.get_ident()]) as profiler:
+        time.sleep(seconds)
+    return profiler.collapsed()
+
+
+class ProfileStore:
+    """Keeps the most recent per-request profiles so they can be fetched by id."""
+
+    def __init__(self, max_profiles=20):
+        self.max_profiles = max_profiles
+        self._profiles = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, collapsed):
+        profile_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._profiles[profile_id] = collapsed
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+        return profile_id
+
+    def get(self, profile_id):
+        with self._lock:
+            return self._profiles.get(profile_id)
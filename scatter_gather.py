@@ -0,0 +1,137 @@
+# scatter_gather.py
+#
+# Fan one request out to several modules at once and gather their answers as
+# they arrive. The caller stops waiting once enough branches have answered, so
+# latency follows the fastest useful branch instead of the slowest one.
+
+import asyncio
+import logging
+
+logger = logging.getLogger("scatter_gather")
+
+
+class BranchResult:
+    """
+    Outcome of one branch of a scatter-gather request.
+
+    Attributes:
+        module: Name of the module the branch was sent to.
+        response: The joined response, or whatever was received before a
+            timeout or error (None if nothing was).
+        error: The exception that ended the branch, or None on success.
+        elapsed: Seconds from fan-out until the branch finished.
+        timed_out: True if the branch hit its timeout.
+    """
+
+    def __init__(self, module, response, error=None, elapsed=0.0, timed_out=False):
+        self.module = module
+        self.response = response
+        self.error = error
+        self.elapsed = elapsed
+        self.timed_out = timed_out
+
+    @property
+    def ok(self):
+        return self.error is None and self.response is not None
+
+    def __repr__(self):
+        status = "ok" if self.ok else ("timeout" if self.timed_out else f"error={self.error!r}")
+        return f"BranchResult({self.module!r}, {status}, elapsed={self.elapsed:.3f})"
+
+
+class QuorumNotMet(Exception):
+    """Fewer branches succeeded than the requested quorum."""
+
+    def __init__(self, quorum, results):
+        self.quorum = quorum
+        self.results = results
+        succeeded = sum(1 for result in results if result.ok)
+        super().__init__(f"{succeeded} of {quorum} required branches succeeded")
+
+
+def merge_by_module(results):
+    """Default merge: {module_name: response} for every successful branch."""
+    return {result.module: result.response for result in results if result.ok}
+
+
+def merge_labeled(results):
+    """Joins successful responses into one text, each under its module name."""
+    return "\n\n".join(f"[{result.module}]\n{result.response}" for result in results if result.ok)
+
+
+def first_response(results):
+    """Returns the response of the branch that finished first."""
+    for result in results:
+        if result.ok:
+            return result.response
+    return None
+
+
+def _join(parts):
+    if not parts:
+        return None
+    return parts[0] if len(parts) == 1 else "".join(parts)
+
+
+async def _run_branch(module_name, stream_branch, events, timeout, started):
+    loop = asyncio.get_running_loop()
+    parts = []
+
+    async def pump():
+        async for chunk in stream_branch(module_name):
+            parts.append(chunk)
+            await events.put((module_name, chunk))
+
+    try:
+        await asyncio.wait_for(pump(), timeout)
+        result = BranchResult(module_name, _join(parts), elapsed=loop.time() - started)
+    except asyncio.TimeoutError as e:
+        logger.warning(f"Branch '{module_name}' timed out after {timeout}s.")
+        result = BranchResult(module_name, _join(parts), e, loop.time() - started, timed_out=True)
+    except Exception as e:
+        logger.error(f"Branch '{module_name}' failed: {e}")
+        result = BranchResult(module_name, _join(parts), e, loop.time() - started)
+    await events.put(result)
+
+
+async def scatter(stream_branch, module_names, timeout=None, branch_timeouts=None, first_n=None):
+    """
+    Streams every branch concurrently and yields events in arrival order.
+
+    Args:
+        stream_branch: Callable taking a module name and returning an async
+            iterator over that module's response chunks.
+        module_names: Modules to fan out to.
+        timeout: Seconds each branch may run; None waits indefinitely.
+        branch_timeouts: Optional {module_name: seconds} overriding timeout.
+        first_n: Stop once this many branches have succeeded; the remaining
+            branches are cancelled.
+
+    Yields:
+        (module_name, chunk) tuples as chunks arrive, and a BranchResult when
+        each branch finishes. Closing the generator cancels unfinished branches.
+    """
+    branch_timeouts = branch_timeouts or {}
+    events = asyncio.Queue()
+    started = asyncio.get_running_loop().time()
+    tasks = [
+        asyncio.create_task(
+            _run_branch(name, stream_branch, events, branch_timeouts.get(name, timeout), started)
+        )
+        for name in module_names
+    ]
+    remaining = len(tasks)
+    succeeded = 0
+    try:
+        while remaining:
+            event = await events.get()
+            yield event
+            if isinstance(event, BranchResult):
+                remaining -= 1
+                succeeded += event.ok
+                if first_n is not None and succeeded >= first_n:
+                    return
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
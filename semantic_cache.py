@@ -0,0 +1,314 @@
+# semantic_cache.py
+#
+# Response cache keyed by meaning rather than exact text: a new question is
+# embedded and, if a previously answered question is similar enough (cosine
+# similarity above a threshold) under the same system instruction, the stored
+# answer is returned instead of running a full generation.
+#
+# Near neighbours are found with random-hyperplane LSH: each vector gets a
+# bit signature split into bands, and only entries sharing at least one band
+# bucket are compared exactly.
+
+import asyncio
+import collections
+import hashlib
+import logging
+import math
+import random
+import threading
+import time
+
+
+def _normalize(vector):
+    norm = math.sqrt(sum(v * v for v in vector))
+    return [v / norm for v in vector] if norm else list(vector)
+
+
+def _dot(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+
+class _Entry:
+    __slots__ = ("id", "scope", "query", "vector", "response", "created", "buckets", "hits")
+
+    def __init__(self, entry_id, scope, query, vector, response, created, buckets):
+        self.id = entry_id
+        self.scope = scope
+        self.query = query
+        self.vector = vector
+        self.response = response
+        self.created = created
+        self.buckets = buckets
+        self.hits = 0
+
+
+class SemanticCache:
+    """
+    Args:
+        embed: Callable returning an embedding vector for a text, e.g.
+            memory_manager.embed_text.
+        threshold: Minimum cosine similarity for a cached answer to be reused.
+        max_entries: Oldest entries are evicted beyond this many.
+        ttl: Seconds an answer may be served from the cache.
+        bands, band_bits: LSH layout; more bands raise recall, more bits per
+            band shrink candidate sets.
+        audit_rate: Fraction of hits that are regenerated anyway and compared
+            with the cached answer to measure false hits.
+        audit_threshold: Cosine similarity between the cached and the fresh
+            answer below which an audited hit counts as false.
+    """
+
+    def __init__(self, embed, threshold=0.92, max_entries=10000, ttl=24 * 3600.0, bands=8, band_bits=8,
+                 audit_rate=0.01, audit_threshold=0.85, seed=0, clock=time.monotonic):
+        self.embed = embed
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bands = bands
+        self.band_bits = band_bits
+        self.audit_rate = audit_rate
+        self.audit_threshold = audit_threshold
+        self.clock = clock
+        self.logger = logging.getLogger("semantic_cache")
+        self._random = random.Random(seed)
+        self._seed = seed
+        self._planes = None  # Created on first use, once the embedding size is known
+        self._entries = collections.OrderedDict()  # entry id -> _Entry, oldest first
+        self._buckets = {}  # (scope, band, signature bits) -> set of entry ids
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.audits = 0
+        self.false_hits = 0
+        self.reported_false_hits = 0
+
+    @staticmethod
+    def scope_for(system_instruction, *extra):
+        """Cache scope: answers are only shared between requests with the same instruction (and extras)."""
+        key = repr((system_instruction, extra)).encode("utf-8")
+        return hashlib.sha256(key).hexdigest()[:16]
+
+    def _bucket_keys(self, scope, vector):
+        if self._planes is None:
+            rng = random.Random(self._seed)
+            self._planes = [[rng.gauss(0, 1) for _ in vector] for _ in range(self.bands * self.band_bits)]
+        bits = [_dot(plane, vector) >= 0 for plane in self._planes]
+        keys = []
+        for band in range(self.bands):
+            chunk = bits[band * self.band_bits:(band + 1) * self.band_bits]
+            keys.append((scope, band, sum(1 << i for i, bit in enumerate(chunk) if bit)))
+        return keys
+
+    def lookup(self, query, scope, vector=None, count=True):
+        """
+        Finds the most similar cached question in scope.
+
+        With count=False the lookup is left out of the hit statistics until
+        the caller passes its outcome to record_lookup().
+
+        Returns:
+            (entry_id, response, similarity) for a hit, or (None, None, vector)
+            on a miss so the caller can pass the vector on to store().
+        """
+        vector = _normalize(vector if vector is not None else self.embed(query))
+        now = self.clock()
+        with self._lock:
+            candidates = set()
+            for key in self._bucket_keys(scope, vector):
+                candidates.update(self._buckets.get(key, ()))
+            best, best_similarity = None, self.threshold
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if now - entry.created > self.ttl:
+                    self._remove(entry)
+                    continue
+                similarity = _dot(vector, entry.vector)
+                if similarity >= best_similarity:
+                    best, best_similarity = entry, similarity
+            if count:
+                self._count_lookup(best is not None, best)
+            if best is None:
+                return None, None, vector
+            return best.id, best.response, best_similarity
+
+    def record_lookup(self, entry_id):
+        """Counts a lookup made with count=False: a hit on entry_id, or a miss if it is None."""
+        with self._lock:
+            self._count_lookup(entry_id is not None, self._entries.get(entry_id))
+
+    def _count_lookup(self, hit, entry=None):
+        self.lookups += 1
+        if hit:
+            self.hits += 1
+            if entry is not None:  # None if it was evicted since the lookup
+                entry.hits += 1
+
+    def store(self, query, scope, response, vector=None):
+        vector = _normalize(vector if vector is not None else self.embed(query))
+        with self._lock:
+            buckets = self._bucket_keys(scope, vector)
+            entry = _Entry(self._next_id, scope, query, vector, response, self.clock(), buckets)
+            self._next_id += 1
+            self._entries[entry.id] = entry
+            for key in buckets:
+                self._buckets.setdefault(key, set()).add(entry.id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries.values())))
+            return entry.id
+
+    def _remove(self, entry):
+        self._entries.pop(entry.id, None)
+        for key in entry.buckets:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry.id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def should_audit(self):
+        with self._lock:
+            return self._random.random() < self.audit_rate
+
+    def record_audit(self, entry_id, cached_response, fresh_response):
+        """Compares an audited hit's cached answer with a fresh one; drops the entry if they disagree."""
+        similarity = _dot(_normalize(self.embed(cached_response)), _normalize(self.embed(fresh_response)))
+        with self._lock:
+            self.audits += 1
+            if similarity < self.audit_threshold:
+                self.false_hits += 1
+                entry = self._entries.get(entry_id)
+                if entry is not None:
+                    self._remove(entry)
+                self.logger.warning(f"Audited cache hit {entry_id} disagreed with a fresh answer "
+                                    f"(similarity {similarity:.2f}); entry dropped.")
+        return similarity
+
+    def report_false_hit(self, entry_id):
+        """Records a hit a user or reviewer flagged as wrong and drops the entry."""
+        with self._lock:
+            self.reported_false_hits += 1
+            entry = self._entries.get(entry_id)
+            if entry is not None:
+                self._remove(entry)
+                return True
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "audits": self.audits,
+                "false_hits": self.false_hits,
+                "false_hit_rate": self.false_hits / self.audits if self.audits else 0.0,
+                "reported_false_hits": self.reported_false_hits,
+            }
+
+
+class SemanticCachingClient:
+    """
+    Module wrapper that answers from a SemanticCache when it can and otherwise
+    forwards to the wrapped module (VertexAIClient, ResilientVertexClient or
+    TieredVertexClient), caching complete answers.
+
+    The scope is the system instruction plus 'model_tier', so answers never
+    cross instructions or tiers. A message with 'cache': False bypasses the cache.
+    Requests that end in an "Error: ..." response are left out of the hit,
+    miss and audit statistics, since the cache played no part in the answer.
+    """
+
+    def __init__(self, module, cache):
+        self.module = module
+        self.cache = cache
+        self.logger = logging.getLogger("semantic_cache")
+
+    def _scope(self, message, context):
+        return self.cache.scope_for(context.get("system_instruction"), message.get("model_tier"))
+
+    @staticmethod
+    def _is_error(response):
+        return response.startswith("Error:")
+
+    def stream_message(self, message, context):
+        user_input = message.get("content")
+        if not user_input or message.get("cache") is False:
+            yield from self.module.stream_message(message, context)
+            return
+
+        scope = self._scope(message, context)
+        try:
+            entry_id, cached, vector = self.cache.lookup(user_input, scope, count=False)
+        except Exception as e:
+            self.logger.error(f"Semantic cache lookup failed: {e}")
+            yield from self.module.stream_message(message, context)
+            return
+        if entry_id is not None and not self.cache.should_audit():
+            self.cache.record_lookup(entry_id)
+            yield cached
+            return
+
+        parts = []
+        for text in self.module.stream_message(message, context):
+            parts.append(text)
+            yield text
+        response = "".join(parts)
+        if self._is_error(response):
+            return
+        try:
+            self.cache.record_lookup(entry_id)
+            if entry_id is not None:
+                self.cache.record_audit(entry_id, cached, response)
+            elif response:
+                self.cache.store(user_input, scope, response, vector)
+        except Exception as e:
+            self.logger.error(f"Semantic cache update failed: {e}")
+
+    def handle_message(self, message, context):
+        return "".join(self.stream_message(message, context))
+
+    async def stream_message_async(self, message, context):
+        user_input = message.get("content")
+        if not user_input or message.get("cache") is False:
+            async for text in self.module.stream_message_async(message, context):
+                yield text
+            return
+
+        scope = self._scope(message, context)
+        try:
+            # Embedding is a blocking network call; keep it off the event loop.
+            entry_id, cached, vector = await asyncio.to_thread(self.cache.lookup, user_input, scope, count=False)
+        except Exception as e:
+            self.logger.error(f"Semantic cache lookup failed: {e}")
+            entry_id, cached, vector = None, None, None
+        if entry_id is not None and not self.cache.should_audit():
+            self.cache.record_lookup(entry_id)
+            yield cached
+            return
+
+        parts = []
+        async for text in self.module.stream_message_async(message, context):
+            parts.append(text)
+            yield text
+        response = "".join(parts)
+        if vector is None or self._is_error(response):
+            return  # The lookup failed, or the answer is an error the cache had no part in
+        try:
+            self.cache.record_lookup(entry_id)
+            if entry_id is not None:
+                await asyncio.to_thread(self.cache.record_audit, entry_id, cached, response)
+            elif response:
+                await asyncio.to_thread(self.cache.store, user_input, scope, response, vector)
+        except Exception as e:
+            self.logger.error(f"Semantic cache update failed: {e}")
+
+    async def handle_message_async(self, message, context):
+        responses = ""
+        async for text in self.stream_message_async(message, context):
+            responses += text
+        return responses
+
+    def stats(self):
+        return self.cache.stats()
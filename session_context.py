@@ -0,0 +1,194 @@
+# session_context.py
+#
+# Per-session context for AICoordinator. Global defaults (such as the system
+# instruction) sit underneath per-session overrides. Modules receive immutable
+# snapshots, so a request never sees another request's writes halfway through.
+#
+# Every stored dict is copy-on-write: writers build a new dict and swap the
+# reference, so readers never take a lock. Writers lock only their session's
+# stripe, so different sessions almost never contend.
+
+import logging
+import sys
+import threading
+import time
+from collections import ChainMap
+from types import MappingProxyType
+
+
+def estimate_size(value, _depth=0):
+    """Rough deep size in bytes of a context value, for memory accounting."""
+    size = sys.getsizeof(value)
+    if _depth > 4:
+        return size
+    if isinstance(value, dict):
+        size += sum(estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, _depth + 1) for item in value)
+    return size
+
+
+class _Session:
+    __slots__ = ("overrides", "size", "last_access")
+
+    def __init__(self, now):
+        self.overrides = {}
+        self.size = 0
+        self.last_access = now
+
+
+class SessionContextStore:
+    """
+    Args:
+        defaults: Initial global context shared by every session.
+        max_sessions: Sessions kept before the least recently used are evicted.
+        ttl: Seconds a session may sit idle before it is evicted.
+        max_bytes: Approximate memory budget for all session overrides.
+        lock_stripes: Number of write locks sessions are spread over.
+        clock: Time source, replaceable in tests.
+    """
+
+    def __init__(self, defaults=None, max_sessions=50000, ttl=3600.0, max_bytes=256 * 1024 * 1024,
+                 lock_stripes=64, clock=time.monotonic):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.logger = logging.getLogger("session_context")
+        self._defaults = dict(defaults or {})
+        self._defaults_lock = threading.Lock()
+        self._sessions = {}
+        self._stripes = [threading.Lock() for _ in range(lock_stripes)]
+        self._stripe_bytes = [0] * lock_stripes  # Each entry guarded by its stripe's lock
+        self._evict_lock = threading.Lock()
+        self._last_sweep = clock()
+        self.evicted_lru = 0
+        self.evicted_ttl = 0
+
+    def _stripe(self, session_id):
+        return hash(session_id) % len(self._stripes)
+
+    @property
+    def defaults(self):
+        """Read-only view of the global defaults."""
+        return MappingProxyType(self._defaults)
+
+    def set_default(self, key, value):
+        with self._defaults_lock:
+            self._defaults = {**self._defaults, key: value}
+
+    def snapshot(self, session_id=None):
+        """
+        Returns a read-only mapping of the session's overrides layered over the
+        global defaults. Later writes never change a snapshot already handed out.
+        """
+        defaults = self._defaults
+        session = self._sessions.get(session_id) if session_id is not None else None
+        if session is None:
+            return MappingProxyType(defaults)
+        session.last_access = self.clock()
+        return MappingProxyType(ChainMap(session.overrides, defaults))
+
+    def get(self, session_id, key, default=None):
+        return self.snapshot(session_id).get(key, default)
+
+    def set(self, session_id, key, value):
+        """Sets a per-session override, creating the session if needed."""
+        self.update(session_id, {key: value})
+
+    def update(self, session_id, values):
+        """Sets several per-session overrides in one copy."""
+        index = self._stripe(session_id)
+        created = False
+        with self._stripes[index]:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = _Session(self.clock())
+                self._sessions[session_id] = session
+                created = True
+            overrides = dict(session.overrides)
+            delta = 0
+            for key, value in values.items():
+                if key in overrides:
+                    delta -= estimate_size(key) + estimate_size(overrides[key])
+                overrides[key] = value
+                delta += estimate_size(key) + estimate_size(value)
+            session.overrides = overrides
+            session.size += delta
+            session.last_access = self.clock()
+            self._stripe_bytes[index] += delta
+        if created or delta > 0:
+            self._maybe_evict()
+
+    def end_session(self, session_id):
+        """Drops a session's overrides. Returns True if the session existed."""
+        index = self._stripe(session_id)
+        with self._stripes[index]:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                return False
+            self._stripe_bytes[index] -= session.size
+            return True
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def bytes_used(self):
+        return sum(self._stripe_bytes)
+
+    def _over_budget(self):
+        return len(self._sessions) > self.max_sessions or self.bytes_used() > self.max_bytes
+
+    def _maybe_evict(self):
+        due = self.clock() - self._last_sweep >= self.ttl / 4
+        if (due or self._over_budget()) and self._evict_lock.acquire(blocking=False):
+            # Only one thread sweeps at a time; the others carry on without waiting.
+            try:
+                self._sweep()
+            finally:
+                self._evict_lock.release()
+
+    def evict_expired(self):
+        """Evicts idle sessions now. Returns the number evicted."""
+        with self._evict_lock:
+            return self._sweep()
+
+    def _sweep(self):
+        now = self.clock()
+        self._last_sweep = now
+        sessions = list(self._sessions.items())
+        evicted = 0
+        survivors = []
+        for session_id, session in sessions:
+            if now - session.last_access > self.ttl:
+                if self.end_session(session_id):
+                    evicted += 1
+                    self.evicted_ttl += 1
+            else:
+                survivors.append((session.last_access, session_id))
+
+        if self._over_budget():
+            # Evict down to 90% of the limits so the next insert doesn't sweep again.
+            survivors.sort(key=lambda item: item[0])
+            target_sessions = int(self.max_sessions * 0.9)
+            target_bytes = int(self.max_bytes * 0.9)
+            for _, session_id in survivors:
+                if len(self._sessions) <= target_sessions and self.bytes_used() <= target_bytes:
+                    break
+                if self.end_session(session_id):
+                    evicted += 1
+                    self.evicted_lru += 1
+        if evicted:
+            self.logger.info(f"Evicted {evicted} idle session context(s); {len(self._sessions)} remain.")
+        return evicted
+
+    def stats(self):
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self.bytes_used(),
+            "evicted_lru": self.evicted_lru,
+            "evicted_ttl": self.evicted_ttl,
+        }
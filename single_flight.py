@@ -0,0 +1,146 @@
+# single_flight.py
+#
+# Request coalescing: concurrent calls that share a key attach to one in-flight
+# execution instead of each starting their own.
+
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Thread-based single-flight for blocking callers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        Runs fn() unless a call with the same key is already in flight, in which
+        case waits for that call instead.
+
+        Returns:
+            A (result, shared) tuple; shared is True if this caller joined
+            another caller's execution. Exceptions raised by fn propagate to
+            every caller.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            shared = call is not None
+            if not shared:
+                call = _Call()
+                self._calls[key] = call
+
+        if shared:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+class _StreamFlight:
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self.changed = asyncio.Condition()
+
+
+class AsyncSingleFlight:
+    """
+    asyncio single-flight for streamed results.
+
+    The upstream stream is pumped by its own task into a buffer; every caller
+    with the same key replays the buffer from the start and then follows it
+    live, so late joiners still receive the complete response. If every
+    caller goes away before the stream finishes, the upstream task is
+    cancelled.
+    """
+
+    def __init__(self):
+        self._flights = {}
+
+    def stream(self, key, make_stream):
+        """
+        Attaches to the flight for key, starting make_stream() if none is running.
+
+        Args:
+            key: Hashable coalescing key.
+            make_stream: Zero-argument callable returning an async iterator of chunks.
+
+        Returns:
+            A (chunks, shared) tuple where chunks is an async iterator and shared
+            is True if an existing flight was joined.
+        """
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if not shared:
+            flight = _StreamFlight()
+            self._flights[key] = flight
+            flight.task = asyncio.ensure_future(self._pump(key, flight, make_stream))
+        flight.subscribers += 1
+        return self._subscribe(key, flight), shared
+
+    def in_flight(self):
+        return len(self._flights)
+
+    async def _pump(self, key, flight, make_stream):
+        try:
+            async for chunk in make_stream():
+                flight.chunks.append(chunk)
+                async with flight.changed:
+                    flight.changed.notify_all()
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            async with flight.changed:
+                flight.changed.notify_all()
+
+    async def _subscribe(self, key, flight):
+        index = 0
+        try:
+            while True:
+                while index < len(flight.chunks):
+                    yield flight.chunks[index]
+                    index += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                async with flight.changed:
+                    await flight.changed.wait_for(lambda: flight.done or len(flight.chunks) > index)
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
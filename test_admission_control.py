@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+import pytest
+from admission_control import AdmissionController, AdmissionRejected, TokenBucket, INTERACTIVE, BATCH
+from ai_coordinator import AICoordinator
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_token_bucket_refills():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2.0, capacity=2, clock=clock)
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+    clock.now = 0.5
+    assert bucket.try_acquire() == 0
+
+def test_user_and_module_rate_limits():
+    clock = FakeClock()
+    controller = AdmissionController(user_rate=1.0, user_burst=2, module_limits={"vertex_ai": (1.0, 3)}, clock=clock)
+    controller.check_rate("alice", "vertex_ai")
+    controller.check_rate("alice", "vertex_ai")
+    with pytest.raises(AdmissionRejected) as excinfo:
+        controller.check_rate("alice", "vertex_ai")
+    assert excinfo.value.reason == "user_rate_limited"
+    assert excinfo.value.retry_after == pytest.approx(1.0)
+
+    # Another user is unaffected by alice's bucket but shares the module's.
+    controller.check_rate("bob", "vertex_ai")
+    with pytest.raises(AdmissionRejected) as excinfo:
+        controller.check_rate("carol", "vertex_ai")
+    assert excinfo.value.reason == "module_rate_limited"
+    assert controller.stats()["rejected"] == {"user_rate_limited": 1, "module_rate_limited": 1}
+
+def test_module_rejection_does_not_spend_the_user_token():
+    clock = FakeClock()
+    controller = AdmissionController(user_rate=0.01, user_burst=1, module_limits={"vertex_ai": (1.0, 1)}, clock=clock)
+    controller.check_rate("bob", "vertex_ai")
+    with pytest.raises(AdmissionRejected) as excinfo:
+        controller.check_rate("alice", "vertex_ai")
+    assert excinfo.value.reason == "module_rate_limited"
+    clock.now = 1.0  # The module bucket has refilled; alice's would not have yet
+    controller.check_rate("alice", "vertex_ai")
+
+def test_slot_queue_timeout_and_queue_full():
+    controller = AdmissionController(max_concurrent=1, max_queue=1)
+    with controller.slot():
+        with pytest.raises(AdmissionRejected) as excinfo:
+            with controller.slot(timeout=0.01):
+                pass
+        assert excinfo.value.reason == "deadline_exceeded"
+
+        release = threading.Event()
+        def hold_queued_slot():
+            with controller.slot(timeout=1):
+                release.wait()
+        waiting = threading.Thread(target=hold_queued_slot)
+        waiting.start()
+        while controller.stats()["queue_depth"] == 0:
+            time.sleep(0.001)
+        with pytest.raises(AdmissionRejected) as excinfo:
+            with controller.slot(timeout=1):
+                pass
+        assert excinfo.value.reason == "queue_full"
+    # The queued request inherits the released slot.
+    assert controller.stats()["active"] == 1
+    release.set()
+    waiting.join()
+    assert controller.stats()["active"] == 0
+
+def test_weighted_fair_queuing_prefers_interactive():
+    controller = AdmissionController(max_concurrent=1, class_weights={INTERACTIVE: 4, BATCH: 1})
+    order = []
+
+    async def request(priority, tag):
+        async with controller.slot_async(priority, timeout=5):
+            order.append(tag)
+            await asyncio.sleep(0)
+
+    async def main():
+        async with controller.slot_async():
+            tasks = [asyncio.create_task(request(BATCH, f"b{i}")) for i in range(4)]
+            tasks += [asyncio.create_task(request(INTERACTIVE, f"i{i}")) for i in range(4)]
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    # Interactive requests queued behind a batch backlog get 4 slots per batch slot.
+    assert order == ["i0", "i1", "i2", "b0", "i3", "b1", "b2", "b3"]
+    assert controller.stats()["active"] == 0
+
+def test_coordinator_raises_admission_rejected():
+    coordinator = AICoordinator()
+    class EchoModule:
+        def handle_message(self, message, context):
+            return message["content"]
+    coordinator.register_module("echo", EchoModule())
+    coordinator.set_admission_controller(AdmissionController(user_rate=0.001, user_burst=1))
+
+    message = {"target_module": "echo", "content": "hi", "user_id": "alice"}
+    assert coordinator.route_message(message) == "hi"
+    with pytest.raises(AdmissionRejected):
+        coordinator.route_message(message)
+    assert coordinator.route_message({**message, "user_id": "bob"}) == "hi"
+
+    # A caller with a client_id is limited by it, not by the user_id it sends.
+    message = {"target_module": "echo", "content": "hi", "user_id": "carol", "client_id": "10.0.0.1"}
+    assert coordinator.route_message(message) == "hi"
+    with pytest.raises(AdmissionRejected):
+        coordinator.route_message({**message, "user_id": "dave"})
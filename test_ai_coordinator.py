@@ -1,5 +1,12 @@
+import asyncio
+import threading
+import time
 import pytest
 from ai_coordinator import AICoordinator
+from scatter_gather import BranchResult, QuorumNotMet, first_response, merge_labeled
+from cancellation import CancellationToken, RequestCancelled
+from admission_control import AdmissionRejected
+from deadlines import DeadlineExceeded, deadline_after
 import os  # Add this line
 
 class MockModule:
@@ -50,4 +57,376 @@ def test_load_config():
     config_value = coordinator.load_config("TEST_CONFIG")
     assert config_value == "config_value"
     assert coordinator.load_config("NON_EXISTENT") == None
-    assert coordinator.load_config("NON_EXISTENT", "default") == "default"
\ No newline at end of file
+    assert coordinator.load_config("NON_EXISTENT", "default") == "default"
+
+def test_route_message_async_runs_sync_module():
+    coordinator = AICoordinator()
+    coordinator.register_module("mock", MockModule())
+    message = {"target_module": "mock", "content": "test message"}
+    response = asyncio.run(coordinator.route_message_async(message))
+    assert response == "MockModule processed: test message"
+
+def test_stream_message_async():
+    coordinator = AICoordinator()
+    class StreamingModule:
+        async def stream_message_async(self, message, context):
+            for word in message["content"].split():
+                yield word
+    coordinator.register_module("stream", StreamingModule())
+    coordinator.register_module("mock", MockModule())
+
+    async def collect(message):
+        return [chunk async for chunk in coordinator.stream_message_async(message)]
+
+    assert asyncio.run(collect({"target_module": "stream", "content": "a b c"})) == ["a", "b", "c"]
+    assert asyncio.run(collect({"target_module": "mock", "content": "x"})) == ["MockModule processed: x"]
+    with pytest.raises(KeyError):
+        asyncio.run(collect({"target_module": "nonexistent", "content": "x"}))
+
+def test_module_factory_is_lazy():
+    coordinator = AICoordinator()
+    created = []
+    def factory():
+        created.append(MockModule())
+        return created[-1]
+    coordinator.register_module_factory("lazy", factory)
+    assert created == []
+    assert coordinator.has_module("lazy")
+
+    message = {"target_module": "lazy", "content": "test message"}
+    assert coordinator.route_message(message) == "MockModule processed: test message"
+    assert coordinator.route_message(message) == "MockModule processed: test message"
+    assert len(created) == 1
+    assert coordinator.modules["lazy"] is created[0]
+
+def test_tts_module_not_created_at_startup():
+    coordinator = AICoordinator()
+    assert "text_to_speech" not in coordinator.modules
+    assert coordinator.has_module("text_to_speech")
+
+def test_warm_up():
+    coordinator = AICoordinator()
+    class WarmModule(MockModule):
+        warmed = False
+        def warm_up(self):
+            self.warmed = True
+    coordinator.register_module_factory("warm", WarmModule)
+    coordinator.warm_up(["warm"])
+    assert coordinator.modules["warm"].warmed
+
+    coordinator.register_module_factory("failing", lambda: 1 / 0)
+    coordinator.warm_up(["failing"], background=True).join()
+    assert "failing" not in coordinator.modules
+
+def test_coalescing_concurrent_identical_requests():
+    coordinator = AICoordinator()
+    release = threading.Event()
+    calls = []
+    class SlowModule:
+        def handle_message(self, message, context):
+            calls.append(message["content"])
+            release.wait(timeout=5)
+            return f"answer to {message['content']}"
+    coordinator.register_module("slow", SlowModule())
+    coordinator.enable_coalescing("slow")
+
+    message = {"target_module": "slow", "content": "same question"}
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(coordinator.route_message(message))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while coordinator._single_flight.in_flight() == 0:
+        time.sleep(0.001)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == ["same question"]
+    assert results == ["answer to same question"] * 5
+    assert coordinator.get_coalescing_stats() == {"slow": {"upstream_calls": 1, "coalesced": 4}}
+
+def test_coalescing_async_streaming_and_plain_waiters():
+    coordinator = AICoordinator()
+    calls = []
+    class StreamingModule:
+        async def stream_message_async(self, message, context):
+            calls.append(message["content"])
+            for word in ["one ", "two ", "three"]:
+                await asyncio.sleep(0.01)
+                yield word
+    coordinator.register_module("stream", StreamingModule())
+    coordinator.enable_coalescing("stream")
+    message = {"target_module": "stream", "content": "protocol question"}
+
+    async def stream_all():
+        return [chunk async for chunk in coordinator.stream_message_async(message)]
+
+    async def late_joiner():
+        await asyncio.sleep(0.015)
+        return await coordinator.route_message_async(message)
+
+    async def main():
+        return await asyncio.gather(stream_all(), coordinator.route_message_async(message), late_joiner())
+
+    streamed, plain, late = asyncio.run(main())
+    assert streamed == ["one ", "two ", "three"]
+    assert plain == late == "one two three"
+    assert calls == ["protocol question"]
+    assert coordinator.get_coalescing_stats() == {"stream": {"upstream_calls": 1, "coalesced": 2}}
+
+def test_coalescing_key_includes_context():
+    coordinator = AICoordinator()
+    coordinator.register_module("mock", MockModule())
+    coordinator.enable_coalescing("mock")
+    message = {"target_module": "mock", "content": "x"}
+    key = coordinator._coalescing_key(message)
+    coordinator.set_context("system_instruction", "different")
+    assert coordinator._coalescing_key(message) != key
+    assert coordinator._coalescing_key({"target_module": "other", "content": "x"}) is None
+
+def test_stream_message():
+    coordinator = AICoordinator()
+    class StreamingModule:
+        def stream_message(self, message, context):
+            yield from message["content"].split()
+    coordinator.register_module("stream", StreamingModule())
+    coordinator.register_module("mock", MockModule())
+    assert list(coordinator.stream_message({"target_module": "stream", "content": "a b"})) == ["a", "b"]
+    assert list(coordinator.stream_message({"target_module": "mock", "content": "x"})) == ["MockModule processed: x"]
+    with pytest.raises(KeyError):
+        list(coordinator.stream_message({"target_module": "nonexistent", "content": "x"}))
+
+class DelayedModule:
+    def __init__(self, delay, chunks=("a", "b")):
+        self.delay = delay
+        self.chunks = chunks
+        self.cancelled = False
+
+    async def stream_message_async(self, message, context):
+        try:
+            for chunk in self.chunks:
+                await asyncio.sleep(self.delay)
+                yield chunk
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+def test_scatter_gather_merges_and_times_out_slow_branch():
+    coordinator = AICoordinator()
+    coordinator.register_module("fast", DelayedModule(0.001))
+    coordinator.register_module("sync", MockModule())
+    coordinator.register_module("hung", DelayedModule(10))
+    message = {"target_module": "ignored", "content": "case"}
+    partials = []
+
+    start = time.monotonic()
+    merged = asyncio.run(coordinator.scatter_gather_async(
+        message, ["fast", "sync", "hung", "missing"], branch_timeouts={"hung": 0.05},
+        on_chunk=lambda module, chunk: partials.append(module)))
+    assert time.monotonic() - start < 2
+    assert merged == {"fast": "ab", "sync": "MockModule processed: case"}
+    assert partials.count("fast") == 2 and "hung" not in partials
+
+def test_scatter_gather_first_n_cancels_remaining_branches():
+    coordinator = AICoordinator()
+    slow = DelayedModule(10)
+    coordinator.register_module("fast", DelayedModule(0.001))
+    coordinator.register_module("slow", slow)
+
+    start = time.monotonic()
+    result = asyncio.run(coordinator.scatter_gather_async(
+        {"content": "case"}, ["slow", "fast"], merge=first_response, first_n=1))
+    assert result == "ab"
+    assert time.monotonic() - start < 2
+    assert slow.cancelled
+
+def test_scatter_gather_quorum_and_streaming():
+    coordinator = AICoordinator()
+    coordinator.register_module("a", DelayedModule(0.001, ("x",)))
+    coordinator.register_module("b", DelayedModule(0.02, ("y",)))
+    with pytest.raises(QuorumNotMet):
+        coordinator.scatter_gather({"content": "case"}, ["a", "b"], timeout=0.01, quorum=2)
+
+    async def collect():
+        return [event async for event in coordinator.scatter_stream_async({"content": "case"}, ["b", "a"])]
+    events = asyncio.run(collect())
+    assert events[0] == ("a", "x")
+    assert [event.module for event in events if isinstance(event, BranchResult)] == ["a", "b"]
+    assert merge_labeled([e for e in events if isinstance(e, BranchResult)]) == "[a]\nx\n\n[b]\ny"
+
+def test_session_context_overrides():
+    coordinator = AICoordinator()
+    class ContextModule:
+        def handle_message(self, message, context):
+            return context.get("system_instruction")
+    coordinator.register_module("ctx", ContextModule())
+    coordinator.set_context("system_instruction", "global")
+    coordinator.set_context("system_instruction", "pediatrics", session_id="s1")
+
+    assert coordinator.route_message({"target_module": "ctx", "session_id": "s1"}) == "pediatrics"
+    assert coordinator.route_message({"target_module": "ctx", "session_id": "s2"}) == "global"
+    assert coordinator.get_context("system_instruction", session_id="s1") == "pediatrics"
+    assert coordinator.end_session("s1")
+    assert coordinator.route_message({"target_module": "ctx", "session_id": "s1"}) == "global"
+
+def test_cancelled_stream_closes_module_and_is_counted():
+    coordinator = AICoordinator()
+    closed = []
+    class StreamingModule:
+        def stream_message(self, message, context):
+            try:
+                for word in ["one", "two", "three"]:
+                    yield word
+            finally:
+                closed.append(True)
+    coordinator.register_module("stream", StreamingModule())
+    token = CancellationToken()
+    received = []
+    with pytest.raises(RequestCancelled):
+        for chunk in coordinator.stream_message({"target_module": "stream", "content": "x", "cancel_token": token}):
+            received.append(chunk)
+            token.cancel("user moved on")
+    assert received == ["one"]
+    assert closed == [True]
+    with pytest.raises(RequestCancelled):
+        coordinator.route_message({"target_module": "stream", "content": "x", "cancel_token": token})
+    assert coordinator.get_cancellation_stats() == {"stream": 2}
+
+def test_closing_a_deadline_bound_stream_early_is_not_a_cancellation():
+    coordinator = AICoordinator()
+    class StreamingModule:
+        def stream_message(self, message, context):
+            yield from ["one", "two", "three"]
+    coordinator.register_module("stream", StreamingModule())
+    coordinator.set_module_timeout("stream", 5)
+    for message in ({"target_module": "stream", "content": "x"},
+                    {"target_module": "stream", "content": "x", "cancel_token": CancellationToken()}):
+        chunks = coordinator.stream_message(message)
+        assert next(chunks) == "one"
+        chunks.close()  # e.g. parse_sections stopping, or a client disconnecting
+    assert coordinator.get_cancellation_stats() == {}
+
+def test_cancelling_one_coalesced_caller_leaves_the_others_running():
+    coordinator = AICoordinator()
+    calls = []
+    class StreamingModule:
+        async def stream_message_async(self, message, context):
+            calls.append(message.get("cancel_token"))
+            for word in ["one ", "two ", "three"]:
+                await asyncio.sleep(0.01)
+                yield word
+    coordinator.register_module("stream", StreamingModule())
+    coordinator.enable_coalescing("stream")
+    token = CancellationToken()
+
+    async def cancelled_caller():
+        chunks = []
+        with pytest.raises(RequestCancelled):
+            async for chunk in coordinator.stream_message_async(
+                    {"target_module": "stream", "content": "q", "cancel_token": token}):
+                chunks.append(chunk)
+                token.cancel()
+        return chunks
+
+    async def main():
+        return await asyncio.gather(cancelled_caller(), coordinator.route_message_async(
+            {"target_module": "stream", "content": "q", "cancel_token": CancellationToken()}))
+
+    cancelled, completed = asyncio.run(main())
+    assert cancelled == ["one "]
+    assert completed == "one two three"
+    assert calls == [None]  # The shared upstream call carries no caller's token
+    assert coordinator.get_cancellation_stats() == {"stream": 1}
+
+class HangingModule:
+    def __init__(self):
+        self.release = threading.Event()
+        self.messages = []
+
+    def handle_message(self, message, context):
+        self.messages.append(message)
+        self.release.wait(5)
+        return "late"
+
+    def stream_message(self, message, context):
+        self.messages.append(message)
+        yield "first"
+        self.release.wait(5)
+        yield "late"
+
+def test_hung_module_times_out_without_holding_the_caller():
+    coordinator = AICoordinator()
+    module = HangingModule()
+    coordinator.register_module("hung", module)
+    coordinator.set_module_timeout("hung", 0.05)
+    caller_token = CancellationToken()
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        coordinator.route_message({"target_module": "hung", "content": "x", "cancel_token": caller_token})
+    assert time.monotonic() - start < 1
+    seen = module.messages[0]
+    assert seen["deadline"] is not None
+    assert seen["cancel_token"].cancelled and not caller_token.cancelled  # Only the overdue call is stopped
+    assert coordinator.get_timeout_stats() == {"hung": {"timeouts": 1, "shed": 0, "overdue": 1}}
+    module.release.set()
+    time.sleep(0.1)
+    assert coordinator.get_timeout_stats()["hung"]["overdue"] == 0
+
+def test_overdue_calls_are_capped():
+    coordinator = AICoordinator()
+    coordinator.max_overdue_calls = 1
+    module = HangingModule()
+    coordinator.register_module("hung", module)
+    with pytest.raises(DeadlineExceeded):
+        coordinator.route_message({"target_module": "hung", "content": "x", "deadline": deadline_after(0.05)})
+    with pytest.raises(AdmissionRejected) as rejected:
+        coordinator.route_message({"target_module": "hung", "content": "x", "deadline": deadline_after(1)})
+    assert rejected.value.reason == "hung_stalled"
+    assert len(module.messages) == 1
+    assert coordinator.get_timeout_stats()["hung"] == {"timeouts": 1, "shed": 1, "overdue": 1}
+    module.release.set()
+
+def test_stalled_stream_times_out_between_chunks():
+    coordinator = AICoordinator()
+    module = HangingModule()
+    coordinator.register_module("hung", module)
+    received = []
+    with pytest.raises(DeadlineExceeded):
+        for chunk in coordinator.stream_message({"target_module": "hung", "content": "x",
+                                                 "deadline": deadline_after(0.1)}):
+            received.append(chunk)
+    assert received == ["first"]
+    module.release.set()
+
+def test_async_deadline():
+    coordinator = AICoordinator()
+    class SlowModule:
+        async def stream_message_async(self, message, context):
+            yield "first"
+            await asyncio.sleep(5)
+            yield "late"
+
+        async def handle_message_async(self, message, context):
+            await asyncio.sleep(5)
+    coordinator.register_module("slow", SlowModule())
+    coordinator.register_module("hung", HangingModule())
+
+    async def main():
+        with pytest.raises(DeadlineExceeded):
+            await coordinator.route_message_async({"target_module": "slow", "deadline": deadline_after(0.05)})
+        with pytest.raises(DeadlineExceeded):
+            await coordinator.route_message_async({"target_module": "hung", "deadline": deadline_after(0.05)})
+        received = []
+        with pytest.raises(DeadlineExceeded):
+            async for chunk in coordinator.stream_message_async({"target_module": "slow",
+                                                                 "deadline": deadline_after(0.05)}):
+                received.append(chunk)
+        return received
+
+    start = time.monotonic()
+    assert asyncio.run(main()) == ["first"]
+    assert time.monotonic() - start < 2
+    stats = coordinator.get_timeout_stats()
+    assert stats["slow"]["timeouts"] == 2 and stats["hung"]["timeouts"] == 1
+    coordinator.get_module("hung").release.set()
@@ -0,0 +1,68 @@
+import json
+import threading
+from ai_coordinator import AICoordinator
+from batch_runner import run_batch, load_completed_ids
+
+class FakeCaseModule:
+    def __init__(self, fail_on=()):
+        self.fail_on = set(fail_on)
+        self.seen = []
+        self.lock = threading.Lock()
+
+    def handle_message(self, message, context):
+        with self.lock:
+            self.seen.append(message["content"])
+        if message["content"] in self.fail_on:
+            raise RuntimeError("upstream error")
+        return f"review of {message['content']}"
+
+def write_cases(path, count):
+    with open(path, "w") as f:
+        for i in range(count):
+            f.write(json.dumps({"id": f"case-{i}", "content": f"case {i}"}) + "\n")
+
+def read_results(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def make_coordinator(module):
+    coordinator = AICoordinator()
+    coordinator.register_module("vertex_ai", module)
+    return coordinator
+
+def test_run_batch_writes_all_results(tmp_path):
+    cases, results = tmp_path / "cases.jsonl", tmp_path / "results.jsonl"
+    write_cases(cases, 20)
+    reports = []
+    summary = run_batch(make_coordinator(FakeCaseModule()), str(cases), str(results), concurrency=4, on_progress=reports.append)
+
+    assert summary["processed"] == 20 and summary["failed"] == 0
+    records = read_results(results)
+    assert sorted(r["id"] for r in records) == sorted(f"case-{i}" for i in range(20))
+    assert all(r["response"] == f"review of case {r['id'].split('-')[1]}" for r in records)
+    assert reports and reports[-1].eta() == 0
+
+def test_resume_skips_completed_and_retries_failed(tmp_path):
+    cases, results = tmp_path / "cases.jsonl", tmp_path / "results.jsonl"
+    write_cases(cases, 10)
+    first = FakeCaseModule(fail_on={"case 3"})
+    summary = run_batch(make_coordinator(first), str(cases), str(results), concurrency=3)
+    assert summary["failed"] == 1
+
+    # Simulate a crash that left a torn line behind.
+    with open(results, "a") as f:
+        f.write('{"id": "case-9", "resp')
+
+    second = FakeCaseModule()
+    summary = run_batch(make_coordinator(second), str(cases), str(results), concurrency=3)
+    assert second.seen == ["case 3"]
+    assert summary["skipped"] == 9 and summary["processed"] == 1
+    assert load_completed_ids(str(results)) == {f"case-{i}" for i in range(10)}
+
+def test_stop_event_stops_new_cases(tmp_path):
+    cases, results = tmp_path / "cases.jsonl", tmp_path / "results.jsonl"
+    write_cases(cases, 10)
+    stop = threading.Event()
+    stop.set()
+    summary = run_batch(make_coordinator(FakeCaseModule()), str(cases), str(results), stop_event=stop)
+    assert summary["processed"] == 0
@@ -0,0 +1,83 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import pytest
+from cancellation import CancellationRegistry, CancellationToken, RequestCancelled
+from text_to_speech import TextToSpeechModule, split_segments
+from vertex_ai_module import VertexAIClient
+
+def test_registry_cancels_only_in_flight_requests():
+    registry = CancellationRegistry()
+    token = registry.register("req-1")
+    assert registry.cancel("req-1", "cancelled by client")
+    assert token.cancelled and token.reason == "cancelled by client"
+    assert not registry.cancel("req-1")  # Already cancelled
+    registry.release("req-1", token)
+    assert len(registry) == 0
+    assert not registry.cancel("req-1")
+    untracked = registry.register(None)
+    assert len(registry) == 0 and not untracked.cancelled
+
+def test_vertex_client_closes_stream_when_cancelled():
+    closed = []
+    def stream(**kwargs):
+        try:
+            for text in ["Hel", "lo", " there"]:
+                yield SimpleNamespace(text=text, usage_metadata=None)
+        finally:
+            closed.append(True)
+    client = VertexAIClient.__new__(VertexAIClient)
+    client.model = "gemini-test"
+    client.ledger = None
+    client.cancelled_streams = 0
+    client.client = SimpleNamespace(models=SimpleNamespace(generate_content_stream=stream))
+    token = CancellationToken()
+    received = []
+    with pytest.raises(RequestCancelled):
+        for text in client.stream_message({"content": "question", "cancel_token": token}, {}):
+            received.append(text)
+            token.cancel()
+    assert received == ["Hel"]
+    assert closed == [True]
+    assert client.cancelled_streams == 1
+
+def test_split_segments_keeps_sentences_whole():
+    text = "First sentence. Second one! Third? " + "x" * 50
+    assert split_segments(text, max_chars=30) == ["First sentence. Second one!", "Third?", "x" * 50]
+    assert split_segments("   ") == []
+
+def test_tts_playback_stops_between_segments():
+    tts = TextToSpeechModule.__new__(TextToSpeechModule)
+    tts._synthesis_pool = ThreadPoolExecutor(max_workers=1)
+    tts.cancelled_playbacks = 0
+    token = CancellationToken()
+    played = []
+    tts.synthesize_speech = lambda text, timeout=None: f"audio:{text}"
+    def play_audio(audio):
+        played.append(audio)
+        token.cancel()
+    tts.play_audio = play_audio
+    tts.play_segments("audio:one", ["two", "three"], token)
+    assert played == ["audio:one"]
+    assert tts.cancelled_playbacks == 1
+    with pytest.raises(RequestCancelled):
+        tts.handle_message({"content": "Hello.", "cancel_token": token}, {})
+
+def test_tts_playback_reports_synthesis_errors_when_done():
+    tts = TextToSpeechModule.__new__(TextToSpeechModule)
+    tts._synthesis_pool = ThreadPoolExecutor(max_workers=1)
+    tts.cancelled_playbacks = 0
+    tts.logger = logging.getLogger("text_to_speech")
+    played = []
+    def synthesize_speech(text, timeout=None):
+        raise RuntimeError("quota exceeded")
+    tts.synthesize_speech = synthesize_speech
+    tts.play_audio = played.append
+    finished = []
+    tts.play_segments("audio:one", ["two"], on_done=finished.append)  # Must not raise on the playback thread
+    assert played == ["audio:one"]
+    assert len(finished) == 1 and str(finished[0]) == "quota exceeded"
+
+    tts.synthesize_speech = lambda text, timeout=None: f"audio:{text}"
+    tts.play_segments("audio:one", ["two"], on_done=finished.append)
+    assert finished[1:] == [None]
@@ -0,0 +1,48 @@
+from conversation_archive import ConversationArchive, quantize_vector, dequantize_vector, apply_vector_policy, DROP_VECTORS
+
+def test_quantize_round_trip():
+    vector = [0.5, -0.25, 0.0, 0.125]
+    restored = dequantize_vector(quantize_vector(vector))
+    assert all(abs(a - b) < 0.005 for a, b in zip(vector, restored))
+    assert dequantize_vector([1.0, 2.0]) == [1.0, 2.0]
+
+def test_archive_load_and_reclaim(tmp_path):
+    archive = ConversationArchive(str(tmp_path), max_segment_bytes=200)
+    entries = lambda n: [{"id": str(i), "content": f"turn {i} " * 20, "contentVector": [0.1, 0.2]} for i in range(n)]
+    archive.archive_sessions("u1", [("s1", entries(3), 100.0), ("s2", entries(2), 200.0)])
+    archive.archive_sessions("u1", [("s3", apply_vector_policy(entries(1), DROP_VECTORS), 300.0)])
+
+    assert archive.load("u1", "s1")[2]["content"].startswith("turn 2")
+    assert "contentVector" not in archive.load("u1", "s3")[0]
+    assert archive.load("u1", "missing") is None
+    assert archive.sessions("u1") == {"s1": 100.0, "s2": 200.0, "s3": 300.0}
+
+    assert archive.expire("u1", cutoff=250.0) == 2
+    assert archive.reclaim("u1") > 0
+    segments = [p for p in (tmp_path / "user_u1").iterdir() if p.suffix == ".seg"]
+    assert len(segments) == 1
+    # A fresh instance reads the persisted offset index.
+    assert ConversationArchive(str(tmp_path)).load("u1", "s3")[0]["id"] == "0"
+
+def test_users_do_not_wait_on_each_other(tmp_path):
+    import threading
+    archive = ConversationArchive(str(tmp_path))
+    archive.archive_sessions("u1", [("s1", [{"id": "1"}], 100.0)])
+    archive.archive_sessions("u2", [("s1", [{"id": "2"}], 100.0)])
+    held, release = threading.Event(), threading.Event()
+    def hold_u1():
+        with archive._locked("u1"):
+            held.set()
+            release.wait(5)
+    thread = threading.Thread(target=hold_u1)
+    thread.start()
+    held.wait(5)
+    try:
+        loaded = []
+        reader = threading.Thread(target=lambda: loaded.append(archive.load("u2", "s1")))
+        reader.start()
+        reader.join(1)
+        assert loaded == [[{"id": "2"}]]  # Not queued behind u1's lock
+    finally:
+        release.set()
+        thread.join()
@@ -0,0 +1,91 @@
+import threading
+import time
+from conversation_persistence import ConversationPersister
+
+class FakeMemoryManager:
+    def __init__(self, save_delay=0.0):
+        self.save_delay = save_delay
+        self.entries = {}
+
+    def save_conversation_entry(self, user_id, session_id, entry_id, content, role):
+        time.sleep(self.save_delay)
+        self.entries.setdefault((user_id, session_id), []).append(
+            {"id": entry_id, "content": content, "role": role, "contentVector": [0.1] * 768}
+        )
+
+    def load_conversation(self, user_id, session_id):
+        return list(self.entries.get((user_id, session_id), []))
+
+    def load_conversation_page(self, user_id, session_id, limit=50, before=None):
+        entries = self.load_conversation(user_id, session_id)
+        end = len(entries) if before is None else before
+        start = max(0, end - limit)
+        return entries[start:end], start or None
+
+    def list_sessions(self, user_id):
+        return [{"sessionId": session, "modified": 0} for user, session in self.entries if user == user_id]
+
+def test_save_turn_does_not_block():
+    manager = FakeMemoryManager(save_delay=0.05)
+    persister = ConversationPersister(lambda: manager, user_id="clinician")
+    start = time.monotonic()
+    for i in range(5):
+        persister.save_turn("s1", str(i), f"turn {i}", "user")
+    assert time.monotonic() - start < 0.05
+    persister.flush()
+    assert [e["id"] for e in manager.entries[("clinician", "s1")]] == ["0", "1", "2", "3", "4"]
+    persister.close()
+
+def test_manager_created_lazily_on_worker():
+    created_on = []
+    def factory():
+        created_on.append(threading.current_thread().name)
+        return FakeMemoryManager()
+    persister = ConversationPersister(factory, user_id="clinician")
+    assert created_on == []
+    persister.save_turn("s1", "0", "hello", "user")
+    persister.flush()
+    assert created_on == ["conversation-write"]
+    persister.close()
+
+def test_list_and_load_session():
+    manager = FakeMemoryManager()
+    persister = ConversationPersister(lambda: manager, user_id="clinician")
+    persister.save_turn("s1", "0", "question", "user")
+    persister.save_turn("s1", "1", "answer", "assistant")
+    persister.flush()
+    assert persister.list_sessions().result(timeout=1) == [{"sessionId": "s1", "modified": 0}]
+    assert persister.load_session("s1").result(timeout=1) == ([("0", "user", "question"), ("1", "assistant", "answer")], None)
+    turns, cursor = persister.load_session("s1", limit=1).result(timeout=1)
+    assert turns == [("1", "assistant", "answer")]
+    assert persister.load_session("s1", limit=1, before=cursor).result(timeout=1) == ([("0", "user", "question")], None)
+    persister.close()
+
+def test_load_session_waits_for_its_own_pending_turns_only():
+    release = threading.Event()
+    class SlowManager(FakeMemoryManager):
+        def save_conversation_entry(self, user_id, session_id, *args):
+            if session_id == "busy":
+                release.wait(timeout=5)
+            super().save_conversation_entry(user_id, session_id, *args)
+    persister = ConversationPersister(SlowManager, user_id="clinician")
+    persister.save_turn("busy", "0", "slow write", "user")
+    future = persister.load_session("busy")
+    time.sleep(0.05)
+    assert not future.done()  # The turn queued before opening is written first
+    release.set()
+    assert future.result(timeout=1) == ([("0", "user", "slow write")], None)
+    assert persister.load_session("other").result(timeout=1) == ([], None)
+    persister.close()
+
+def test_queue_full_drops_instead_of_blocking():
+    release = threading.Event()
+    class BlockedManager(FakeMemoryManager):
+        def save_conversation_entry(self, *args):
+            release.wait(timeout=5)
+    persister = ConversationPersister(BlockedManager, user_id="clinician", max_pending=1)
+    for i in range(5):
+        persister.save_turn("s1", str(i), "x", "user")
+    assert persister.dropped >= 3
+    release.set()
+    persister.close()
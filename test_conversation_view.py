@@ -0,0 +1,144 @@
+import re
+from conversation_view import ConversationModel, ConversationView
+
+def test_streamed_turns_and_formatting():
+    model = ConversationModel()
+    model.append_turn("user", "Cough for 6 weeks")
+    model.append_turn("assistant")
+    for chunk in ["**Diagnosis**", ": chronic ", "bronchitis"]:
+        model.append_to_last(chunk)
+    model.finish_last()
+
+    assert len(model) == 2
+    assert model.turns[1]["parts"] == ["**Diagnosis**: chronic bronchitis"]
+    assert list(model.iter_text()) == [
+        "You:\nCough for 6 weeks\n\n",
+        "Assistant:\n**Diagnosis**: chronic bronchitis\n\n",
+    ]
+    assert list(model.iter_text(start=1)) == ["Assistant:\n**Diagnosis**: chronic bronchitis\n\n"]
+
+def test_clear():
+    model = ConversationModel()
+    model.append_turn("user", "hi")
+    model.clear()
+    assert len(model) == 0 and list(model.iter_text()) == []
+
+class FakeText:
+    """Just enough of tk.Text (flat character offsets, marks, gravity) to drive ConversationView headlessly."""
+
+    def __init__(self):
+        self.content = "\n"  # Tk always keeps a final newline
+        self.marks = {}  # name -> [offset, gravity]
+        self.options = {"state": "disabled"}
+        self.idle = []
+
+    def _offset(self, index):
+        if index in self.marks:
+            return self.marks[index][0]
+        match = re.fullmatch(r"end(?:-(\d+)c)?", index)
+        if match:
+            return len(self.content) - int(match.group(1) or 0)
+        match = re.fullmatch(r"1\.0(?: \+ (\d+) chars)?", index)
+        return int(match.group(1) or 0)
+
+    def config(self, **options):
+        self.options.update(options)
+
+    def cget(self, option):
+        return self.options[option]
+
+    def insert(self, index, text):
+        at = min(self._offset(index), len(self.content) - 1)
+        self.content = self.content[:at] + text + self.content[at:]
+        for mark in self.marks.values():
+            if mark[0] > at or (mark[0] == at and mark[1] == "right"):
+                mark[0] += len(text)
+
+    def delete(self, start, end):
+        a, b = self._offset(start), min(self._offset(end), len(self.content) - 1)
+        self.content = self.content[:a] + self.content[b:]
+        for mark in self.marks.values():
+            mark[0] = a if a <= mark[0] <= b else mark[0] - (b - a) if mark[0] > b else mark[0]
+
+    def mark_set(self, name, index):
+        self.marks[name] = [self._offset(index), self.marks.get(name, [0, "right"])[1]]
+
+    def mark_gravity(self, name, gravity):
+        self.marks[name][1] = gravity
+
+    def mark_unset(self, name):
+        del self.marks[name]
+
+    def mark_names(self):
+        return list(self.marks)
+
+    def index(self, index):
+        return "1.0"
+
+    def see(self, index):
+        pass
+
+    def yview(self, index):
+        pass
+
+    def after_idle(self, callback, *args):
+        self.idle.append((callback, args))
+
+def _rendered_turns(text):
+    return re.findall(r"^(?:You|Assistant):$", text.content, re.MULTILINE)
+
+def test_view_stays_bounded_while_paging_both_ways():
+    model = ConversationModel()
+    for n in range(100):
+        model.append_turn("user" if n % 2 == 0 else "assistant", f"message {n}")
+    text = FakeText()
+    view = ConversationView(text, model, max_visible_turns=10, page_size=4)
+    view.render_tail()
+    assert len(_rendered_turns(text)) == 10
+
+    for _ in range(30):
+        view.load_older()
+        assert len(_rendered_turns(text)) <= 10
+    assert view.first_visible == 0 and "message 0\n" in text.content
+    assert "message 99" not in text.content
+
+    # Scrolling to the bottom pages newer turns back in.
+    while not view.at_tail:
+        view._on_scroll("0.5", "1.0")
+        callback, args = text.idle.pop()
+        callback(*args)
+        assert len(_rendered_turns(text)) <= 10
+    assert text.content.endswith("Assistant:\nmessage 99\n\n\n")
+    assert text.content.startswith("You:\nmessage 90\n")
+
+def test_streaming_while_scrolled_back_jumps_to_the_new_turn():
+    model = ConversationModel()
+    for n in range(30):
+        model.append_turn("user", f"message {n}")
+    text = FakeText()
+    view = ConversationView(text, model, max_visible_turns=10, page_size=10)
+    view.render_tail()
+    view.append_turn("assistant")
+    view.load_older()
+    view.append_to_last("hidden")  # Not in the widget right now; only the model changes
+    assert "hidden" not in text.content
+    view.append_turn("user", "next question")
+    assert text.content.endswith("Assistant:\nhidden\n\nYou:\nnext question\n\n\n")
+    assert len(_rendered_turns(text)) == 10
+
+def test_older_history_from_storage_is_prepended_in_place():
+    model = ConversationModel()
+    model.load_turns([("user", f"message {n}") for n in range(20, 25)])
+    text = FakeText()
+    requests = []
+    view = ConversationView(text, model, max_visible_turns=10, page_size=5,
+                            on_history_start=lambda: requests.append(True))
+    view.render_tail()
+    view.load_older()
+    assert requests == [True]  # Everything in the model is shown; ask storage for more
+    model.prepend_turns([("user", f"message {n}") for n in range(15, 20)])
+    view.turns_prepended(5)
+    assert (view.first_visible, view.end_visible) == (0, 10)
+    assert text.content.startswith("You:\nmessage 15\n") and "message 24" in text.content
+    view.append_turn("assistant", "reply")
+    assert text.content.endswith("Assistant:\nreply\n\n\n") and len(_rendered_turns(text)) == 10
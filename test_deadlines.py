@@ -0,0 +1,46 @@
+import time
+from types import SimpleNamespace
+import pytest
+from deadlines import DeadlineExceeded, check_deadline, deadline_after, run_in_thread, time_left
+from vertex_ai_module import VertexAIClient
+
+def test_deadline_helpers():
+    assert time_left(None) is None
+    check_deadline(None)
+    deadline = deadline_after(10)
+    assert 9 < time_left(deadline) <= 10
+    with pytest.raises(DeadlineExceeded) as exceeded:
+        check_deadline(time.monotonic() - 1, "vertex_ai")
+    assert exceeded.value.module == "vertex_ai"
+    assert isinstance(exceeded.value, TimeoutError)
+
+def test_run_in_thread_returns_result_or_error():
+    assert run_in_thread(lambda: 42).result(timeout=1) == 42
+    with pytest.raises(ZeroDivisionError):
+        run_in_thread(lambda: 1 / 0).result(timeout=1)
+
+def test_vertex_client_budgets_and_enforces_deadline():
+    requests = []
+    closed = []
+    def stream(**kwargs):
+        requests.append(kwargs["config"])
+        try:
+            yield SimpleNamespace(text="Hel", usage_metadata=None)
+            time.sleep(0.1)
+            yield SimpleNamespace(text="lo", usage_metadata=None)
+        finally:
+            closed.append(True)
+    client = VertexAIClient.__new__(VertexAIClient)
+    client.model = "gemini-test"
+    client.ledger = None
+    client.cancelled_streams = 0
+    client.timed_out_streams = 0
+    client.client = SimpleNamespace(models=SimpleNamespace(generate_content_stream=stream))
+    received = []
+    with pytest.raises(DeadlineExceeded):
+        for text in client.stream_message({"content": "question", "deadline": deadline_after(0.05)}, {}):
+            received.append(text)
+    assert received == ["Hel"]
+    assert 0 < requests[0].http_options.timeout <= 50
+    assert closed == [True]
+    assert client.timed_out_streams == 1
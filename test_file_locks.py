@@ -0,0 +1,63 @@
+import contextlib
+import json
+import multiprocessing
+import os
+import threading
+from file_locks import FileLock, KeyedFileLock, StripedFileLock, atomic_write_json
+
+def _increment(lock_dir, counter_path, times):
+    locks = StripedFileLock(lock_dir, stripes=8)
+    for _ in range(times):
+        with locks.hold("user1/session1"):
+            with open(counter_path, "r") as f:
+                value = json.load(f)
+            atomic_write_json(counter_path, value + 1)
+
+def test_striped_lock_serializes_across_processes_and_threads(tmp_path):
+    counter = str(tmp_path / "counter.json")
+    atomic_write_json(counter, 0)
+    lock_dir = str(tmp_path / "locks")
+    processes = [multiprocessing.Process(target=_increment, args=(lock_dir, counter, 50)) for _ in range(3)]
+    threads = [threading.Thread(target=_increment, args=(lock_dir, counter, 50)) for _ in range(2)]
+    for worker in processes + threads:
+        worker.start()
+    for worker in processes + threads:
+        worker.join()
+    with open(counter) as f:
+        assert json.load(f) == 250
+    assert len(os.listdir(lock_dir)) <= 8
+
+def test_atomic_write_leaves_no_temp_files(tmp_path):
+    path = str(tmp_path / "data.json")
+    atomic_write_json(path, {"a": 1}, indent=2)
+    atomic_write_json(path, {"a": 2})
+    with open(path) as f:
+        assert json.load(f) == {"a": 2}
+    assert os.listdir(tmp_path) == ["data.json"]
+
+def test_file_lock_is_exclusive_between_threads(tmp_path):
+    lock = FileLock(str(tmp_path / "x.lock"))
+    inside = []
+    def hold():
+        with lock.hold():
+            inside.append(1)
+            assert len(inside) == 1
+            inside.pop()
+    threads = [threading.Thread(target=hold) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def test_keyed_lock_never_makes_different_keys_wait(tmp_path):
+    locks = KeyedFileLock(str(tmp_path / "locks"))
+    done = threading.Event()
+    def hold_all():
+        # Every key held at once: any two sharing a lock would deadlock here.
+        with contextlib.ExitStack() as stack:
+            for n in range(200):
+                stack.enter_context(locks.hold(f"user{n}"))
+        done.set()
+    threading.Thread(target=hold_all, daemon=True).start()
+    assert done.wait(5)
+    assert len(os.listdir(tmp_path / "locks")) == 200
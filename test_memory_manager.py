@@ -2,6 +2,9 @@
 import pytest
 import json
 import os
+import threading
+from types import SimpleNamespace
+import memory_manager as memory_manager_module
 from memory_manager import MemoryManager
 from google.cloud import aiplatform
 
@@ -16,20 +19,31 @@ class MockMatchingEngineIndexEndpoint:
     def upsert_datapoints(self, datapoints):
         pass
 
+    @staticmethod
+    def UpsertDatapointsSpec(**kwargs):
+        return kwargs
+
 # Mock Vertex AI TextEmbeddingModel
 class MockTextEmbeddingModel:
     def __init__(self, model_name):
         pass
 
+    @classmethod
+    def from_pretrained(cls, model_name):
+        return cls(model_name)
+
     def get_embeddings(self, texts):
         # Return a fixed vector for testing
-        return [aiplatform.TextEmbeddingModel.Embedding(values=[0.1, 0.2, 0.3])]
+        return [SimpleNamespace(values=[0.1, 0.2, 0.3]) for _ in texts]
 
 @pytest.fixture
 def memory_manager(tmp_path, monkeypatch):
     # Mock aiplatform.MatchingEngineIndexEndpoint and aiplatform.TextEmbeddingModel
     monkeypatch.setattr(aiplatform, "MatchingEngineIndexEndpoint", MockMatchingEngineIndexEndpoint)
-    monkeypatch.setattr(aiplatform, "TextEmbeddingModel", MockTextEmbeddingModel)
+    # Newer aiplatform releases only export TextEmbeddingModel from vertexai, so it may be missing here
+    monkeypatch.setattr(aiplatform, "TextEmbeddingModel", MockTextEmbeddingModel, raising=False)
+    monkeypatch.setattr(aiplatform, "init", lambda **kwargs: None)
+    monkeypatch.setattr(memory_manager_module, "_embedding_models", {})
 
     base_dir = str(tmp_path)
     return MemoryManager(base_dir=base_dir, project="test-project", location="test-location", index_endpoint_name="test-endpoint")
@@ -86,4 +100,118 @@ def test_load_summary(memory_manager):
     memory_manager.save_summary(user_id, session_id, summary_id, summary)
     loaded_summary = memory_manager.load_summary(user_id, session_id, summary_id)
 
-    assert loaded_summary["summary"] == summary
\ No newline at end of file
+    assert loaded_summary["summary"] == summary
+
+def test_list_sessions(memory_manager):
+    memory_manager.save_conversation_entry("user1", "older", "1", "First session", "user")
+    memory_manager.save_conversation_entry("user1", "newer", "1", "Second session", "user")
+    memory_manager.save_conversation_entry("user2", "other", "1", "Someone else", "user")
+    older = memory_manager._get_conversation_path("user1", "older")
+    os.utime(older, (1, 1))
+
+    sessions = memory_manager.list_sessions("user1")
+    assert [s["sessionId"] for s in sessions] == ["newer", "older"]
+
+def test_search_text(memory_manager):
+    memory_manager.save_conversation_entry("user1", "s1", "1", "Started metformin 500mg", "user")
+    memory_manager.save_conversation_entry("user1", "s2", "1", "Persistent cough for six weeks", "user")
+    memory_manager.save_summary("user1", "s2", "1", "Cough, smoker, chest X-ray ordered")
+    memory_manager.save_conversation_entry("user2", "s3", "1", "Also on metformin", "user")
+
+    results = memory_manager.search_text("user1", "metformin")
+    assert [(r["type"], r["sessionId"]) for r in results] == [("conversation", "s1")]
+    assert {r["type"] for r in memory_manager.search_text("user1", "cough")} == {"conversation", "summary"}
+    hybrid = memory_manager.search_text("user1", "cough", vector_weight=0.5)
+    assert len(hybrid) == 2 and all(r["score"] > 0 for r in hybrid)
+
+def test_compact_storage_archives_and_expires(memory_manager):
+    from conversation_archive import RetentionPolicy
+    memory_manager.save_conversation_entry("user1", "cold", "1", "Old visit about warfarin", "user")
+    memory_manager.save_conversation_entry("user1", "ancient", "1", "Very old visit", "user")
+    memory_manager.save_conversation_entry("user1", "hot", "1", "Today", "user")
+    os.utime(memory_manager._get_conversation_path("user1", "cold"), (1000, 1000))
+    os.utime(memory_manager._get_conversation_path("user1", "ancient"), (10, 10))
+
+    policy = RetentionPolicy(archive_after=500, delete_after=5000)
+    stats = memory_manager.compact_storage(policy, now=5500)
+    assert stats["archived"] == 1 and stats["deleted"] == 1
+    assert not os.path.exists(memory_manager._get_conversation_path("user1", "cold"))
+
+    # Archived sessions still load, list and search transparently.
+    cold = memory_manager.load_conversation("user1", "cold")
+    assert cold[0]["content"] == "Old visit about warfarin"
+    assert abs(cold[0]["contentVector"][1] - 0.2) < 0.01
+    assert {s["sessionId"] for s in memory_manager.list_sessions("user1")} == {"cold", "hot"}
+    assert memory_manager.load_conversation("user1", "ancient") == []
+    assert memory_manager.search_text("user1", "visit")[0]["sessionId"] == "cold"
+
+    # Writing to an archived session brings it back to hot storage intact.
+    memory_manager.save_conversation_entry("user1", "cold", "2", "Follow-up", "user")
+    assert [e["id"] for e in memory_manager.load_conversation("user1", "cold")] == ["1", "2"]
+    assert memory_manager.archive.sessions("user1") == {}
+
+def test_concurrent_writers_lose_no_entries(memory_manager):
+    def write(worker):
+        for n in range(10):
+            memory_manager.save_conversation_entry("user1", "shared", f"{worker}-{n}", "turn", "user")
+    threads = [threading.Thread(target=write, args=(w,)) for w in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(memory_manager.load_conversation("user1", "shared")) == 40
+
+def test_failed_resume_keeps_archived_session(memory_manager, monkeypatch):
+    import memory_manager as memory_manager_module
+    from conversation_archive import RetentionPolicy
+    memory_manager.save_conversation_entry("user1", "cold", "1", "Old visit", "user")
+    os.utime(memory_manager._get_conversation_path("user1", "cold"), (1000, 1000))
+    memory_manager.compact_storage(RetentionPolicy(archive_after=500, delete_after=5000), now=1600)
+
+    def failing_write(path, data, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(memory_manager_module, "atomic_write_json", failing_write)
+    with pytest.raises(OSError):
+        memory_manager.save_conversation_entry("user1", "cold", "2", "Follow-up", "user")
+    assert "cold" in memory_manager.archive.sessions("user1")
+    assert [e["id"] for e in memory_manager.load_conversation("user1", "cold")] == ["1"]
+
+def test_load_conversation_page_reads_latest_turns_first(memory_manager):
+    for n in range(7):
+        memory_manager.save_conversation_entry("user1", "long", str(n), f"turn {n}", "user")
+    entries, cursor = memory_manager.load_conversation_page("user1", "long", limit=3)
+    assert [e["id"] for e in entries] == ["4", "5", "6"]
+    assert "contentVector" not in entries[0]
+    pages = [entries]
+    while cursor is not None:
+        entries, cursor = memory_manager.load_conversation_page("user1", "long", limit=3, before=cursor)
+        pages.insert(0, entries)
+    assert [e["content"] for page in pages for e in page] == [f"turn {n}" for n in range(7)]
+
+    # A session saved before transcripts existed gets one on first page load.
+    os.remove(memory_manager._get_transcript_path("user1", "long"))
+    assert [e["id"] for e in memory_manager.load_conversation_page("user1", "long", limit=2)[0]] == ["5", "6"]
+
+def test_loading_one_users_index_does_not_block_others(memory_manager, monkeypatch):
+    loading = threading.Event()
+    release = threading.Event()
+    real_index = memory_manager_module.BM25Index
+    def slow_index(directory):
+        if directory.endswith("user_slow"):
+            loading.set()
+            release.wait(5)
+        return real_index(directory)
+    monkeypatch.setattr(memory_manager_module, "BM25Index", slow_index)
+    loader = threading.Thread(target=memory_manager.search_text, args=("slow", "cough"))
+    loader.start()
+    assert loading.wait(5)
+    results = []
+    other = threading.Thread(target=lambda: results.append(memory_manager.search_text("fast", "cough")))
+    other.start()
+    other.join(1)
+    waited = other.is_alive()  # Would wait on user "slow" if index loads shared one lock
+    release.set()
+    loader.join()
+    other.join()
+    assert not waited and results == [[]]
+    assert memory_manager._get_text_index("slow") is memory_manager._get_text_index("slow")
@@ -0,0 +1,49 @@
+import asyncio
+from model_tiering import TieredVertexClient, KeywordLengthClassifier, ModelTier, QUICK, FULL
+
+class RecordingClient:
+    def __init__(self):
+        self.calls = []
+
+    def generate_response(self, user_input, system_instruction, model=None, max_output_tokens=None, usage_tags=None,
+                          cancel_token=None, deadline=None):
+        self.calls.append((model, max_output_tokens))
+        yield f"{model} answer"
+
+    async def generate_response_async(self, user_input, system_instruction, model=None, max_output_tokens=None,
+                                      usage_tags=None, cancel_token=None, deadline=None):
+        self.calls.append((model, max_output_tokens))
+        yield f"{model} answer"
+
+def test_keyword_length_classifier():
+    classifier = KeywordLengthClassifier(max_quick_words=10)
+    assert classifier("Max daily dose of paracetamol?") == QUICK
+    assert classifier("Differential for chest pain in a 50 year old") == FULL
+    assert classifier(" ".join(["word"] * 11)) == FULL
+
+def test_routes_by_tier_and_records_latency():
+    client = RecordingClient()
+    tiered = TieredVertexClient(client)
+    context = {"system_instruction": "x"}
+
+    assert tiered.handle_message({"content": "Amoxicillin dose for adults?"}, context) == "gemini-2.0-flash-lite-001 answer"
+    assert tiered.handle_message({"content": "Symptoms: cough for 6 weeks, smoker"}, context) == "gemini-2.0-flash-001 answer"
+    assert client.calls == [("gemini-2.0-flash-lite-001", 1024), ("gemini-2.0-flash-001", 8192)]
+
+    stats = tiered.stats()
+    assert stats[QUICK]["requests"] == 1 and stats[FULL]["requests"] == 1
+    assert stats[QUICK]["p50_latency"] is not None
+
+def test_per_request_override_and_pluggable_classifier():
+    client = RecordingClient()
+    tiers = (ModelTier("tiny", "tiny-model", 256, 1.0), ModelTier("big", "big-model", 4096, 10.0))
+    tiered = TieredVertexClient(client, tiers=tiers, classifier=lambda text: "tiny", default_tier="big")
+    context = {"system_instruction": "x"}
+
+    async def run(message):
+        return await tiered.handle_message_async(message, context)
+
+    assert asyncio.run(run({"content": "anything"})) == "tiny-model answer"
+    assert asyncio.run(run({"content": "anything", "model_tier": "big"})) == "big-model answer"
+    # Unknown tiers fall back to the default rather than failing the request.
+    assert asyncio.run(run({"content": "anything", "model_tier": "missing"})) == "big-model answer"
@@ -0,0 +1,150 @@
+import asyncio
+import threading
+import pytest
+from deadlines import DeadlineExceeded, deadline_after
+from resilient_vertex import ResilientVertexClient, NoHealthyBackendError, CircuitBreaker, OPEN, HALF_OPEN, CLOSED
+
+class FakeBackend:
+    """Local stand-in for VertexAIClient with configurable latency and failures."""
+
+    def __init__(self, name, first_chunk_delay=0.0, chunks=("Hello", " world"), fail=False):
+        self.name = name
+        self.first_chunk_delay = first_chunk_delay
+        self.chunks = chunks
+        self.fail = fail
+        self.calls = 0
+        self.closed_early = 0
+
+    async def generate_response_async(self, user_input, system_instruction, usage_tags=None, cancel_token=None, deadline=None):
+        self.calls += 1
+        finished = False
+        try:
+            await asyncio.sleep(self.first_chunk_delay)
+            if self.fail:
+                raise RuntimeError(f"{self.name} unavailable")
+            for chunk in self.chunks:
+                yield chunk
+            finished = True
+        finally:
+            if not finished:
+                self.closed_early += 1
+
+def collect(client, user_input="question"):
+    async def run():
+        return [chunk async for chunk in client.generate_response_async(user_input, "instruction")]
+    return asyncio.run(run())
+
+def test_single_fast_backend():
+    primary = FakeBackend("primary")
+    client = ResilientVertexClient([primary], default_hedge_delay=1.0)
+    assert collect(client) == ["Hello", " world"]
+    assert client.stats()["backends"]["primary"]["successes"] == 1
+    assert client.hedges_sent == 0
+
+def test_hedges_slow_primary_and_cancels_loser():
+    slow = FakeBackend("slow", first_chunk_delay=1.0)
+    fast = FakeBackend("fast", first_chunk_delay=0.0, chunks=("fast answer",))
+    client = ResilientVertexClient([slow, fast], default_hedge_delay=0.02)
+    assert collect(client) == ["fast answer"]
+    assert client.hedges_sent == 1
+    assert slow.calls == 1 and slow.closed_early == 1
+    assert client.stats()["backends"]["fast"]["hedge_wins"] == 1
+
+def test_hedge_delay_tracks_observed_percentile():
+    primary = FakeBackend("primary")
+    client = ResilientVertexClient([primary], min_samples=3, default_hedge_delay=5.0)
+    assert client._hedge_delay(client.backends[0]) == 5.0
+    client.backends[0].first_chunk_latencies.extend([0.1, 0.2, 0.3, 0.4])
+    assert client._hedge_delay(client.backends[0]) == 0.4
+
+def test_fails_over_on_error_and_opens_circuit():
+    broken = FakeBackend("broken", fail=True)
+    healthy = FakeBackend("healthy")
+    client = ResilientVertexClient([broken, healthy], failure_threshold=2, reset_timeout=60.0)
+    client.backends[0].first_chunk_latencies.append(0.0)  # It was the fastest until it broke
+    assert collect(client) == ["Hello", " world"]
+    assert collect(client) == ["Hello", " world"]
+    assert client.stats()["backends"]["broken"]["state"] == OPEN
+    # With its circuit open the broken backend is no longer tried.
+    collect(client)
+    assert broken.calls == 2
+
+def test_all_backends_failing():
+    client = ResilientVertexClient([FakeBackend("a", fail=True), FakeBackend("b", fail=True)])
+    with pytest.raises(NoHealthyBackendError):
+        collect(client)
+
+def test_first_chunk_timeout():
+    client = ResilientVertexClient([FakeBackend("stuck", first_chunk_delay=5.0)], first_chunk_timeout=0.05)
+    with pytest.raises(TimeoutError):
+        collect(client)
+
+def test_caller_deadline_does_not_count_against_backend():
+    stuck = FakeBackend("stuck", first_chunk_delay=5.0)
+    client = ResilientVertexClient([stuck], first_chunk_timeout=60.0, failure_threshold=1)
+
+    async def run():
+        return [chunk async for chunk in client.generate_response_async(
+            "question", "instruction", deadline=deadline_after(0.05))]
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+    assert stuck.closed_early == 1
+    assert client.stats()["backends"]["stuck"]["state"] == CLOSED
+
+def test_circuit_breaker_half_open_trial():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0, clock=lambda: now[0])
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+    now[0] = 10.0
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+def test_closing_stream_during_half_open_trial_releases_the_breaker():
+    now = [0.0]
+    backend = FakeBackend("primary")
+    client = ResilientVertexClient([backend], failure_threshold=1, reset_timeout=10.0, clock=lambda: now[0])
+    breaker = client.backends[0].breaker
+    breaker.record_failure()
+    now[0] = 10.0
+
+    async def read_one_chunk():
+        stream = client.generate_response_async("question", "instruction")
+        assert await stream.__anext__() == "Hello"
+        assert breaker.state == HALF_OPEN and not breaker.available()
+        await stream.aclose()
+    asyncio.run(read_one_chunk())
+    assert breaker.available() and backend.closed_early == 1
+    assert collect(client) == ["Hello", " world"]
+    assert breaker.state == CLOSED
+
+def test_unmeasured_backends_follow_measured_ones():
+    client = ResilientVertexClient([FakeBackend("new"), FakeBackend("slow"), FakeBackend("fast")])
+    new, slow, fast = client.backends
+    slow.first_chunk_latencies.append(0.8)
+    fast.first_chunk_latencies.append(0.2)
+    assert client._ordered_backends() == [fast, slow, new]
+
+def test_sync_handle_message():
+    client = ResilientVertexClient([FakeBackend("primary")])
+    assert client.handle_message({"content": "hi"}, {"system_instruction": "x"}) == "Hello world"
+
+def test_sync_callers_share_one_event_loop():
+    loops = []
+    class LoopRecordingBackend(FakeBackend):
+        async def generate_response_async(self, *args, **kwargs):
+            loops.append(asyncio.get_running_loop())
+            async for chunk in super().generate_response_async(*args, **kwargs):
+                yield chunk
+    client = ResilientVertexClient([LoopRecordingBackend("primary")])
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        client.handle_message({"content": "hi"}, {"system_instruction": "x"}))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["Hello world"] * 4
+    assert len(set(map(id, loops))) == 1 and not loops[0].is_closed()
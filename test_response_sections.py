@@ -0,0 +1,89 @@
+import asyncio
+from response_sections import SectionParser, parse_sections, parse_sections_async
+
+ANSWER = """Based on the symptoms provided:
+
+**Diagnosis**:
+1. Chronic bronchitis (most likely based on symptoms
+   and smoking history).
+2. Possible early indication of COPD.
+
+**Reasoning**:
+The patient's smoking history and prolonged cough strongly suggest chronic bronchitis.
+
+**Treatment Recommendations**:
+-   **Medications**:
+    -   Bronchodilators (e.g., Albuterol as needed).
+-   **Referrals**:
+    -   Pulmonologist consultation.
+
+**Possible Complications:**
+-   Shortness of breath.
+
+## Preventative Measures
+-   Avoid lung irritants.
+
+**Disclaimer**: Recommend clinical evaluation."""
+
+def _parse(text, chunk_size):
+    parser = SectionParser()
+    events = []
+    for i in range(0, len(text), chunk_size):
+        events.extend(parser.feed(text[i:i + chunk_size]))
+    return events + parser.close()
+
+def test_sections_and_items():
+    events = _parse(ANSWER, len(ANSWER))
+    sections = [event["section"] for event in events if event["event"] == "section_start"]
+    assert sections == ["Diagnosis", "Reasoning", "Treatment Recommendations", "Possible Complications",
+                        "Preventative Measures", "Disclaimer"]
+    items = [(event["section"], event["text"], event["level"]) for event in events if event["event"] == "item"]
+    assert items[:3] == [
+        (None, "Based on the symptoms provided:", 0),
+        ("Diagnosis", "Chronic bronchitis (most likely based on symptoms and smoking history).", 0),
+        ("Diagnosis", "Possible early indication of COPD.", 0),
+    ]
+    assert ("Treatment Recommendations", "Medications:", 0) in items
+    assert ("Treatment Recommendations", "Bronchodilators (e.g., Albuterol as needed).", 1) in items
+    assert items[-1] == ("Disclaimer", "Recommend clinical evaluation.", 0)
+    assert events[-1] == {"event": "section_end", "section": "Disclaimer"}
+
+def test_events_do_not_depend_on_chunking():
+    expected = _parse(ANSWER, len(ANSWER))
+    for chunk_size in (1, 3, 17, 64):
+        assert _parse(ANSWER, chunk_size) == expected
+
+def test_section_is_reported_before_the_stream_ends():
+    parser = SectionParser()
+    assert parser.feed("**Diagnosis**:\n1. Influenza.\n2. Com") == [
+        {"event": "section_start", "section": "Diagnosis"}]
+    assert parser.feed("mon cold.\n\n**Reasoning**") == [
+        {"event": "item", "section": "Diagnosis", "text": "Influenza.", "level": 0},
+        {"event": "item", "section": "Diagnosis", "text": "Common cold.", "level": 0}]
+    assert parser._buffer == "**Reasoning**"  # Only the unfinished line is kept
+
+def test_parse_sections_closes_upstream_when_consumer_leaves():
+    closed = []
+    def chunks():
+        try:
+            yield "**Diagnosis**:\n- Flu.\n"
+            yield "- Cold.\n"
+        finally:
+            closed.append(True)
+    events = parse_sections(chunks())
+    assert next(events) == {"event": "section_start", "section": "Diagnosis"}
+    events.close()
+    assert closed == [True]
+
+def test_parse_sections_async():
+    async def chunks():
+        for chunk in ["**Disclaimer**: See", " a doctor."]:
+            yield chunk
+
+    async def main():
+        return [event async for event in parse_sections_async(chunks())]
+    assert asyncio.run(main()) == [
+        {"event": "section_start", "section": "Disclaimer"},
+        {"event": "item", "section": "Disclaimer", "text": "See a doctor.", "level": 0},
+        {"event": "section_end", "section": "Disclaimer"},
+    ]
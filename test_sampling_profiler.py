@@ -0,0 +1,55 @@
+import threading
+import time
+from sampling_profiler import SamplingProfiler, ProfileStore, profile_for
+
+def _busy_work(stop):
+    while not stop.is_set():
+        sum(i * i for i in range(1000))
+
+def test_profiler_captures_busy_thread_in_collapsed_format():
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy_work, args=(stop,))
+    worker.start()
+    try:
+        with SamplingProfiler(interval=0.001, thread_ids=[worker.ident]) as profiler:
+            time.sleep(0.2)
+    finally:
+        stop.set()
+        worker.join()
+
+    lines = profiler.collapsed().splitlines()
+    assert lines and profiler.samples > 0
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+        assert stack.split(";")[0].startswith("threading:")
+    assert any("test_sampling_profiler:_busy_work" in line for line in lines)
+    assert profiler.summary()["distinct_stacks"] == len(lines)
+
+def test_profile_for_skips_the_waiting_thread():
+    collapsed = profile_for(0.05, interval=0.001)
+    assert "test_profile_for_skips_the_waiting_thread" not in collapsed
+
+def test_profile_store_keeps_most_recent():
+    store = ProfileStore(max_profiles=2)
+    first = store.add("a 1\n")
+    second = store.add("b 1\n")
+    third = store.add("c 1\n")
+    assert store.get(first) is None
+    assert store.get(second) == "b 1\n"
+    assert store.get(third) == "c 1\n"
+
+def test_request_profile_follows_deadline_bound_module_call():
+    from ai_coordinator import AICoordinator
+    class BusyModule:
+        def handle_message(self, message, context):
+            deadline = time.monotonic() + 0.2
+            while time.monotonic() < deadline:
+                sum(i * i for i in range(1000))
+            return "done"
+    coordinator = AICoordinator()
+    coordinator.register_module("busy", BusyModule())
+    coordinator.set_module_timeout("busy", 5)  # Runs the call on its own worker thread
+    with SamplingProfiler(interval=0.001, thread_ids=[threading.get_ident()]) as profiler:
+        assert coordinator.route_message({"target_module": "busy"}) == "done"
+    assert "BusyModule.handle_message" in profiler.collapsed()
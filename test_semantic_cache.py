@@ -0,0 +1,97 @@
+import asyncio
+from semantic_cache import SemanticCache, SemanticCachingClient
+
+VOCAB = ["cough", "weeks", "6", "smoker", "persistent", "rash", "child", "fever", "dose", "amoxicillin"]
+SYNONYMS = {"coughing": "cough", "six": "6", "smoking": "smoker"}
+
+def embed(text):
+    words = [SYNONYMS.get(w, w) for w in text.lower().replace("?", "").split()]
+    return [float(words.count(term)) for term in VOCAB] + [0.01]
+
+class CountingModule:
+    def __init__(self):
+        self.calls = 0
+
+    def stream_message(self, message, context):
+        self.calls += 1
+        yield f"answer {self.calls} "
+        yield "for " + message["content"]
+
+    async def stream_message_async(self, message, context):
+        for chunk in self.stream_message(message, context):
+            yield chunk
+
+def test_paraphrase_hits_within_scope_only():
+    module = CountingModule()
+    client = SemanticCachingClient(module, SemanticCache(embed, threshold=0.9, audit_rate=0))
+    context = {"system_instruction": "clinic"}
+
+    first = client.handle_message({"content": "persistent cough 6 weeks smoker"}, context)
+    assert client.handle_message({"content": "smoker coughing for six weeks persistent"}, context) == first
+    assert module.calls == 1
+
+    # Different instruction, tier or topic: no reuse.
+    client.handle_message({"content": "persistent cough 6 weeks smoker"}, {"system_instruction": "other"})
+    client.handle_message({"content": "persistent cough 6 weeks smoker", "model_tier": "quick"}, context)
+    client.handle_message({"content": "child rash fever"}, context)
+    client.handle_message({"content": "persistent cough 6 weeks smoker", "cache": False}, context)
+    assert module.calls == 5
+
+    stats = client.stats()
+    assert stats["hits"] == 1 and stats["lookups"] == 5
+    assert stats["entries"] == 4
+
+def test_audit_counts_false_hits_and_drops_entry():
+    answers = iter(["amoxicillin dose", "rash fever child"])
+    class ChangingModule:
+        async def stream_message_async(self, message, context):
+            yield next(answers)
+    cache = SemanticCache(embed, threshold=0.9, audit_rate=1.0)
+    client = SemanticCachingClient(ChangingModule(), cache)
+    context = {"system_instruction": "clinic"}
+
+    asyncio.run(client.handle_message_async({"content": "amoxicillin dose"}, context))
+    # Audited hit: regenerated, and the fresh answer disagrees with the cached one.
+    fresh = asyncio.run(client.handle_message_async({"content": "dose amoxicillin?"}, context))
+    assert fresh == "rash fever child"
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["audits"] == 1 and stats["false_hits"] == 1
+    assert stats["entries"] == 0
+
+def test_error_responses_stay_out_of_the_statistics():
+    failing = [False]
+    class FlakyModule(CountingModule):
+        def stream_message(self, message, context):
+            if failing[0]:
+                yield "Error: Vertex AI is unavailable."
+            else:
+                yield from super().stream_message(message, context)
+    cache = SemanticCache(embed, threshold=0.9, audit_rate=0)
+    client = SemanticCachingClient(FlakyModule(), cache)
+    context = {"system_instruction": "clinic"}
+
+    failing[0] = True
+    client.handle_message({"content": "child rash fever"}, context)
+    asyncio.run(client.handle_message_async({"content": "child rash fever"}, context))
+    assert cache.stats()["lookups"] == 0 and cache.stats()["entries"] == 0
+
+    failing[0] = False
+    client.handle_message({"content": "child rash fever"}, context)
+    cache.audit_rate = 1.0
+    failing[0] = True  # An audited hit whose fresh answer fails is not an audit
+    assert client.handle_message({"content": "fever child rash"}, context).startswith("Error:")
+    stats = cache.stats()
+    assert stats["lookups"] == 1 and stats["hits"] == 0 and stats["audits"] == 0
+    assert stats["entries"] == 1
+
+def test_ttl_and_capacity():
+    now = [0.0]
+    cache = SemanticCache(embed, max_entries=2, ttl=10, clock=lambda: now[0])
+    first = cache.store("cough", "s", "a1")
+    cache.store("rash", "s", "a2")
+    cache.store("fever", "s", "a3")
+    assert cache.lookup("cough", "s")[0] is None  # Evicted as the oldest
+    assert cache.lookup("rash", "s")[1] == "a2"
+    now[0] = 11
+    assert cache.lookup("rash", "s")[0] is None
+    assert not cache.report_false_hit(first)
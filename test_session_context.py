@@ -0,0 +1,63 @@
+import threading
+import pytest
+from session_context import SessionContextStore
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_overrides_layer_over_defaults_and_snapshots_are_immutable():
+    store = SessionContextStore(defaults={"system_instruction": "global"})
+    store.set("s1", "system_instruction", "session one")
+    snapshot = store.snapshot("s1")
+
+    assert snapshot["system_instruction"] == "session one"
+    assert store.snapshot("s2")["system_instruction"] == "global"
+    assert store.snapshot()["system_instruction"] == "global"
+    with pytest.raises(TypeError):
+        snapshot["system_instruction"] = "mutated"
+
+    # Copy-on-write: later writes don't leak into snapshots already handed out.
+    store.set("s1", "system_instruction", "changed")
+    store.set_default("language", "en")
+    assert snapshot["system_instruction"] == "session one"
+    assert "language" not in snapshot
+    assert store.snapshot("s1")["language"] == "en"
+
+def test_ttl_and_lru_eviction_with_memory_accounting():
+    clock = FakeClock()
+    store = SessionContextStore(max_sessions=10, ttl=100, clock=clock)
+    for i in range(10):
+        clock.now = i
+        store.set(f"s{i}", "notes", "x" * 100)
+    assert len(store) == 10
+    assert store.bytes_used() > 1000
+
+    clock.now = 10
+    store.snapshot("s0")  # Touch s0 so it is the most recently used
+    store.set("s10", "notes", "x")  # Over capacity: evicts the oldest down to 90%
+    assert "s0" in store and "s10" in store
+    assert "s1" not in store and len(store) == 9
+    assert store.stats()["evicted_lru"] == 2
+
+    clock.now = 500
+    assert store.evict_expired() == 9
+    assert len(store) == 0 and store.bytes_used() == 0
+
+def test_concurrent_sessions_do_not_interfere():
+    store = SessionContextStore()
+
+    def worker(n):
+        for i in range(200):
+            store.set(f"session{n}", "turn", i)
+            assert store.get(f"session{n}", "turn") == i
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(store.get(f"session{n}", "turn") == 199 for n in range(8))
@@ -0,0 +1,65 @@
+from text_index import BM25Index, tokenize
+
+def test_tokenize_keeps_codes_and_doses_whole():
+    assert tokenize("HbA1c 7.2%, LOINC 4548-4; Metformin 500mg") == ["hba1c", "7.2", "loinc", "4548-4", "metformin", "500mg"]
+
+def test_bm25_ranking(tmp_path):
+    index = BM25Index(str(tmp_path))
+    index.add({"type": "conversation", "sessionId": "a", "id": 1}, "Started metformin, HbA1c 7.2 last month")
+    index.add({"type": "conversation", "sessionId": "a", "id": 2}, "Patient reports persistent cough")
+    index.add({"type": "conversation", "sessionId": "b", "id": 1}, "Metformin metformin dose review, kidney function")
+
+    results = index.search("metformin", k=5)
+    assert [ref["sessionId"] for _, ref in results] == ["b", "a"]
+    assert index.search("cough", k=5)[0][1] == {"type": "conversation", "sessionId": "a", "id": 2}
+    assert index.search("warfarin") == []
+
+def test_persistence_compaction_and_replacement(tmp_path):
+    index = BM25Index(str(tmp_path), compact_every=3)
+    for i in range(4):
+        index.add({"type": "conversation", "sessionId": "s", "id": i}, f"note {i} amoxicillin")
+    index.add({"type": "summary", "sessionId": "s", "id": "sum"}, "old summary mentions warfarin")
+    index.add({"type": "summary", "sessionId": "s", "id": "sum"}, "new summary mentions apixaban")
+    assert len(index) == 5
+
+    # Reopen from disk: compacted postings plus the log written since.
+    reopened = BM25Index(str(tmp_path))
+    assert len(reopened) == 5
+    assert len(reopened.search("amoxicillin", k=10)) == 4
+    assert reopened.search("warfarin") == []
+    assert reopened.search("apixaban")[0][1]["id"] == "sum"
+
+    reopened.compact()
+    assert len(BM25Index(str(tmp_path)).search("amoxicillin", k=10)) == 4
+
+def test_torn_log_line_is_ignored(tmp_path):
+    index = BM25Index(str(tmp_path))
+    index.add({"type": "conversation", "sessionId": "s", "id": 1}, "lisinopril")
+    with open(tmp_path / "log.jsonl", "a") as f:
+        f.write('[1, 3, {"type": "conv')
+    reopened = BM25Index(str(tmp_path))
+    reopened.add({"type": "conversation", "sessionId": "s", "id": 2}, "lisinopril again")
+    assert len(BM25Index(str(tmp_path)).search("lisinopril", k=10)) == 2
+
+def test_remove_session_survives_reopen(tmp_path):
+    index = BM25Index(str(tmp_path))
+    index.add({"type": "conversation", "sessionId": "old", "id": 1}, "digoxin level")
+    index.add({"type": "summary", "sessionId": "old", "id": 1}, "digoxin summary")
+    index.add({"type": "conversation", "sessionId": "new", "id": 1}, "digoxin stopped")
+    index.compact()
+    assert index.remove_session("old", "conversation") == 1
+    reopened = BM25Index(str(tmp_path))
+    assert {(ref["type"], ref["sessionId"]) for _, ref in reopened.search("digoxin")} == {("summary", "old"), ("conversation", "new")}
+
+def test_instances_sharing_a_directory_stay_in_sync(tmp_path):
+    # Two instances stand in for two worker processes writing the same index.
+    first = BM25Index(str(tmp_path))
+    second = BM25Index(str(tmp_path))
+    first.add({"type": "conversation", "sessionId": "a", "id": 1}, "insulin glargine")
+    second.add({"type": "conversation", "sessionId": "b", "id": 1}, "insulin lispro")
+    assert len(first.search("insulin")) == 2
+
+    first.compact()
+    second.add({"type": "conversation", "sessionId": "c", "id": 1}, "insulin pump")
+    assert {ref["sessionId"] for _, ref in first.search("insulin")} == {"a", "b", "c"}
+    assert {ref["sessionId"] for _, ref in BM25Index(str(tmp_path)).search("insulin")} == {"a", "b", "c"}
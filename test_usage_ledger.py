@@ -0,0 +1,103 @@
+import asyncio
+from types import SimpleNamespace
+from usage_ledger import UsageLedger, UsageFlushJob
+from vertex_ai_module import VertexAIClient
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class RecordingChronos:
+    def __init__(self):
+        self.entries = []
+
+    def info(self, message, context=None):
+        self.entries.append((message, context))
+
+def test_aggregates_by_group_over_rolling_window():
+    clock = FakeClock()
+    ledger = UsageLedger(bucket_seconds=60, max_window=3600, clock=clock)
+    ledger.record("alice", "vertex_ai", "flash", 100, 50)
+    ledger.record("bob", "vertex_ai", "pro", 10, 5, total_tokens=20)
+    clock.now += 600
+    ledger.record("alice", "vertex_ai", "pro", 1000, 500)
+
+    by_user = ledger.aggregate(window=3600, by=("user_id",))
+    assert by_user[0] == {"user_id": "alice", "requests": 2, "prompt_tokens": 1100,
+                          "completion_tokens": 550, "total_tokens": 1650}
+    assert by_user[1]["total_tokens"] == 20
+    assert ledger.aggregate(window=60, by=())[0]["total_tokens"] == 1500
+    assert {row["model"]: row["requests"] for row in ledger.aggregate(by=("model",))} == {"pro": 2, "flash": 1}
+
+    clock.now += 3600 + 60
+    ledger.record("carol", "vertex_ai", "flash", 1, 1)
+    assert [row["user_id"] for row in ledger.aggregate(by=("user_id",))] == ["carol"]
+
+def test_heaviest_requests_and_report():
+    ledger = UsageLedger(max_heavy=2, prompt_preview=5, clock=FakeClock())
+    ledger.record("a", "vertex_ai", "flash", 10, 10, prompt="short question")
+    ledger.record("b", "vertex_ai", "flash", 900, 100, prompt="long document")
+    ledger.record("c", "vertex_ai", "flash", 50, 50, prompt="medium")
+    heaviest = ledger.heaviest(n=5)
+    assert [row["user_id"] for row in heaviest] == ["b", "c"]
+    assert heaviest[0]["prompt_preview"] == "long "
+    report = ledger.report(by=("user_id",), top=1)
+    assert report["totals"]["requests"] == 3
+    assert [row["user_id"] for row in report["groups"]] == ["b"]
+
+def test_flush_job_writes_usage_since_last_flush():
+    ledger = UsageLedger(clock=FakeClock())
+    chronos = RecordingChronos()
+    job = UsageFlushJob(ledger, chronos)
+    ledger.record("alice", "vertex_ai", "flash", 3, 4)
+    ledger.record("alice", "vertex_ai", "flash", 3, 4)
+    assert job.flush() == 1
+    assert chronos.entries[0][1] == {"user_id": "alice", "module": "vertex_ai", "model": "flash",
+                                     "requests": 2, "prompt_tokens": 6, "completion_tokens": 8, "total_tokens": 14}
+    assert job.flush() == 0
+
+def _chunks(*texts):
+    chunks = [SimpleNamespace(text=text, usage_metadata=None) for text in texts]
+    chunks[-1].usage_metadata = SimpleNamespace(prompt_token_count=12, candidates_token_count=30,
+                                                total_token_count=42)
+    return chunks
+
+async def _async_chunks(*texts):
+    for chunk in _chunks(*texts):
+        yield chunk
+
+async def _stream_async(*texts, **kwargs):
+    return _async_chunks(*texts)
+
+def test_vertex_client_records_stream_usage():
+    ledger = UsageLedger(clock=FakeClock())
+    client = VertexAIClient.__new__(VertexAIClient)
+    client.model = "gemini-test"
+    client.ledger = ledger
+    client.client = SimpleNamespace(
+        models=SimpleNamespace(generate_content_stream=lambda **kwargs: iter(_chunks("Hel", "lo"))),
+        aio=SimpleNamespace(models=SimpleNamespace(generate_content_stream=lambda **kwargs: _stream_async("Hi"))),
+    )
+    message = {"content": "question", "user_id": "alice", "target_module": "vertex_ai"}
+    context = {"system_instruction": "Be brief."}
+
+    assert client.handle_message(message, context) == "Hello"
+    assert asyncio.run(client.handle_message_async(message, context)) == "Hi"
+    rows = ledger.aggregate()
+    assert rows == [{"user_id": "alice", "module": "vertex_ai", "model": "gemini-test", "requests": 2,
+                     "prompt_tokens": 24, "completion_tokens": 60, "total_tokens": 84}]
+
+def test_prompts_are_hashed_by_default_and_stop_drains_the_log(tmp_path):
+    from usage_ledger import usage_chronos_logger
+    ledger = UsageLedger(clock=FakeClock())
+    ledger.record("alice", "vertex_ai", "flash", 10, 10, prompt="Chest pain since Tuesday")
+    request = ledger.heaviest()[0]
+    assert "prompt_preview" not in request and len(request["prompt_hash"]) == 16
+
+    path = tmp_path / "usage.log"
+    job = UsageFlushJob(ledger, usage_chronos_logger(str(path)), interval=3600).start()
+    job.stop()
+    assert "'user_id': 'alice'" in path.read_text()
@@ -0,0 +1,332 @@
+# text_index.py
+#
+# Incremental BM25 keyword index over one user's conversations and summaries.
+#
+# On disk, each index is a directory holding:
+#   postings.bin  compacted posting lists (delta + varint encoded)
+#   docs.json     the document table matching postings.bin
+#   log.jsonl     documents added (or sessions deleted) since the last
+#                 compaction, one per line
+# Adding a document appends one line to the log. Once the log grows past
+# compact_every lines, it is folded into postings.bin.
+
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import threading
+from array import array
+
+from file_locks import FileLock, atomic_write_json
+
+MAGIC = b"BM25\x02"
+
+# Drug names, doses and lab codes ("HbA1c", "2345-7", "0.5mg") stay single tokens.
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-.][a-z0-9]+)*")
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower()) if text else []
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class BM25Index:
+    """
+    Args:
+        directory: Where the index files live; created if missing.
+        k1, b: BM25 parameters.
+        compact_every: Log entries to accumulate before rewriting postings.bin.
+    """
+
+    def __init__(self, directory, k1=1.2, b=0.75, compact_every=1000):
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self.compact_every = compact_every
+        self.logger = logging.getLogger("text_index")
+        self._lock = threading.Lock()
+        self._postings_stamp = None  # stat of postings.bin as loaded
+        self._reset_state()
+        os.makedirs(directory, exist_ok=True)
+        # Several processes may share an index directory; every operation
+        # holds this lock and first catches up with their writes.
+        self._file_lock = FileLock(self._path("index.lock"))
+        with self._file_lock.hold():
+            self._load()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _stamp(self, name):
+        try:
+            stat = os.stat(self._path(name))
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _sync(self):
+        log_stamp = self._stamp("log.jsonl")
+        log_size = log_stamp[2] if log_stamp else 0
+        if self._stamp("postings.bin") != self._postings_stamp or log_size < self._log_offset:
+            # Another process compacted the index; start over from its files.
+            self._reset_state()
+            self._load()
+        elif log_size > self._log_offset:
+            self._replay_log()
+
+    def _reset_state(self):
+        # term -> (array of doc ids, array of term frequencies), or the term's
+        # still-encoded bytes from postings.bin until it is first needed.
+        self._postings = {}
+        self._refs = []  # doc id -> ref dict, or None once superseded
+        self._lengths = array("I")
+        self._total_length = 0
+        self._live_docs = 0
+        self._doc_by_key = {}  # ref key -> current doc id
+        self._log_entries = 0
+        self._covered = 0  # Documents contained in postings.bin
+        self._log_offset = 0  # Bytes of log.jsonl already applied
+
+    def _append_log(self, record):
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        with open(self._path("log.jsonl"), "ab") as f:
+            f.write(line)
+        self._log_offset += len(line)
+
+    @staticmethod
+    def _key(ref):
+        return (ref.get("type"), ref.get("sessionId"), ref.get("id"))
+
+    def _decoded(self, term):
+        postings = self._postings.get(term)
+        if isinstance(postings, memoryview):
+            docs, freqs = array("I"), array("H")
+            pos = 0
+            doc_id = 0
+            while pos < len(postings):
+                delta, pos = _read_varint(postings, pos)
+                tf, pos = _read_varint(postings, pos)
+                doc_id += delta
+                docs.append(doc_id)
+                freqs.append(tf)
+            postings = self._postings[term] = (docs, freqs)
+        return postings
+
+    def _index_document(self, doc_id, ref, term_counts, length):
+        old = self._doc_by_key.get(self._key(ref))
+        if old is not None and self._refs[old] is not None:
+            # A re-saved document (e.g. a rewritten summary) replaces the old one.
+            self._refs[old] = None
+            self._total_length -= self._lengths[old]
+            self._live_docs -= 1
+        while len(self._refs) <= doc_id:
+            self._refs.append(None)
+            self._lengths.append(0)
+        self._refs[doc_id] = ref
+        self._lengths[doc_id] = length
+        self._total_length += length
+        self._live_docs += 1
+        self._doc_by_key[self._key(ref)] = doc_id
+        for term, count in term_counts.items():
+            postings = self._decoded(term)
+            if postings is None:
+                postings = self._postings[term] = (array("I"), array("H"))
+            postings[0].append(doc_id)
+            postings[1].append(min(count, 0xFFFF))
+
+    def add(self, ref, text):
+        """
+        Indexes text under ref, a small JSON-serializable dict identifying the
+        document. Adding a ref with the same type, sessionId and id again
+        replaces the earlier version.
+        """
+        tokens = tokenize(text)
+        term_counts = {}
+        for token in tokens:
+            term_counts[token] = term_counts.get(token, 0) + 1
+        with self._lock, self._file_lock.hold():
+            self._sync()
+            doc_id = len(self._refs)
+            self._index_document(doc_id, ref, term_counts, len(tokens))
+            self._append_log([doc_id, len(tokens), ref, term_counts])
+            self._log_entries += 1
+            if self._log_entries >= self.compact_every:
+                self._compact()
+
+    def remove_session(self, session_id, doc_type=None):
+        """Removes every document of a session (optionally only of one type). Returns how many."""
+        with self._lock, self._file_lock.hold():
+            self._sync()
+            removed = self._remove_session(session_id, doc_type)
+            if removed:
+                self._append_log({"delete": session_id, "type": doc_type})
+            return removed
+
+    def _remove_session(self, session_id, doc_type):
+        removed = 0
+        for key, doc_id in list(self._doc_by_key.items()):
+            if key[1] == session_id and (doc_type is None or key[0] == doc_type):
+                del self._doc_by_key[key]
+                if self._refs[doc_id] is not None:
+                    self._refs[doc_id] = None
+                    self._total_length -= self._lengths[doc_id]
+                    self._live_docs -= 1
+                    removed += 1
+        return removed
+
+    def search(self, query, k=10):
+        """Returns up to k (score, ref) pairs, best first."""
+        terms = set(tokenize(query))
+        with self._lock, self._file_lock.hold():
+            self._sync()
+            if not terms or not self._live_docs:
+                return []
+            n = self._live_docs
+            avg_length = self._total_length / n
+            scores = {}
+            for term in terms:
+                postings = self._decoded(term)
+                if postings is None:
+                    continue
+                docs, freqs = postings
+                idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                for doc_id, tf in zip(docs, freqs):
+                    if self._refs[doc_id] is None:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(score, self._refs[doc_id]) for doc_id, score in best]
+
+    def __len__(self):
+        return self._live_docs
+
+    def compact(self):
+        with self._lock, self._file_lock.hold():
+            self._sync()
+            self._compact()
+
+    def _compact(self):
+        covered = len(self._refs)
+        out = bytearray(MAGIC)
+        _write_varint(out, covered)
+        live_terms = []
+        for term in list(self._postings):
+            docs, freqs = self._decoded(term)
+            pairs = [(d, f) for d, f in zip(docs, freqs) if self._refs[d] is not None]
+            if pairs:
+                live_terms.append((term, pairs))
+        _write_varint(out, len(live_terms))
+        for term, pairs in live_terms:
+            encoded = term.encode("utf-8")
+            _write_varint(out, len(encoded))
+            out += encoded
+            payload = bytearray()
+            previous = 0
+            for doc_id, tf in pairs:
+                _write_varint(payload, doc_id - previous)
+                _write_varint(payload, tf)
+                previous = doc_id
+            _write_varint(out, len(payload))
+            out += payload
+
+        atomic_write_json(self._path("docs.json"), {"refs": self._refs, "lengths": self._lengths.tolist()})
+        postings_tmp = self._path("postings.bin.tmp")
+        with open(postings_tmp, "wb") as f:
+            f.write(out)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(postings_tmp, self._path("postings.bin"))
+        # Anything still in the log is below `covered` and skipped on load, so
+        # a crash before this truncation is harmless.
+        open(self._path("log.jsonl"), "w").close()
+        self._covered = covered
+        self._postings_stamp = self._stamp("postings.bin")
+        self._log_offset = 0
+        self._log_entries = 0
+        self.logger.info(f"Compacted {self.directory}: {self._live_docs} documents, {len(live_terms)} terms.")
+        self._postings = {term: (array("I", (d for d, _ in pairs)), array("H", (f for _, f in pairs)))
+                          for term, pairs in live_terms}
+
+    def _load(self):
+        covered = 0
+        self._postings_stamp = self._stamp("postings.bin")
+        try:
+            with open(self._path("postings.bin"), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = None
+        if data is not None and data.startswith(MAGIC):
+            data = memoryview(data)
+            pos = len(MAGIC)
+            covered, pos = _read_varint(data, pos)
+            term_count, pos = _read_varint(data, pos)
+            for _ in range(term_count):
+                size, pos = _read_varint(data, pos)
+                term = bytes(data[pos:pos + size]).decode("utf-8")
+                pos += size
+                length, pos = _read_varint(data, pos)
+                # Decoded on first use, so opening a large index only reads term headers.
+                self._postings[term] = data[pos:pos + length]
+                pos += length
+
+            with open(self._path("docs.json"), "r", encoding="utf-8") as f:
+                table = json.load(f)
+            # docs.json may be newer than postings.bin after a crash mid-compaction.
+            self._refs = table["refs"][:covered]
+            self._lengths = array("I", table["lengths"][:covered])
+            for doc_id, ref in enumerate(self._refs):
+                if ref is not None:
+                    self._total_length += self._lengths[doc_id]
+                    self._live_docs += 1
+                    self._doc_by_key[self._key(ref)] = doc_id
+        self._covered = covered
+        self._replay_log()
+
+    def _replay_log(self):
+        try:
+            with open(self._path("log.jsonl"), "rb") as f:
+                f.seek(self._log_offset)
+                log = f.read()
+        except FileNotFoundError:
+            return
+        if log and not log.endswith(b"\n"):
+            # Writers hold the file lock, so an unterminated line was left by a
+            # crashed one. End it so the next append starts on a fresh line.
+            with open(self._path("log.jsonl"), "ab") as f:
+                f.write(b"\n")
+            log += b"\n"
+        self._log_offset += len(log)
+        for line in log.decode("utf-8", errors="replace").splitlines():
+            try:
+                record = json.loads(line)
+                if isinstance(record, dict):
+                    # Deletions are replayed regardless of `covered`; they are idempotent.
+                    self._remove_session(record["delete"], record.get("type"))
+                    continue
+                doc_id, length, ref, term_counts = record
+            except (ValueError, KeyError, TypeError):
+                continue  # Torn line from an interrupted write
+            self._log_entries += 1
+            if doc_id >= self._covered:
+                self._index_document(doc_id, ref, term_counts, length)
@@ -1,15 +1,44 @@
 # text_to_speech.py
 from google.cloud import texttospeech
+import logging
 import os
+import re
 import tempfile
 import playsound
 import threading  # Import threading
+from concurrent.futures import ThreadPoolExecutor
+from cancellation import RequestCancelled
+from deadlines import DeadlineExceeded, time_left
+
+# Text is synthesized and played a few sentences at a time, so playback starts
+# sooner and a cancelled request stops after the segment that is playing.
+SEGMENT_CHARS = 400
+
+
+def split_segments(text, max_chars=SEGMENT_CHARS):
+    """Splits text at sentence boundaries into segments of at most max_chars (longer sentences stay whole)."""
+    segments = []
+    current = ""
+    for sentence in re.split(r"(?<=[.!?])\s+", text.strip()):
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            segments.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        segments.append(current)
+    return segments
+
 
 class TextToSpeechModule:
     def __init__(self):
         self.client = texttospeech.TextToSpeechClient()
+        # Synthesizes the next segment while the current one plays.
+        self._synthesis_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts-synthesis")
+        self.cancelled_playbacks = 0
+        self.logger = logging.getLogger("text_to_speech")
 
-    def synthesize_speech(self, text, voice_name="en-US-Studio-O", speaking_rate=1.0):
+    def synthesize_speech(self, text, voice_name="en-US-Studio-O", speaking_rate=1.0, timeout=None):
         input_text = texttospeech.SynthesisInput(text=text)
         voice = texttospeech.VoiceSelectionParams(
             language_code="en-US",
@@ -20,7 +49,8 @@ class TextToSpeechModule:
             speaking_rate=speaking_rate,
         )
         response = self.client.synthesize_speech(
-            request={"input": input_text, "voice": voice, "audio_config": audio_config}
+            request={"input": input_text, "voice": voice, "audio_config": audio_config},
+            timeout=timeout,
         )
         return response.audio_content
 
@@ -38,11 +68,61 @@ class TextToSpeechModule:
         thread = threading.Thread(target=self.play_audio, args=(audio_content,))
         thread.start()
 
+    def play_segments(self, audio_content, segments, cancel_token=None, on_done=None):
+        """
+        Plays audio_content, then synthesizes and plays each remaining text
+        segment in turn. Stops before the next segment once cancel_token is
+        cancelled.
+
+        on_done(error) is called when playback ends, however it ends: error is
+        None, or the exception that stopped synthesis or playback.
+        """
+        error = None
+        upcoming = None
+        try:
+            pending = list(segments)
+            while True:
+                upcoming = self._synthesis_pool.submit(self.synthesize_speech, pending.pop(0)) if pending else None
+                if cancel_token is not None and cancel_token.cancelled:
+                    self.cancelled_playbacks += 1
+                    return
+                self.play_audio(audio_content)
+                if upcoming is None:
+                    return
+                audio_content = upcoming.result()
+        except Exception as e:
+            error = e
+            self.logger.error(f"Speech playback failed: {e}")
+        finally:
+            if upcoming is not None:
+                upcoming.cancel()
+            if on_done is not None:
+                on_done(error)
+
+    def play_segments_async(self, audio_content, segments, cancel_token=None, on_done=None):
+        """Plays segments in a separate thread."""
+        thread = threading.Thread(target=self.play_segments, args=(audio_content, segments, cancel_token, on_done))
+        thread.start()
+
     def handle_message(self, message, context):
+        """
+        Synthesizes the first segment and starts playing in the background.
+        If this returns "Audio Played", message's optional 'on_done' callback
+        is called with None or the exception once playback ends.
+        """
         text = message.get("content")
-        audio = self.synthesize_speech(text)
+        cancel_token = message.get("cancel_token")
+        segments = split_segments(text or "")
+        if cancel_token is not None and cancel_token.cancelled:
+            self.cancelled_playbacks += 1
+            raise RequestCancelled(cancel_token.reason)
+        # Only the first segment is on the request's clock; the rest synthesize during playback.
+        budget = time_left(message.get("deadline"))
+        if budget is not None and budget <= 0:
+            raise DeadlineExceeded("text_to_speech")
+        audio = self.synthesize_speech(segments[0], timeout=budget) if segments else None
         if audio:
-            self.play_audio_async(audio)  # Play audio asynchronously
+            self.play_segments_async(audio, segments[1:], cancel_token, message.get("on_done"))  # Play audio asynchronously
             return "Audio Played"
         else:
-            return "Audio synthesis failed."
\ No newline at end of file
+            return "Audio synthesis failed."
@@ -0,0 +1,222 @@
+# usage_ledger.py
+#
+# In-memory ledger of model token usage. VertexAIClient reports the prompt,
+# completion and total token counts from each stream's usage metadata; the
+# ledger keeps them in per-minute buckets so usage can be aggregated by user,
+# module and model over any rolling window up to max_window, and remembers the
+# heaviest individual requests so expensive prompts can be found.
+#
+# UsageFlushJob periodically writes what was recorded since its last flush to
+# a ChronosLogger, for long-term storage outside this process.
+
+import collections
+import hashlib
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+GROUP_FIELDS = ("user_id", "module", "model")
+
+
+class _Usage:
+    __slots__ = ("requests", "prompt_tokens", "completion_tokens", "total_tokens")
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_tokens = 0
+
+    def add(self, prompt_tokens, completion_tokens, total_tokens, requests=1):
+        self.requests += requests
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.total_tokens += total_tokens
+
+    def merge(self, other):
+        self.add(other.prompt_tokens, other.completion_tokens, other.total_tokens, other.requests)
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+        }
+
+
+def usage_tags(message):
+    """Tags VertexAIClient attaches to the usage it records for a coordinator message."""
+    return {"user_id": message.get("user_id"), "module": message.get("target_module")}
+
+
+class UsageLedger:
+    """
+    Args:
+        bucket_seconds: Granularity of the rolling windows.
+        max_window: Longest window, in seconds, that can be queried; older
+            buckets are dropped.
+        max_heavy: Heaviest individual requests remembered per bucket.
+        prompt_preview: Characters of each heavy request's prompt kept for
+            inspection. Prompts here are patient descriptions, so the default
+            0 keeps only a hash; enable previews deliberately.
+    """
+
+    def __init__(self, bucket_seconds=60, max_window=24 * 3600, max_heavy=20, prompt_preview=0, clock=time.time):
+        self.bucket_seconds = bucket_seconds
+        self.max_window = max_window
+        self.max_heavy = max_heavy
+        self.prompt_preview = prompt_preview
+        self.clock = clock
+        self._buckets = collections.OrderedDict()  # bucket start -> {(user_id, module, model): _Usage}
+        self._heavy = {}  # bucket start -> min-heap of (total_tokens, seq, request dict)
+        self._unflushed = {}  # (user_id, module, model) -> _Usage recorded since the last flush()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def record(self, user_id, module, model, prompt_tokens, completion_tokens, total_tokens=None, prompt=None):
+        """Adds one request's token counts. total_tokens defaults to prompt plus completion."""
+        prompt_tokens = prompt_tokens or 0
+        completion_tokens = completion_tokens or 0
+        if not total_tokens:
+            total_tokens = prompt_tokens + completion_tokens
+        now = self.clock()
+        start = now - now % self.bucket_seconds
+        key = (None if user_id is None else str(user_id), module, model)
+        with self._lock:
+            bucket = self._buckets.get(start)
+            if bucket is None:
+                bucket = self._buckets[start] = {}
+                self._expire(now)
+            bucket.setdefault(key, _Usage()).add(prompt_tokens, completion_tokens, total_tokens)
+            self._unflushed.setdefault(key, _Usage()).add(prompt_tokens, completion_tokens, total_tokens)
+            if self.max_heavy:
+                request = dict(zip(GROUP_FIELDS, key), timestamp=now, prompt_tokens=prompt_tokens,
+                               completion_tokens=completion_tokens, total_tokens=total_tokens)
+                if prompt is not None:
+                    request["prompt_hash"] = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+                    if self.prompt_preview:
+                        request["prompt_preview"] = prompt[:self.prompt_preview]
+                heavy = self._heavy.setdefault(start, [])
+                item = (total_tokens, next(self._seq), request)
+                if len(heavy) < self.max_heavy:
+                    heapq.heappush(heavy, item)
+                elif total_tokens > heavy[0][0]:
+                    heapq.heapreplace(heavy, item)
+
+    def _expire(self, now):
+        cutoff = now - self.max_window - self.bucket_seconds
+        while self._buckets:
+            start = next(iter(self._buckets))
+            if start >= cutoff:
+                break
+            del self._buckets[start]
+            self._heavy.pop(start, None)
+
+    def _window_starts(self, window):
+        cutoff = self.clock() - min(window, self.max_window)
+        # A bucket counts if any part of it falls inside the window.
+        return [start for start in self._buckets if start + self.bucket_seconds > cutoff]
+
+    def aggregate(self, window=3600, by=GROUP_FIELDS):
+        """
+        Sums usage over the last `window` seconds.
+
+        Args:
+            by: Fields to group by, any of "user_id", "module" and "model".
+                An empty tuple gives a single overall total.
+
+        Returns:
+            A list of dicts with the group fields and requests, prompt_tokens,
+            completion_tokens and total_tokens, heaviest first.
+        """
+        unknown = [field for field in by if field not in GROUP_FIELDS]
+        if unknown:
+            raise ValueError(f"Cannot group usage by {', '.join(unknown)}.")
+        positions = [GROUP_FIELDS.index(field) for field in by]
+        groups = {}
+        with self._lock:
+            for start in self._window_starts(window):
+                for key, usage in self._buckets[start].items():
+                    group = tuple(key[i] for i in positions)
+                    groups.setdefault(group, _Usage()).merge(usage)
+        rows = [dict(zip(by, group), **usage.as_dict()) for group, usage in groups.items()]
+        rows.sort(key=lambda row: row["total_tokens"], reverse=True)
+        return rows
+
+    def heaviest(self, window=3600, n=10):
+        """Returns the n requests with the most total tokens in the last `window` seconds."""
+        with self._lock:
+            items = [item for start in self._window_starts(window) for item in self._heavy.get(start, ())]
+        return [dict(request) for _, _, request in heapq.nlargest(n, items)]
+
+    def report(self, window=3600, by=GROUP_FIELDS, top=10):
+        """Everything the usage API returns: overall totals, grouped usage and the heaviest requests."""
+        totals = self.aggregate(window, by=())
+        return {
+            "window": min(window, self.max_window),
+            "totals": totals[0] if totals else _Usage().as_dict(),
+            "groups": self.aggregate(window, by)[:top],
+            "heaviest": self.heaviest(window, top),
+        }
+
+    def flush(self):
+        """Returns usage recorded since the previous flush, grouped by user, module and model, and resets it."""
+        with self._lock:
+            unflushed, self._unflushed = self._unflushed, {}
+        return [dict(zip(GROUP_FIELDS, key), **usage.as_dict()) for key, usage in unflushed.items()]
+
+
+def usage_chronos_logger(path="token_usage.log"):
+    """ChronosLogger writing one line per flushed usage row to path."""
+    from cronoslog import ChronosLogger
+
+    chronos_logger = ChronosLogger(name="token_usage")
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter("%(timestamp)s - %(context)s"))
+    chronos_logger.addHandler(handler)
+    return chronos_logger
+
+
+class UsageFlushJob:
+    """Writes UsageLedger.flush() to a ChronosLogger every interval seconds on a daemon thread."""
+
+    def __init__(self, ledger, chronos_logger, interval=60.0):
+        self.ledger = ledger
+        self.chronos_logger = chronos_logger
+        self.interval = interval
+        self.logger = logging.getLogger("usage_ledger")
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="usage-flush", daemon=True)
+        self._thread.start()
+        return self
+
+    def flush(self):
+        rows = self.ledger.flush()
+        for row in rows:
+            self.chronos_logger.info("Token usage", context=row)
+        return len(rows)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.error(f"Token usage flush failed: {e}")
+
+    def stop(self, timeout=None):
+        """
+        Stops the job, flushes whatever was recorded since the last interval and
+        waits until the ChronosLogger has written it out.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+        if hasattr(self.chronos_logger, "wait"):
+            self.chronos_logger.wait()  # Its queue is drained by a daemon thread that dies with the process
@@ -3,15 +3,26 @@ from google import genai
 from google.genai import types
 import os
 from dotenv import load_dotenv
+from usage_ledger import usage_tags
+from cancellation import RequestCancelled
+from deadlines import DeadlineExceeded, check_deadline, time_left
 
 class VertexAIClient:
-    def __init__(self, project, location, model="gemini-2.0-flash-001"):
+    def __init__(self, project, location, model="gemini-2.0-flash-001", ledger=None):
+        """
+        Args:
+            ledger: Optional UsageLedger that receives the token counts
+                reported in each response stream's usage metadata.
+        """
         self.project = project
         self.location = location
         self.model = model
+        self.ledger = ledger
+        self.cancelled_streams = 0  # Streams closed early because their request was cancelled
+        self.timed_out_streams = 0  # Streams closed early because their request's deadline passed
         self.client = genai.Client(vertexai=True, project=self.project, location=self.location)
 
-    def generate_response(self, user_input, system_instruction):
+    def _build_request(self, user_input, system_instruction, max_output_tokens=None, deadline=None):
         contents = [
             types.Content(
                 role="user",
@@ -21,7 +32,7 @@ class VertexAIClient:
         config = types.GenerateContentConfig(
             temperature=1,
             top_p=0.95,
-            max_output_tokens=8192,
+            max_output_tokens=max_output_tokens or 8192,
             response_modalities=["TEXT"],
             safety_settings=[
                 types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="BLOCK_NONE"),
@@ -31,21 +42,128 @@ class VertexAIClient:
             ],
             system_instruction=[types.Part.from_text(text=system_instruction)],
         )
+        if deadline is not None:
+            # Bound the HTTP call by what is left of the request's budget.
+            config.http_options = types.HttpOptions(timeout=max(1, int(time_left(deadline) * 1000)))
+        return contents, config
+
+    def _record_usage(self, usage, model, user_input, usage_tags):
+        # Usage metadata is cumulative; the last chunk that carries it has the final counts.
+        if self.ledger is None or usage is None:
+            return
+        tags = usage_tags or {}
+        self.ledger.record(
+            tags.get("user_id"), tags.get("module"), model,
+            prompt_tokens=usage.prompt_token_count,
+            completion_tokens=usage.candidates_token_count,
+            total_tokens=usage.total_token_count,
+            prompt=user_input,
+        )
+
+    def _check_cancelled(self, cancel_token):
+        if cancel_token is not None and cancel_token.cancelled:
+            self.cancelled_streams += 1
+            raise RequestCancelled(cancel_token.reason)
+
+    def _check_deadline(self, deadline):
+        try:
+            check_deadline(deadline, "vertex_ai")
+        except DeadlineExceeded:
+            self.timed_out_streams += 1
+            raise
+
+    def generate_response(self, user_input, system_instruction, model=None, max_output_tokens=None, usage_tags=None,
+                          cancel_token=None, deadline=None):
+        """
+        Streams response text. With a cancel_token, the token is checked before
+        the request and after every chunk; once it is cancelled the upstream
+        stream is closed and RequestCancelled is raised. A deadline
+        (time.monotonic()) caps the HTTP timeout and is checked the same way,
+        raising DeadlineExceeded.
+        """
+        contents, config = self._build_request(user_input, system_instruction, max_output_tokens, deadline)
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        self._check_deadline(deadline)
 
         response_chunks = self.client.models.generate_content_stream(
-            model=self.model, contents=contents, config=config
+            model=model or self.model, contents=contents, config=config
+        )
+
+        usage = None
+        try:
+            for chunk in response_chunks:
+                self._check_cancelled(cancel_token)
+                self._check_deadline(deadline)
+                if chunk.usage_metadata is not None:
+                    usage = chunk.usage_metadata
+                if chunk.text:
+                    yield chunk.text
+        finally:
+            # Close explicitly so an abandoned stream releases its connection now, not at garbage collection.
+            if hasattr(response_chunks, "close"):
+                response_chunks.close()
+            self._record_usage(usage, model or self.model, user_input, usage_tags)
+
+    async def generate_response_async(self, user_input, system_instruction, model=None, max_output_tokens=None,
+                                      usage_tags=None, cancel_token=None, deadline=None):
+        """Non-blocking variant of generate_response for the ASGI server."""
+        contents, config = self._build_request(user_input, system_instruction, max_output_tokens, deadline)
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        self._check_deadline(deadline)
+
+        response_chunks = await self.client.aio.models.generate_content_stream(
+            model=model or self.model, contents=contents, config=config
         )
 
-        for chunk in response_chunks:
-            yield chunk.text
+        usage = None
+        try:
+            async for chunk in response_chunks:
+                self._check_cancelled(cancel_token)
+                self._check_deadline(deadline)
+                if chunk.usage_metadata is not None:
+                    usage = chunk.usage_metadata
+                if chunk.text:
+                    yield chunk.text
+        finally:
+            if hasattr(response_chunks, "aclose"):
+                await response_chunks.aclose()
+            self._record_usage(usage, model or self.model, user_input, usage_tags)
+
+    def stream_message(self, message, context):
+        user_input = message.get("content")
+        system_instruction = context.get("system_instruction")
+        if not user_input:
+            yield "Error: No user input provided."
+            return
+
+        for text in self.generate_response(user_input, system_instruction, usage_tags=usage_tags(message),
+                                           cancel_token=message.get("cancel_token"),
+                                           deadline=message.get("deadline")):
+            yield text
 
     def handle_message(self, message, context):
+        responses = ""
+        for text in self.stream_message(message, context):
+            responses += text
+        return responses
+
+    async def stream_message_async(self, message, context):
         user_input = message.get("content")
         system_instruction = context.get("system_instruction")
         if not user_input:
-            return "Error: No user input provided."
+            yield "Error: No user input provided."
+            return
+
+        async for text in self.generate_response_async(user_input, system_instruction,
+                                                       usage_tags=usage_tags(message),
+                                                       cancel_token=message.get("cancel_token"),
+                                                       deadline=message.get("deadline")):
+            yield text
 
+    async def handle_message_async(self, message, context):
         responses = ""
-        for text in self.generate_response(user_input, system_instruction):
+        async for text in self.stream_message_async(message, context):
             responses += text
-        return responses
\ No newline at end of file
+        return responses